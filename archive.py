@@ -0,0 +1,146 @@
+import os
+import os.path
+import shutil
+import tarfile
+import tempfile
+import subprocess
+from distutils.spawn import find_executable
+
+import logging
+logger = logging.getLogger("builder")
+
+class ArchiveError(Exception): pass
+
+## Tarball suffixes -> (tarfile compression, parallel decoders, other decoders)
+## Decoders are tried in order; tarfile itself is the last resort.
+CODECS = [
+    ((".tar.gz", ".tgz"),           "gz",   [ [ "pigz", "-dc" ] ],
+                                            [ [ "gzip", "-dc" ] ]),
+    ((".tar.bz2", ".tbz2", ".tbz"), "bz2",  [ [ "lbzip2", "-dc" ], [ "pbzip2", "-dc" ] ],
+                                            [ [ "bzip2", "-dc" ] ]),
+    ((".tar.xz", ".txz"),           None,   [ [ "pixz", "-d" ], [ "xz", "-dc", "-T0" ] ],
+                                            [ [ "xz", "-dc" ] ]),
+    ((".tar.zst", ".tzst"),         None,   [ [ "zstd", "-dc", "-T0" ] ],
+                                            [ [ "zstd", "-dc" ] ]),
+    ((".tar", ),                    "",     [], []),
+]
+
+
+################################################################################
+def getCodec(filename):
+    for suffixes, compression, parallel, single in CODECS:
+        for suffix in suffixes:
+            if filename.endswith(suffix):
+                return compression, parallel + single
+    raise ArchiveError("Unknown archive format: %s" % (filename, ))
+
+################################################################################
+def _safeName(name, strip):
+    """
+
+    Member name with `strip` leading components removed, or None if
+    it is empty or would land outside of the destination.
+    """
+    parts = [ part for part in name.split("/") if part and part != "." ]
+    parts = parts[strip:]
+    if not parts or os.pardir in parts or name.startswith("/"):
+        return None
+    return "/".join(parts)
+
+################################################################################
+def _safeLink(member, name):
+    """
+
+    Links must point inside of the extracted tree.
+    """
+    if member.issym():
+        target = os.path.normpath(os.path.join(os.path.dirname(name), member.linkname))
+    else:
+        target = os.path.normpath(member.linkname)
+    return not os.path.isabs(member.linkname) and not target.startswith(os.pardir)
+
+################################################################################
+def _extractMembers(archive, directory, strip):
+    names = []
+    for member in archive:
+        name = _safeName(member.name, strip)
+        if name is None:
+            if member.name.strip("./"):
+                logger.warning("Skipping unsafe archive member %s" % (member.name, ))
+            continue
+        if member.islnk():
+            linkname = _safeName(member.linkname, strip)
+            if linkname is None:
+                logger.warning("Skipping unsafe hard link %s -> %s" % (member.name, member.linkname))
+                continue
+            member.linkname = linkname
+        if (member.issym() or member.islnk()) and not _safeLink(member, name):
+            logger.warning("Skipping unsafe link %s -> %s" % (member.name, member.linkname))
+            continue
+        member.name = name
+        archive.extract(member, directory)
+        if not member.isdir():
+            names.append(name)
+    return names
+
+################################################################################
+def extract(filename, destination, strip = None):
+    """
+
+    Extract a tarball to `destination`, which must not exist.
+
+    The archive is streamed through a (parallel if available) decoder
+    process, or decoded by tarfile itself, into a temporary directory
+    renamed to `destination` once complete: `destination` is either
+    missing or complete.
+
+    `strip` leading path components are removed from every member.
+    By default, the top-level directory is removed if it is the only one.
+    Returns the extracted files, relative to `destination`.
+    """
+    compression, decoders = getCodec(filename)
+    if os.path.exists(destination):
+        raise ArchiveError("%s already exists" % (destination, ))
+
+    parent = os.path.dirname(os.path.abspath(destination))
+    tmpdir = tempfile.mkdtemp(prefix = ".extract-", dir = parent)
+    try:
+        decoder = None
+        for command in decoders:
+            if find_executable(command[0]):
+                decoder = command + [ filename ]
+                break
+
+        if decoder:
+            logger.info("Extracting %s with %s" % (filename, decoder[0]))
+            p = subprocess.Popen(decoder, stdout = subprocess.PIPE, close_fds = True)
+            try:
+                archive = tarfile.open(fileobj = p.stdout, mode = "r|")
+                names = _extractMembers(archive, tmpdir, strip or 0)
+                archive.close()
+            finally:
+                p.stdout.close()
+                exit_code = p.wait()
+            if exit_code != 0:
+                raise ArchiveError("%s failed on %s (exit code %s)" % (decoder[0], filename, exit_code))
+        elif compression is not None:
+            archive = tarfile.open(filename, mode = "r|%s" % (compression, ))
+            try:
+                names = _extractMembers(archive, tmpdir, strip or 0)
+            finally:
+                archive.close()
+        else:
+            raise ArchiveError("No decoder found for %s (tried %s)" % (
+                filename, ", ".join([ command[0] for command in decoders ])))
+
+        root = tmpdir
+        entries = os.listdir(tmpdir)
+        if strip is None and len(entries) == 1 and os.path.isdir(os.path.join(tmpdir, entries[0])):
+            root = os.path.join(tmpdir, entries[0])
+            names = [ name.split("/", 1)[1] for name in names if "/" in name ]
+        os.rename(root, destination)
+    except (tarfile.TarError, EnvironmentError), err:
+        raise ArchiveError("Unable to extract %s: %s" % (filename, err))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors = True)
+    return names
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+"""
+
+Overhead of the builder itself, on synthetic packages: tiny fake autotools
+packages (a configure script writing a Makefile), in local tarballs, with
+dependency graphs of various shapes. Everything is offline.
+
+    python benchmark.py [--shapes chain,fan,diamond] [--sizes 50,200]
+                        [--jobs 4] [--work 0] [--repeat 1]
+                        [--json FILE] [--compare FILE]
+
+Each case runs in a child process (peak memory is the one of the case) and
+builds everything twice: a full build, then a null build (all up to date).
+Measured:
+
+    wall        full build, from Builder.build() to its return
+    null        null build: the cost of finding there is nothing to do
+    plan        planning time of the full build
+    path        critical path of the packages (recorded durations, but
+                the phases overlapped with builds: fetch and extract)
+    eff         scheduling efficiency: the ideal wall time (the critical
+                path, or the package time over the jobs if longer) over
+                the wall time
+    ovh/pkg     what the build took beyond the ideal, per package
+    saves       writes of the stamp manifest (and KB written)
+    rss         peak RSS of the builder process, in MB
+
+--work gives the packages something to do (seconds of sleep in their
+build); with the default 0, the build time is nearly all overhead.
+--repeat runs every case several times, keeping the fastest run: less
+noise from the host.
+--json saves the results, --compare shows the changes from saved ones
+and exits with 1 if some wall, null or overhead time got more than 10%
+(and 50 ms) worse.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tarfile
+import tempfile
+import resource
+import StringIO
+import subprocess
+
+from util import writeJSON
+
+import logging
+
+## Phases done while others build (see Scheduler.run()): not on the critical path
+OVERLAPPED = ("fetch", "extract", "prepare", "plan")
+
+## Slower than the baseline by more than both: a regression
+REGRESSION_RATIO = 1.10
+REGRESSION_MIN = 0.05
+
+CONFIGURE = """#!/bin/sh
+prefix=/usr/local
+for arg in "$@"; do case $arg in --prefix=*) prefix=${arg#--prefix=};; esac; done
+echo "checking whether we are a benchmark... yes"
+sed "s|@PREFIX@|$prefix|" "$(dirname "$0")/Makefile.in" > Makefile
+"""
+
+MAKEFILE = """PREFIX=@PREFIX@
+all:
+\t%(work)s
+install:
+\tmkdir -p $(DESTDIR)$(PREFIX)/share/benchmark
+\techo %(name)s > $(DESTDIR)$(PREFIX)/share/benchmark/%(name)s
+"""
+
+
+################################################################################
+def getGraph(shape, size):
+    """
+
+    [ (name, [ dependencies ]) ] of `size` packages:
+
+        chain       each package depends on the previous one
+        fan         one root, all the others depending on it, and a last
+                    one depending on all of them
+        diamond     layers of 1 and 2 packages, alternately, each package
+                    depending on all those of the previous layer
+    """
+    names = [ "pkg%04d" % (index, ) for index in range(size) ]
+    if shape == "chain":
+        return [ (name, names[index-1:index]) for index, name in enumerate(names) ]
+    if shape == "fan":
+        graph = [ (names[0], []) ]
+        graph.extend([ (name, [ names[0] ]) for name in names[1:-1] ])
+        if size > 1:
+            graph.append((names[-1], names[1:-1] or [ names[0] ]))
+        return graph
+    if shape == "diamond":
+        graph = []
+        previous = []
+        index = 0
+        while index < size:
+            if len(previous) == 1:
+                layer = names[index:index + 2]
+            else:
+                layer = names[index:index + 1]
+            graph.extend([ (name, previous) for name in layer ])
+            previous = layer
+            index += len(layer)
+        return graph
+    raise ValueError("Unknown shape %s" % (shape, ))
+
+################################################################################
+def makePackage(distfiles, name, work):
+    """
+
+    Write the tarball of the fake package `name` in `distfiles`.
+    """
+    files = { "configure"   : (CONFIGURE, 0755),
+              "Makefile.in" : (MAKEFILE % { "name" : name, "work" : work and "sleep %s" % (work, ) or "@true" }, 0644) }
+    archive = tarfile.open(os.path.join(distfiles, "%s-1.0.tar.gz" % (name, )), "w:gz")
+    try:
+        for filename, (content, mode) in sorted(files.items()):
+            info = tarfile.TarInfo("%s-1.0/%s" % (name, filename))
+            info.size = len(content)
+            info.mode = mode
+            info.mtime = time.time()
+            archive.addfile(info, StringIO.StringIO(content))
+    finally:
+        archive.close()
+
+################################################################################
+def runCase(shape, size, jobs, work):
+    """
+
+    Build one case in a scratch directory; returns its measures.
+    Runs in the child process.
+    """
+    directory = tempfile.mkdtemp(prefix = "benchmark-")
+    try:
+        distfiles = os.path.join(directory, "distfiles")
+        os.mkdir(distfiles)
+        graph = getGraph(shape, size)
+        for name, dependencies in graph:
+            makePackage(distfiles, name, work)
+
+        import config
+        config.PREFIX = os.path.join(directory, "prefix")
+        config.JOBS = jobs
+        config.MIRROR = []
+        config.CLARILAB_MIRROR = []
+        config.VERBOSE = False
+        config.DASHBOARD = False
+        config.CCACHE = False
+        config.CONFIGURE_CACHE = False
+        config.DISTFILE_STORE = None
+        config.SCRATCH = None
+        config.MEMORY = False
+        config.EXPORT_PACKAGES = False
+        config.IMPORT_PACKAGES = False
+
+        from builder import Builder
+        from buildobj import AbstractBuildObject
+        from manifest import Manifest
+
+        ## The builder talks a lot: only our results go to stdout
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        try:
+            builder = Builder(os.path.join(directory, "buildroot"), distfiles, artifacts = False)
+            AbstractBuildObject.setBuilder(builder)
+            start = time.time()
+            objects = Manifest([ { "class" : "SimpleBuildObject", "name" : name, "version" : "1.0",
+                                   "filename" : "%s-1.0.tar.gz" % (name, ), "dependencies" : dependencies }
+                                 for name, dependencies in graph ]).materialise()
+            materialise = time.time() - start
+
+            start = time.time()
+            builder.build("all")
+            wall = time.time() - start
+            profiler = builder.profiler
+            saves, written = builder.stamps.saves, builder.stamps.written
+
+            start = time.time()
+            builder.build("all")
+            null = time.time() - start
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+        totals = profiler.getTotals(OVERLAPPED)
+        packageTime = sum([ total[0] for total in totals.values() ])
+        path, chain = profiler.getCriticalPath(objects, builder.getDependencies, OVERLAPPED)
+        ideal = max(path, packageTime / jobs)
+        return { "shape"        : shape,
+                 "size"         : size,
+                 "jobs"         : jobs,
+                 "work"         : work,
+                 "materialise"  : materialise,
+                 "wall"         : wall,
+                 "null"         : null,
+                 "plan"         : sum([ span.getDuration() for span in profiler.spans if span.phase == "plan" ]),
+                 "path"         : path,
+                 "ideal"        : ideal,
+                 "efficiency"   : wall and ideal / wall or 1.0,
+                 "overhead"     : max(0.0, wall - ideal) / size,
+                 "commands"     : sum([ span.commands for span in profiler.spans ]),
+                 "saves"        : saves,
+                 "written"      : written,
+                 "maxrss"       : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0 }
+    finally:
+        shutil.rmtree(directory, ignore_errors = True)
+
+################################################################################
+def spawnCase(shape, size, jobs, work):
+    """
+
+    Run a case in a child process: its own memory, and a fresh builder.
+    """
+    child = subprocess.Popen([ sys.executable, os.path.abspath(__file__), "--case",
+                               "%s:%d:%d:%s" % (shape, size, jobs, work) ],
+                             stdout = subprocess.PIPE)
+    output = child.communicate()[0]
+    if child.returncode != 0:
+        raise RuntimeError("The %s %d case failed (exit code %d)" % (shape, size, child.returncode))
+    return json.loads(output.strip().split("\n")[-1])
+
+################################################################################
+def getKey(result):
+    return "%(shape)s:%(size)d:%(jobs)d:%(work)s" % result
+
+################################################################################
+def formatResults(results, baseline = None):
+    """
+
+    Table of `results`, with the changes from `baseline` ({key: result}).
+    """
+    lines = [ "%-8s %5s %4s %8s %8s %7s %8s %5s %9s %13s %7s" % (
+        "shape", "size", "jobs", "wall", "null", "plan", "path", "eff", "ovh/pkg", "saves (KB)", "rss") ]
+    for result in results:
+        lines.append("%-8s %5d %4d %7.2fs %7.2fs %6.2fs %7.2fs %4.0f%% %7.1fms %6d (%4d) %5.1fMB" % (
+            result["shape"], result["size"], result["jobs"], result["wall"], result["null"], result["plan"],
+            result["path"], 100 * result["efficiency"], 1000 * result["overhead"], result["saves"],
+            result["written"] >> 10, result["maxrss"]))
+        old = baseline and baseline.get(getKey(result))
+        if old:
+            lines.append("%-8s %10s %7s %+7.0f%% %+7.0f%% %+6.0f%% %8s %+4.0f%% %+8.0f%% %+6d %12s %+5.1fMB" % (
+                "", "", "vs base", 100 * (result["wall"] / max(old["wall"], 1e-6) - 1),
+                100 * (result["null"] / max(old["null"], 1e-6) - 1),
+                100 * (result["plan"] / max(old["plan"], 1e-6) - 1), "",
+                100 * (result["efficiency"] - old["efficiency"]),
+                100 * (result["overhead"] / max(old["overhead"], 1e-6) - 1),
+                result["saves"] - old["saves"], "", result["maxrss"] - old["maxrss"]))
+    return "\n".join(lines)
+
+################################################################################
+def getRegressions(results, baseline):
+    """
+
+    Measures of `results` notably worse than in `baseline`.
+    """
+    regressions = []
+    for result in results:
+        old = baseline.get(getKey(result))
+        if not old:
+            continue
+        for measure, scale in (("wall", 1), ("null", 1), ("overhead", result["size"])):
+            if result[measure] > old[measure] * REGRESSION_RATIO and \
+               (result[measure] - old[measure]) * scale > REGRESSION_MIN:
+                regressions.append("%s %s: %.3f -> %.3f" % (getKey(result), measure, old[measure], result[measure]))
+    return regressions
+
+################################################################################
+def getOption(name, default):
+    if name in sys.argv:
+        return sys.argv[sys.argv.index(name)+1]
+    return default
+
+if __name__ == "__main__":
+    logging.basicConfig()
+
+    if "--case" in sys.argv:
+        shape, size, jobs, work = getOption("--case", None).split(":")
+        print json.dumps(runCase(shape, int(size), int(jobs), float(work)))
+        sys.exit(0)
+
+    shapes = getOption("--shapes", "chain,fan,diamond").split(",")
+    sizes = [ int(size) for size in getOption("--sizes", "50,200").split(",") ]
+    jobs = int(getOption("--jobs", "4"))
+    work = float(getOption("--work", "0"))
+    repeat = int(getOption("--repeat", "1"))
+
+    results = []
+    for shape in shapes:
+        for size in sizes:
+            print "Running %s %d (-j%d)..." % (shape, size, jobs)
+            runs = [ spawnCase(shape, size, jobs, work) for run in range(repeat) ]
+            results.append(min(runs, key = lambda result: result["wall"]))
+
+    baseline = None
+    if "--compare" in sys.argv:
+        f = open(getOption("--compare", None), "r")
+        try:
+            baseline = dict([ (getKey(result), result) for result in json.load(f) ])
+        finally:
+            f.close()
+    print formatResults(results, baseline)
+
+    if "--json" in sys.argv:
+        writeJSON(getOption("--json", None), results)
+
+    if baseline:
+        regressions = getRegressions(results, baseline)
+        for regression in regressions:
+            print "REGRESSION %s" % (regression, )
+        if regressions:
+            sys.exit(1)
@@ -1,21 +1,142 @@
 import os
 import os.path
+import time
+import shutil
 import logging
+import threading
+from multiprocessing import cpu_count
 
 import config
+from scheduler import JobServer, Scheduler
+from stampstore import StampStore
+from cache import ArtifactCache
+from fetch import Fetcher
+from distfilestore import DistfileStore
+from profiler import Profiler
+from ccache import CompilerCache
+from configcache import ConfigureCache
+from package import PackageStore, PackageError, listTree, mergeTree, removeFiles, rebaseLinks, getStagedLinks
+from installdb import InstallDB
+from planner import Planner, sortObjects
+from history import History
+from scratch import ScratchSpace, getTreeSize, removeTree
+from events import EventBus, Dashboard
 
 logger = logging.getLogger("builder")
 
 class BuilderException(Exception): pass
 
+## Staging directories of the installs, below the build root
+STAGE_DIRECTORY = ".stage"
+
+## Source path -> lock: variants, and the builders of a matrix, may share
+## their source tree
+_extractLocks = {}
+_extractLock = threading.Lock()
+
+################################################################################
+class DependencyChecks(object):
+    """
+
+    Dependency checks of the current run: (object, phase) pairs whose
+    dependencies are known to have gone through the phase, and the checks
+    in progress in each thread, to find cycles.
+
+    A satisfied check is forgotten as soon as a stamp of the object or
+    of one of its dependencies changes.
+    """
+
+    ############################################################################
+    def __init__(self, resolveDependents):
+        self.resolveDependents = resolveDependents
+        self._satisfied = set()
+        self._lock      = threading.Lock()
+        self._current   = threading.local()
+
+    ############################################################################
+    def isSatisfied(self, obj, phase):
+        return (obj, phase) in self._satisfied
+
+    ############################################################################
+    def setSatisfied(self, obj, phase):
+        self._lock.acquire()
+        try:
+            self._satisfied.add((obj, phase))
+        finally:
+            self._lock.release()
+
+    ############################################################################
+    def forget(self, obj):
+        """
+
+        A stamp of `obj` changed: forget the checks of `obj` and of its
+        dependents, direct or not.
+        """
+        self._lock.acquire()
+        try:
+            if not self._satisfied:
+                return
+            stack = [ obj ]
+            seen = set()
+            while stack:
+                obj = stack.pop()
+                if obj in seen:
+                    continue
+                seen.add(obj)
+                for check in [ check for check in self._satisfied if check[0] is obj ]:
+                    self._satisfied.discard(check)
+                stack.extend(self.resolveDependents(obj))
+        finally:
+            self._lock.release()
+
+    ############################################################################
+    def enter(self, obj, phase):
+        """
+
+        Start checking the dependencies of `obj` for `phase` in this thread.
+        Returns the cycle, as a list of objects, if `obj` is already being
+        checked for this phase, None otherwise.
+        """
+        stack = self._current.__dict__.setdefault("stack", [])
+        if (obj, phase) in stack:
+            cycle = [ other for other, other_phase in stack[stack.index((obj, phase)):] ]
+            return cycle + [ obj ]
+        stack.append((obj, phase))
+        return None
+
+    ############################################################################
+    def leave(self, obj, phase):
+        stack = self._current.stack
+        if stack and stack[-1] == (obj, phase):
+            stack.pop()
+
 ################################################################################
 class Builder(object):
     ############################################################################
-    def __init__(self, buildroot, distfiles):
+    def __init__(self, buildroot, distfiles, jobs = None, artifacts = None, packages = None,
+                       target = None, jobserver = None, sources = None, dashboard = None):
         self.builds = []
 
+        ## (name, variant) -> object, and name -> [ objects ]
+        self._registry      = {}
+        self._names         = {}
+        ## object -> [ objects ], computed on first use
+        self._dependencies  = None
+        self._dependents    = None
+
         self.buildroot = buildroot
         self.distfiles = distfiles
+        ## Where the sources are extracted: out of tree, several build
+        ## roots may share them
+        self.sources = sources or buildroot
+        ## Budget shared with the other builders of a matrix, if any
+        self.jobserver = jobserver or JobServer(jobs or config.JOBS or cpu_count())
+        ## matrix.Target we build for, None for the config one
+        self.target = target
+        if target:
+            self.prefix = target.prefix
+        else:
+            self.prefix = config.PREFIX
         
         ## Check
         if not os.path.isdir(buildroot):
@@ -32,112 +153,781 @@ class Builder(object):
                 print "%s does not exists or is not a directory." % (distfiles)
                 raise BuilderException
 
+        self._environment = None
+        self.checks = DependencyChecks(self.getDependents)
+        self.stamps = StampStore(os.path.join(buildroot, ".stamps.json"))
+        if config.DISTFILE_STORE:
+            self.distfileStore = DistfileStore(config.DISTFILE_STORE)
+        else:
+            self.distfileStore = None
+        self.fetcher = Fetcher(distfiles, store = self.distfileStore)
+        self.profiler = Profiler()
+        self.events = EventBus()
+        self.fetcher.events = self.events
+        ## events.Dashboard, shared by the builders of a matrix if given
+        self._dashboard = dashboard
+        if dashboard:
+            self.subscribe(dashboard.forTarget(target and target.name))
+        ## Objects of the current run -> start time, and those done
+        self._started = {}
+        self._finished = set()
+        self.history = History(os.path.join(buildroot, ".history.json"))
+        if config.SCRATCH:
+            self.scratch = ScratchSpace(config.SCRATCH, buildroot, config.SCRATCH_RESERVE << 20)
+        else:
+            self.scratch = None
+        self._rebuilt = set()
+        self.compilerCache = CompilerCache.create(distfiles)
+        ## name -> (hits, misses) of the compiler cache, for this run
+        self.compilerStats = {}
+
+        ## Shared configure cache, next to the distfiles by default
+        configureCache = config.CONFIGURE_CACHE
+        if configureCache is None:
+            configureCache = os.path.join(os.path.dirname(os.path.abspath(distfiles)), "configcache")
+        if configureCache:
+            self.configureCache = ConfigureCache(configureCache)
+        else:
+            self.configureCache = None
+        ## name -> (cached checks, checks, duration, uncached duration) for this run
+        self.configureStats = {}
+
+        ## Build cache, next to the distfiles by default
+        if artifacts is None:
+            artifacts = config.ARTIFACTS
+        if artifacts is None:
+            artifacts = os.path.join(os.path.dirname(os.path.abspath(distfiles)), "artifacts")
+        if artifacts:
+            self.cache = ArtifactCache(artifacts)
+        else:
+            self.cache = None
+        ## Installs are staged, concurrently; their merges into the prefix
+        ## are serialized (see mergeObject()).
+        self._installLock = threading.Lock()
+        ## Owners of the files of the prefix
+        self.installed = InstallDB(os.path.join(self.prefix, ".installed.json"))
+
+        ## Binary packages, exported and/or imported
+        if packages is None:
+            packages = config.PACKAGES
+        if packages is None:
+            packages = os.path.join(os.path.dirname(os.path.abspath(distfiles)), "packages")
+        if config.EXPORT_PACKAGES or config.IMPORT_PACKAGES:
+            self.packages = PackageStore(packages)
+        else:
+            self.packages = None
+
     ############################################################################
-    def setEnvironnement(self):
+    def subscribe(self, callback):
         """
 
-        config.PREFIX/lib must be in LD_LIBRARY_PATH
-        config.PREFIX/bin must be in PATH
+        Call `callback(event)` for every build event (see events.Event),
+        from another thread: callbacks never slow the build down.
         """
+        self.events.subscribe(callback)
 
-        env_path            = os.getenv("PATH")
-        env_library_path    = os.getenv("LD_LIBRARY_PATH")
-        ldflags             = os.getenv("LDFLAGS")
-        cflags              = os.getenv("CFLAGS")
-        
-        if ldflags:
-            os.environ["LDFLAGS"] = "%s -L%s" % (ldflags, os.path.join(config.PREFIX, "lib"))
-        else:
-            os.environ["LDFLAGS"] ="-L%s" % (os.path.join(config.PREFIX, "lib"))
+    ############################################################################
+    def unsubscribe(self, callback):
+        self.events.unsubscribe(callback)
 
-        if cflags:
-            os.environ["CFLAGS"] = "%s -L%s" % (ldflags, os.path.join(config.PREFIX, "include"))
-        else:
-            os.environ["CFLAGS"] = "-I%s" % (os.path.join(config.PREFIX, "include"))
+    ############################################################################
+    def getETA(self, objects):
+        """
 
-        if env_path and ":" in env_path:
-            if not os.path.join(config.PREFIX, "bin") in env_path:
-                newpath = "%s:%s" % (os.path.join(config.PREFIX, "bin"), env_path)
-                logger.info("Setting up new environnement variable PATH: %s" % (newpath))
-                os.environ["PATH"] = newpath
-        else:
-            newpath = "%s:%s" % (os.path.join(config.PREFIX, "bin"), env_path)
-            logger.info("Setting up new environnement variable PATH: %s" % (newpath))
-            os.environ["PATH"] = newpath
-
-        if env_library_path and ":" in env_path:
-            if not os.path.join(config.PREFIX, "lib") in env_library_path:
-                newpath = "%s:%s" % (os.path.join(config.PREFIX, "lib"), env_library_path)
-                logger.info("Setting up new environnement variable LD_LIBRARY_PATH: %s" % (newpath))
-                os.environ["LD_LIBRARY_PATH"] = newpath
-        else:
-            newpath = "%s:%s" % (os.path.join(config.PREFIX, "lib"), env_library_path)
-            logger.info("Setting up new environnement variable LD_LIBRARY_PATH: %s" % (newpath))
-            os.environ["LD_LIBRARY_PATH"] = newpath
-         
-        os.putenv("PATH", os.environ["PATH"])
-        os.putenv("LD_LIBRARY_PATH", os.environ["LD_LIBRARY_PATH"])
-        os.putenv("CFLAGS", os.environ["CFLAGS"])
-        os.putenv("LDFLAGS", os.environ["LDFLAGS"])
+        Expected remaining seconds to build `objects`, from the history:
+        the longest remaining chain, or the remaining work spread over the
+        job budget if longer. None if nothing is known.
+        """
+        remaining = [ obj for obj in objects if obj not in self._finished ]
+        durations = {}
+        for obj in remaining:
+            durations[obj] = self.history.getDuration(obj)
+        known = [ duration for duration in durations.values() if duration is not None ]
+        if not known and remaining:
+            return None
+        average = known and sum(known) / len(known) or 0.0
+        now = time.time()
+        for obj in remaining:
+            duration = durations[obj]
+            if duration is None:
+                duration = average
+            if obj in self._started:
+                duration = max(0.0, duration - (now - self._started[obj]))
+            durations[obj] = duration
+
+        ## Dependencies first
+        chains = {}
+        for obj in sortObjects(remaining, self.getDependencies):
+            chains[obj] = durations[obj] + max([ 0.0 ] + [ chains.get(dep, 0.0) for dep in self.getDependencies(obj)
+                                                           if dep in durations ])
+        chain = max([ 0.0 ] + chains.values())
+        return max(chain, sum(durations.values()) / self.jobserver.jobs)
+
+    ############################################################################
+    def getEnvironment(self):
+        """
+
+        Environment every command starts from: ours, when first asked, with
+        config.PATH if set. Never modified afterwards: build objects compose
+        their own on top of it, see AbstractBuildObject.getEnvironment().
+        """
+        if self._environment is None:
+            environment = dict(os.environ)
+            if config.PATH:
+                environment["PATH"] = config.PATH
+            if self.target:
+                environment.update(self.target.getEnvironment())
+            self._environment = environment
+        return self._environment
+
+    ############################################################################
+    def getCC(self):
+        return self.target and self.target.cc or config.CC
+
+    ############################################################################
+    def getPythonBin(self):
+        return self.target and self.target.python or config.PYTHON_BIN
+
+    ############################################################################
+    def getTargetInputs(self):
+        """
+
+        What our target changes in the installed files, for the cache keys.
+        """
+        if not self.target:
+            return []
+        return [ sorted(self.target.getEnvironment().items()) ]
 
     ############################################################################
     def register(self, buildObject):
+        """
+
+        Objects are registered by name and variant: two objects sharing
+        a name need different variants (eg. builddir).
+        """
+        key = (buildObject.name, buildObject.variant)
+        if key in self._registry:
+            raise BuilderException("%s is already registered (%s): give it another variant." % (
+                buildObject.getQualifiedName(), self._registry[key]))
+
         self.builds.append(buildObject)
+        self._registry[key] = buildObject
+        self._names.setdefault(buildObject.name, []).append(buildObject)
+        self._dependencies = None
+        self._dependents   = None
 
     ############################################################################
-    def getObject(self, object_name):
+    def getObject(self, object_name, variant = None):
+        """
+
+        Lookup an object by name. `object_name` can be qualified
+        by its variant: "Imaging:Sane".
+        """
+        if variant is None and ":" in object_name:
+            object_name, variant = object_name.split(":", 1)
+        return self._registry.get((object_name, variant))
+
+    ############################################################################
+    def findObjects(self, project):
+        """
+
+        All the variants registered under a name, or a single object
+        if `project` is qualified.
+        """
+        if ":" in project:
+            obj = self.getObject(project)
+            return obj and [ obj ] or []
+        return list(self._names.get(project, []))
+
+    ############################################################################
+    def _index(self):
+        if self._dependencies is not None:
+            return
+        dependencies = {}
+        dependents = {}
         for obj in self.builds:
-            if obj.name == object_name:
-                return obj
-        return None
+            dependents.setdefault(obj, [])
+        for obj in self.builds:
+            dependencies[obj] = []
+            for name in obj.dependencies:
+                dep = self.getObject(name)
+                if dep is not None and dep is not obj:
+                    dependencies[obj].append(dep)
+                    dependents[dep].append(obj)
+        self._dependencies = dependencies
+        self._dependents = dependents
+
+    ############################################################################
+    def getDependencies(self, obj):
+        """
+
+        Registered objects `obj` depends on (unknown ones are skipped,
+        check_dependencies() reports them).
+        """
+        self._index()
+        return self._dependencies[obj]
 
     ############################################################################
-    def build(self, project = "all"):
+    def getDependents(self, obj):
+        """
+
+        Registered objects directly depending on `obj`.
+        """
+        self._index()
+        return self._dependents[obj]
+
+    ############################################################################
+    def getClosure(self, objects):
+        """
+
+        `objects` and all their dependencies, in registration order.
+        """
+        closure = set()
+        stack = list(objects)
+        while stack:
+            obj = stack.pop()
+            if obj in closure:
+                continue
+            closure.add(obj)
+            stack.extend(self.getDependencies(obj))
+        return [ obj for obj in self.builds if obj in closure ]
+
+    ############################################################################
+    def getRebuiltDependencies(self, obj, rebuilt):
+        """
+
+        The dependencies of `obj` among `rebuilt` (objects whose build phase
+        runs): `obj` must be built again. The rule of both buildObject() and
+        the planner.
+        """
+        return [ dep for dep in self.getDependencies(obj) if dep in rebuilt ]
+
+    ############################################################################
+    def isCacheable(self, obj):
+        """
+
+        Objects built from locally modified sources, or depending on one,
+        can't be restored from nor stored into the build cache: their keys
+        don't tell the whole story.
+        """
+        for dep in self.getClosure([ obj ]):
+            if dep.isModified():
+                return False
+        return True
+
+    ############################################################################
+    def getStagePath(self, obj):
+        return os.path.join(self.buildroot, STAGE_DIRECTORY, obj.getPathName())
+
+    ############################################################################
+    def mergeObject(self, obj, root, files, key):
+        """
+
+        Move the staged `files` of `obj` (relative to `root`, its staged
+        prefix) into the prefix, atomically (see package.mergeTree()),
+        and mark it installed. Files of the previous install of `obj`
+        that it doesn't install anymore are removed: an upgrade.
+
+        Installing a file owned by another package is a conflict, see
+        config.INSTALL_CONFLICTS. Links into a staging directory (from
+        the cache or packages of installs before rebaseLinks()) are refused.
+        """
+        name = obj.getQualifiedName()
+        staged = getStagedLinks(root, files, STAGE_DIRECTORY)
+        if staged:
+            raise BuilderException("%s has %d links into its staging directory: %s" % (
+                obj, len(staged), ", ".join([ "%s -> %s" % link for link in staged[:5] ])))
+        self._installLock.acquire()
+        try:
+            conflicts = self.installed.getConflicts(name, files)
+            if conflicts:
+                message = "%s overwrites %d files of other packages: %s" % (
+                    obj, len(conflicts), ", ".join([ "%s (%s)" % conflict for conflict in conflicts[:5] ]))
+                if config.INSTALL_CONFLICTS == "error":
+                    raise BuilderException(message)
+                logger.warning(message)
+            try:
+                self._runPhase(obj, "merge", mergeTree, root, self.prefix, files)
+            except (OSError, IOError, PackageError), err:
+                raise BuilderException("Unable to merge %s into %s: %s" % (obj, self.prefix, err))
+            stale = self.installed.record(name, obj.version, key, files)
+            if stale:
+                print " -> %d files of the previous install removed" % (len(stale))
+                removeFiles(self.prefix, stale)
+            obj._setInstallOk()
+        finally:
+            self._installLock.release()
+
+    ############################################################################
+    def installObject(self, obj, key):
+        """
+
+        Install `obj` into a staging directory (concurrently with other
+        installs), then merge it into the prefix. The staged files are
+        exported as a binary package and stored into the build cache too.
+
+        An install leaving the stage empty fails: it ignores the staging
+        directory (and may have written into the prefix).
+        """
+        stage = self.getStagePath(obj)
+        shutil.rmtree(stage, ignore_errors = True)
+        try:
+            ## File times lag behind time.time()
+            started = time.time() - 1
+            self._runPhase(obj, "install", obj.install, stage)
+            root = os.path.join(stage, self.prefix.lstrip(os.sep))
+            files = listTree(root)
+            if not files:
+                database = os.path.relpath(self.installed.filename, self.prefix)
+                touched = [ path for path in listTree(self.prefix)
+                            if path != database and self.installed.getOwner(path) is None
+                            and os.lstat(os.path.join(self.prefix, path)).st_mtime >= started ]
+                if touched:
+                    raise BuilderException("%s installed into %s instead of %s: %s" % (
+                        obj, self.prefix, stage, ", ".join(touched[:5])))
+                raise BuilderException("%s installed nothing into %s" % (obj, stage))
+            try:
+                rebased = rebaseLinks(root, files, stage)
+            except PackageError, err:
+                raise BuilderException("Unable to install %s: %s" % (obj, err))
+            if rebased:
+                logger.warning("%s links into %s: %s made relative" % (obj, stage, ", ".join(rebased)))
+            cacheable = self.isCacheable(obj)
+            if config.EXPORT_PACKAGES and cacheable:
+                dependencies = [ (dep.getQualifiedName(), dep.getRecordedKey() or dep.getCacheKey())
+                                 for dep in self.getDependencies(obj) ]
+                filename = self._runPhase(obj, "export", self.packages.export, obj, root, files, dependencies)
+                print " -> Exported %s" % (filename)
+            self.mergeObject(obj, root, files, key)
+            if self.cache and cacheable:
+                self.cache.store(key, root, files)
+        finally:
+            shutil.rmtree(stage, ignore_errors = True)
+
+    ############################################################################
+    def restoreObject(self, obj, key):
+        """
+
+        Install `obj` from the build cache, through a staging directory.
+        """
+        stage = self.getStagePath(obj)
+        shutil.rmtree(stage, ignore_errors = True)
+        try:
+            files = self._runPhase(obj, "restore", self.cache.restore, key, stage)
+            self.mergeObject(obj, stage, files, key)
+        finally:
+            shutil.rmtree(stage, ignore_errors = True)
+
+    ############################################################################
+    def importPackage(self, obj, filename):
+        """
+
+        Install the binary package of `obj` instead of building it.
+        """
+        manifest, directory = self._runPhase(obj, "import", self.packages.stage, filename, obj.getPrefix())
+        self.mergeObject(obj, directory, manifest["files"], manifest["key"])
+        print " -> %d files installed from %s" % (len(manifest["files"]), filename)
+        obj._setBuildOk()
+
+    ############################################################################
+    def uninstall(self, obj):
+        """
+
+        Remove the files of `obj` from the prefix (those it owns, see
+        installdb.InstallDB), without touching the other packages.
+        """
+        name = obj.getQualifiedName()
+        dependents = [ dep for dep in self.getDependents(obj) if dep.isInstalled() ]
+        if dependents:
+            logger.warning("%s is needed by %s, still installed" % (obj, ", ".join([ "%s" % (dep) for dep in dependents ])))
+        self._installLock.acquire()
+        try:
+            files = self.installed.remove(name)
+            if not files and obj.isInstalled():
+                logger.warning("No files of %s are known: installed before %s existed?"
+                               % (obj, self.installed.filename))
+            removeFiles(self.prefix, files)
+            obj._setInstallOk(False)
+        finally:
+            self._installLock.release()
+        print "=> %s uninstalled: %d files removed" % (obj, len(files))
+
+    ############################################################################
+    def _runPhase(self, obj, phase, method, *args):
+        """
+
+        Call `method(*args)`, timed as the `phase` of `obj`.
+        Phases returning False failed.
+        """
+        if isinstance(obj, basestring):
+            name = obj
+        else:
+            name = obj.getQualifiedName()
+        span = self.profiler.begin(name, phase)
+        self.events.emit("phase-start", name, phase = phase)
+        ok = False
+        try:
+            result = method(*args)
+            ok = result is not False
+        finally:
+            self.profiler.end(span)
+            self.events.emit("phase-end", name, phase = phase, ok = ok, duration = span.getDuration())
+        if result is False:
+            raise BuilderException("%s: %s failed." % (obj, phase))
+        return result
+
+    ############################################################################
+    def extractObject(self, obj):
+        """
+
+        Extract the tree of `obj` if missing: into the scratch space if
+        it is expected to fit there. Out of tree, the build tree is then
+        made from it.
+
+        Out of tree, a tree built in place is extracted again (the build
+        trees are made from pristine sources); back in place, a pristine
+        tree is made writable.
+        """
+        _extractLock.acquire()
+        try:
+            lock = _extractLocks.setdefault(obj.getSourcePath(), threading.Lock())
+        finally:
+            _extractLock.release()
+        lock.acquire()
+        try:
+            source = obj.getSourcePath()
+            if os.path.isdir(obj.getSourceBuildPath()) and obj.isOutOfTree() != obj.isPristine():
+                if obj.isOutOfTree():
+                    print " -> %s was built in place: extracting it again" % (obj, )
+                    if self.scratch and self.scratch.isPlaced(source):
+                        self.scratch.release(source)
+                    else:
+                        removeTree(source)
+                else:
+                    obj.makeSourcesWritable()
+            if not os.path.isdir(obj.getSourceBuildPath()):
+                destination = None
+                ## Sources shared with other builders are their business too
+                if self.scratch and self.sources == self.buildroot:
+                    size = self.history.getSize(obj)
+                    if size is None:
+                        size = os.path.getsize(os.path.join(self.distfiles, obj.filename)) * config.SCRATCH_EXPANSION
+                    destination = self.scratch.place(obj.getSourcePath(), size)
+                print " -> Extracting %s%s" % (obj, destination and " to %s" % (destination, ) or "")
+                self._runPhase(obj, "extract", obj.extract, destination)
+        finally:
+            lock.release()
+        if not os.path.isdir(obj.getBuildPath()):
+            self._runPhase(obj, "prepare", obj.prepareTree)
+
+    ############################################################################
+    def spillObject(self, obj):
+        """
+
+        Move the tree of `obj` out of the scratch space if memory is tight.
+        """
+        if self.scratch and self.scratch.isPlaced(obj.getSourcePath()) and self.scratch.isTight():
+            self._runPhase(obj, "spill", self.scratch.spill, obj.getSourcePath())
+
+    ############################################################################
+    def releaseObject(self, obj):
+        """
+
+        `obj` is installed: remember the size of its tree, and remove it
+        from the scratch space once every object built from it is installed.
+        """
+        source = obj.getSourcePath()
+        if not self.scratch or not self.scratch.isPlaced(source):
+            return
+        self.history.setSize(obj, getTreeSize(os.readlink(source)))
+        self.scratch.settle(source)
+        if config.SCRATCH_KEEP:
+            return
+        if [ other for other in self.builds if other.getSourcePath() == source and not other.isInstalled() ]:
+            return
+        print " -> Removing the build tree of %s from %s" % (obj, self.scratch.directory)
+        self.scratch.release(source)
+
+    ############################################################################
+    def prepareObject(self, obj, step = None):
+        """
+
+        Fetch the distfiles of `obj`, and extract them if its plan `step`
+        says so: done while other objects build (see Scheduler.run()).
+        """
+        for file in obj.getDistFiles():
+            if not obj.hasDistFile(file):
+                self._runPhase(obj, "fetch", obj.getDistFile, file)
+        if step and "extract" in step.phases and not os.path.isdir(obj.getBuildPath()):
+            self.extractObject(obj)
+
+    ############################################################################
+    def runObject(self, obj, jobs, jobserver, objects):
+        """
+
+        buildObject(), reporting the progress of the build of `objects`.
+        """
+        self._started[obj] = time.time()
+        self.buildObject(obj, jobs, jobserver)
+        self._finished.add(obj)
+        self.events.emit("progress", obj.getQualifiedName(), done = len(self._finished), total = len(objects),
+                         eta = self.getETA(objects))
+
+    ############################################################################
+    def buildObject(self, obj, jobs = None, jobserver = None):
+        """
+
+        Fetch, extract, patch, configure, build and install one object,
+        using at most `jobs` parallel make jobs, or with a `jobserver`, as
+        many as it gives (see scheduler.JobServer).
+        """
+        obj.jobs = jobs
+        obj.jobserver = jobserver
+        print "=> Building %s (%s)" % (obj, jobserver and "jobserver" or "-j%s" % (jobs, ))
+
+        if not obj.hasDistFile():
+            print " -> Getting distfile..."
+            self._runPhase(obj, "fetch", obj.getDistFile)
+        if obj.patchfile and not obj.hasDistFile(obj.patchfile):
+            print " -> Getting patch..."
+            self._runPhase(obj, "fetch", obj.getDistFile, obj.patchfile)
+
+        key = obj.getCacheKey()
+        obj.checkChanges()
+        if obj.isBuild() and self.getRebuiltDependencies(obj, self._rebuilt):
+            print " -> %s: dependencies were rebuilt." % (obj)
+            obj.invalidate("build")
+
+        if obj.isInstalled():
+            print "%s already installed..." % (obj)
+            obj.setRecordedKey(key)
+            return
+
+        if config.IMPORT_PACKAGES and self.isCacheable(obj):
+            filename = self.packages.find(obj)
+            if filename:
+                print " -> Importing %s from %s" % (obj, filename)
+                self.importPackage(obj, filename)
+                obj.setRecordedKey(key)
+                return
+
+        if self.cache and self.isCacheable(obj) and self.cache.has(key):
+            print " -> Restoring %s from the build cache (%s)" % (obj, key)
+            self.restoreObject(obj, key)
+            obj._setBuildOk()
+            obj.setRecordedKey(key)
+            return
+
+        ## Extracted if missing, or not fit for the build mode anymore
+        self.extractObject(obj)
+
+        print " -> patching..."
+        self._runPhase(obj, "patch", obj.patch)
+
+        self.spillObject(obj)
+        print " -> configure..."
+        configured = obj.isConfigure()
+        self._runPhase(obj, "configure", obj.configure)
+        if not configured and obj.isAutoconf():
+            self.recordConfigure(obj)
+        print " -> done."
+        self.spillObject(obj)
+        print " -> build..."
+        if not obj.isBuild():
+            self._rebuilt.add(obj)
+            if self.compilerCache:
+                self.compilerCache.resetStats(obj.getLogPath("ccache"))
+        self._runPhase(obj, "build", obj.build)
+        if self.compilerCache:
+            stats = self.compilerCache.readStats(obj.getLogPath("ccache"))
+            if stats:
+                self.compilerStats[obj.getQualifiedName()] = stats
+                print " -> compiler cache: %d hits, %d misses" % stats
+        print " -> done."
+        print " -> install..."
+        self.installObject(obj, key)
+        print " -> done."
+
+        if obj.isInstalled():
+            obj.setRecordedKey(key)
+            self.releaseObject(obj)
+
+    ############################################################################
+    def reconcile(self, objects = None, save = True):
+        """
+
+        Check the stamp store against the stamp files of the build trees,
+        and fix it up (in memory only, unless `save`). Done automatically
+        if there is no stamp store yet.
+
+        Objects without a build tree (eg. restored from the build cache)
+        are left alone.
+        """
+        if objects is None:
+            objects = self.builds
+        paths = []
+        for obj in objects:
+            if os.path.isdir(obj.getBuildPath()):
+                paths.extend(obj.getStampPaths())
+        for path in self.stamps.reconcile(self.buildroot, paths, save):
+            print " -> Stamp %s %s" % (path, self.stamps.has(path) and "found" or "removed")
+
+    ############################################################################
+    def recordConfigure(self, obj):
+        """
+
+        Account an autoconf configure of `obj`: with the shared configure
+        cache, how many checks were cached, and the time saved compared to
+        the last configures without a cached result.
+        """
+        duration = sum([ span.getDuration() for span in self.profiler.spans
+                         if span.name == obj.getQualifiedName() and span.phase == "configure" and span.end ])
+        if not self.configureCache:
+            self.history.setUncachedConfigure(obj, duration)
+            return
+        cached, checks = self.configureCache.readStats(obj.getLogPath("configure"))
+        if not cached:
+            self.history.setUncachedConfigure(obj, duration)
+        uncached = self.history.getUncachedConfigure(obj)
+        self.configureStats[obj.getQualifiedName()] = (cached, checks, duration, uncached)
+        if uncached and cached:
+            print " -> configure cache: %d/%d checks cached, %.1fs instead of %.1fs" % (
+                cached, checks, duration, uncached)
+        else:
+            print " -> configure cache: %d/%d checks cached" % (cached, checks)
+
+    ############################################################################
+    def getConfigureSaving(self):
+        """
+
+        Report of the time saved by the configure cache in this run.
+        """
+        lines = []
+        total = 0.0
+        for name, (cached, checks, duration, uncached) in sorted(self.configureStats.items()):
+            if cached and uncached:
+                total += uncached - duration
+                lines.append("  %-30s %4d/%-4d cached  %6.1fs saved" % (name, cached, checks, uncached - duration))
+            else:
+                lines.append("  %-30s %4d/%-4d cached       ?" % (name, cached, checks))
+        lines.insert(0, "Configure cache: %.1fs saved in %d packages" % (total, len(self.configureStats)))
+        return "\n".join(lines)
+
+    ############################################################################
+    def getMemoryLimit(self):
+        """
+
+        config.MEMORY, or the physical memory, in MB.
+        """
+        if config.MEMORY is not None:
+            return config.MEMORY or None
+        try:
+            return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1024 * 1024)
+        except (ValueError, OSError):
+            return None
+
+    ############################################################################
+    def recordHistory(self, objects):
+        """
+
+        Add the costs of this run of `objects` to the build history.
+        """
+        spans = {}
+        for span in self.profiler.spans:
+            spans.setdefault(span.name, []).append(span)
+        for obj in objects:
+            self.history.record(obj, spans.get(obj.getQualifiedName(), []))
+        self.history.save()
+
+    ############################################################################
+    def plan(self, objects):
+        """
+
+        What building `objects` would do, see planner.Planner.
+        """
+        return Planner(self).plan(objects)
+
+    ############################################################################
+    def build(self, project = "all", dryrun = False, keepGoing = None):
         """
 
         Build all registered projects, by default
 
         Or specify a project name, and the builder will
         build all dependencies, then the specified project :)
-        """
 
-        print "=> Building project %s" % (project)
+        The build is planned first: only the objects with something to do
+        are built. With `dryrun`, the plan is printed and returned.
+
+        Objects are fetched and extracted while others build. On failure,
+        the build stops, or with `keepGoing` (config.KEEP_GOING by default)
+        only the objects depending on the failed one are cancelled.
+        """
+        if keepGoing is None:
+            keepGoing = config.KEEP_GOING
 
-        self.setEnvironnement()
+        print "=> Building project %s%s" % (project, self.target and " for %s" % (self.target.name, ) or "")
+        self.profiler = Profiler()
+        ## Objects built during this run: their dependents build again
+        self._rebuilt = set()
+        self.checks = DependencyChecks(self.getDependents)
+        self.compilerStats = {}
+        self.configureStats = {}
+        self._started = {}
+        self._finished = set()
+        ## A dry run reads the stamp files, but writes nothing
+        if self.stamps.isNew:
+            print "No stamp store yet, reading stamp files..."
+            self.reconcile(save = not dryrun)
 
         if project == "all":
             # Ok, I need to build all registered projects
             builds = self.builds
         else:
-            builds = [ obj for obj in self.builds if obj.name == project ]
+            builds = self.getClosure(self.findObjects(project))
 
         print "Modules in this project: "
         for obj in builds: print " -> %s" % (obj)
 
-        for obj in builds:
-            print "=> Building %s" % (obj)
-            
-            if not obj.hasDistFile():
-                print " -> Getting distfile..."
-                obj.getDistFile()
-
-            object_path = obj.getBuildPath()
-            if not os.path.isdir(object_path):
-                ## I should extract it
-                print " -> Extracting %s" % (obj)
-                obj.extract()
-
-            print " -> patching..."
-            obj.patch()
-            
-            print " -> configure..."
-            obj.configure()
-            print " -> done."
-            print " -> build..."
-            obj.build()
-            print " -> done."
-            print " -> install..."
-            obj.install()
-            print " -> done."
+        plan = self._runPhase(project, "plan", self.plan, builds)
+        print plan.format()
+        if dryrun:
+            return plan
+
+        ## Not before the dry run returned: it changes nothing
+        if self.compilerCache:
+            self.compilerCache.setup([ self.getCC() ])
+        if config.DASHBOARD and self._dashboard is None:
+            self._dashboard = Dashboard(interval = config.DASHBOARD_INTERVAL, verbose = config.VERBOSE)
+            self.subscribe(self._dashboard)
+
+        objects = plan.getObjects()
+        start = time.time()
+        ok = False
+        self.events.emit("build-start", project, objects = [ obj.getQualifiedName() for obj in objects ],
+                         eta = self.getETA(objects))
+        try:
+            ## Independent modules are built at the same time, sharing the job budget
+            print "Job budget: %d" % (self.jobserver.jobs)
+            Scheduler(self.jobserver, self.getDependencies, self.history,
+                      self.getMemoryLimit()).run(objects, lambda obj, jobs, jobserver: self.runObject(obj, jobs, jobserver, objects),
+                          prepare = lambda obj: self.prepareObject(obj, plan.getStep(obj)),
+                          prepareJobs = config.FETCH_JOBS, keepGoing = keepGoing)
+            ok = True
+        finally:
+            self.events.emit("build-end", project, ok = ok, duration = time.time() - start,
+                             dropped = self.events.dropped)
+            self.events.flush()
+            self.recordHistory(objects)
+            self.profiler.writeTrace(os.path.join(self.buildroot, "trace.json"))
+            print self.profiler.report(builds, self.getDependencies)
+            if self.compilerStats:
+                hits = sum([ stats[0] for stats in self.compilerStats.values() ])
+                misses = sum([ stats[1] for stats in self.compilerStats.values() ])
+                print "Compiler cache: %d hits, %d misses (%.0f%%) in %d packages" % (
+                    hits, misses, 100.0 * hits / max(1, hits + misses), len(self.compilerStats))
+            if self.configureStats:
+                print self.getConfigureSaving()
+            print "Trace written to %s" % (os.path.join(self.buildroot, "trace.json"))
 
         print "=> Project %s built." % (project)
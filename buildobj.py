@@ -1,37 +1,89 @@
 import os
 import os.path
+import re
+import json
+import shutil
+import hashlib
 import datetime
 import config
-import select
-import subprocess
+import cache
+import archive
+from fetch import FetchError
+from events import OutputEcho
+from package import mergeTree, listTree
+from scratch import makeWritable
+from util import writeJSON
+import sys
+import runner
 
 import logging
 logger = logging.getLogger("builder")
 
 class BuildError(Exception): pass
 class ExecutionError(BuildError): pass
+class DependencyCycleError(BuildError): pass
+
+## Files of the extracted tree, see AbstractBuildObject.extract()
+SOURCES_LIST = ".sources"
+
+## Out of tree, marks a source tree extracted read-only and never built in,
+## see AbstractBuildObject.extract()
+PRISTINE_MARK = ".pristine"
+
+## Files builds are known to rewrite in place: copied to the "copy" build
+## trees rather than hard linked, see AbstractBuildObject.prepareTree()
+REWRITTEN_FILES = set([ "Makefile", "GNUmakefile", "makefile", "Makefile.pre", "config.h",
+                        "pyconfig.h", "config.status", "config.log", "config.cache",
+                        "libtool", "Setup", "Setup.local" ])
+
+## A change in these source files means configuring again
+CONFIGURE_INPUTS = set([ "configure", "configure.ac", "configure.in", "aclocal.m4",
+                         "Makefile.in", "Makefile.am", "configure.py", "setup.py" ])
 
 
 ################################################################################
 class AbstractBuildObject(object):
     _builder = None
 
+    ## Stamp files, in phase order
+    STAMPS = (".patched", ".configured", ".built", ".installed")
+
     ############################################################################
-    def __init__(self, name, version, filename, url = [], dependencies = [], patch = None):
+    def __init__(self, name, version, filename, url = [], dependencies = [], patch = None, variant = None,
+                       environment = None):
         self.name           = name
+        self.variant        = variant
         self.version        = version
         self.filename       = filename
         self.dependencies   = dependencies
         self.url            = url
         self.patchfile      = patch
-
+        self.environment    = environment or {}
+        ## Qualified name of the object whose build tree we build in, if any
+        self.tree           = None
+
+        ## Number of make jobs given by the scheduler (None: config.GMAKE_FLAGS)
+        self.jobs           = None
+        ## Job server our make takes more jobs from, see scheduler.JobServer
+        self.jobserver      = None
+        ## Working directory of executed commands, see goto()
+        self._cwd           = None
+        ## See getCacheKey() and getEnvironment()
+        self._cacheKey      = None
+        self._environment   = None
+        ## Phases logged during this run, see openLog()
+        self._logs          = set()
+
+        ## Our builder is the one set when we are created: there is one per
+        ## target of a matrix (see matrix.Matrix)
+        self._builder       = AbstractBuildObject._builder
         assert(self._builder is not None)
 
         self._builder.register(self)
     
     ############################################################################
     def __repr__(self):
-        mstr = "<%s (%s)" % (self.name, self.filename)
+        mstr = "<%s (%s)" % (self.getQualifiedName(), self.filename)
         if self.patchfile and self.isPatch():
             mstr += " [ Patched ]"
         if self.isConfigure():
@@ -43,6 +95,27 @@ class AbstractBuildObject(object):
         mstr += ">"
         return mstr
     
+    ############################################################################
+    def getQualifiedName(self):
+        """
+
+        "name", or "name:variant" for variants.
+        """
+        if self.variant is None:
+            return self.name
+        return "%s:%s" % (self.name, self.variant)
+
+    ############################################################################
+    def getPathName(self):
+        """
+
+        getQualifiedName() fit for a directory name: "name", or
+        "name-variant" (':' separates the VPATH entries of make).
+        """
+        if self.variant is None:
+            return self.name
+        return "%s-%s" % (self.name, self.variant)
+
     ############################################################################
     @staticmethod
     def setBuilder(builder):
@@ -56,6 +129,43 @@ class AbstractBuildObject(object):
         """
         raise BuildError("Can't build an abstract BuildObject :)")
    
+    ############################################################################
+    def getInstallCommands(self, destdir = None):
+        """
+
+        Commands installing this object, into `destdir` (a staging
+        directory, prefix included) if given.
+        """
+        raise BuildError("Can't install an abstract BuildObject :)")
+
+    ############################################################################
+    def install(self, destdir = None):
+        """
+
+        Install into getPrefix(), or stage the installation into `destdir`:
+        the builder then merges the files into the prefix, and marks us
+        installed (see Builder.installObject()).
+        """
+        if self.isInstalled():
+            print "%s already installed..." % (self)
+            return True
+        
+        if not self.check_dependencies("install"):
+            logger.error("Dependency check failed for %s. Can't continue." % (self))
+            return False
+
+        self.goto()
+        try:
+            for command in self.getInstallCommands(destdir):
+                self.execute(command, "install")
+        except:
+            self._setInstallOk(False)
+            raise
+        
+        if not destdir:
+            self._setInstallOk()
+        return True
+
     ############################################################################
     def patch(self):
         if not self.patchfile:
@@ -76,47 +186,222 @@ class AbstractBuildObject(object):
         filename = os.path.join(self._builder.distfiles, self.patchfile)
         self.goto()
         try:
-            self.execute("%s -p0 < %s" % (config.PATCH, filename))
+            self.execute("%s -p0 < %s" % (config.PATCH, filename), "patch")
+            ## Kept to be reverted, if the patch changes
+            shutil.copyfile(filename, self._getStatePath(".patched.diff"))
         except:
             self._setPatchOk(False)
             raise
         
         self._setPatchOk()
+        self._setInputs("patch")
+
+    ############################################################################
+    def unpatch(self):
+        """
+
+        Revert the applied patch (which may not be our patch file anymore).
+        """
+        applied = self._getStatePath(".patched.diff")
+        if not self.isPatch():
+            return
+        self.goto()
+        if os.path.isfile(applied):
+            self.execute("%s -R -p0 < %s" % (config.PATCH, applied), "patch")
+            os.unlink(applied)
+        self._setPatchOk(False)
 
  
     ############################################################################
     def check_dependencies(self, action):
+        """
+
+        Make sure the dependencies went through `action`, running it on
+        those which did not. Satisfied checks are remembered by the builder
+        until a stamp changes (see Builder.checks); a dependency cycle
+        raises DependencyCycleError.
+
+        Dependencies are never installed from here: the builder stages and
+        merges them (see Builder.installObject()) before their dependents,
+        a dependency not installed fails the check.
+        """
         def getCheckMethod(obj, action):
             if action == "install":
                 action = "installed"
             return getattr(obj, "is%s" % (action.capitalize()))
         to_build = []
-        
-        for dep in self.dependencies:
-            ## Resolve the dependecy in the builder
-            obj = self._builder.getObject(dep)
-            if not obj:
-                logger.error("Dependency %s not found. Check your configuration." % (dep))
-                return False
-            if not getCheckMethod(obj, action)():
-                to_build.append(obj)
 
-        for dep in to_build:
-            try:
-                getattr(dep, action)()
-            except BuildError:
-                print "I Can't continue building myself, as the dependency %s don't wanna %s :)" % (dep, action)
+        checks = self._builder.checks
+        if checks.isSatisfied(self, action):
+            return True
+        cycle = checks.enter(self, action)
+        if cycle:
+            raise DependencyCycleError("Circular dependency (%s): %s" % (
+                action, " -> ".join([ obj.getQualifiedName() for obj in cycle ])))
+        try:
+            for dep in self.dependencies:
+                ## Resolve the dependecy in the builder
+                obj = self._builder.getObject(dep)
+                if not obj:
+                    logger.error("Dependency %s not found. Check your configuration." % (dep))
+                    return False
+                if not getCheckMethod(obj, action)():
+                    to_build.append(obj)
+
+            if action == "install" and to_build:
+                logger.error("%s: dependencies not installed: %s." % (
+                    self, ", ".join([ dep.getQualifiedName() for dep in to_build ])))
                 return False
-        
+
+            for dep in to_build:
+                try:
+                    getattr(dep, action)()
+                except DependencyCycleError:
+                    raise
+                except BuildError:
+                    print "I Can't continue building myself, as the dependency %s don't wanna %s :)" % (dep, action)
+                    return False
+        finally:
+            checks.leave(self, action)
+
+        checks.setSatisfied(self, action)
         return True
     
     ############################################################################
     def getRepository(self):
         return "%s-%s" % (self.name, self.version)
 
+    ############################################################################
+    def isOutOfTree(self):
+        """
+
+        Whether we build in a directory of our own (config.OUT_OF_TREE),
+        from a pristine, read-only source tree shared with the other
+        objects of the same distfile.
+        """
+        return config.OUT_OF_TREE
+
+    ############################################################################
+    def isPristine(self):
+        """
+
+        Whether our source tree was extracted for out-of-tree builds,
+        and never built in.
+        """
+        return os.path.isfile(os.path.join(self.getSourcePath(), PRISTINE_MARK))
+
+    ############################################################################
+    def makeSourcesWritable(self):
+        """
+
+        Make our pristine source tree writable, to build in it.
+        """
+        makeWritable(self.getSourcePath())
+        os.unlink(os.path.join(self.getSourcePath(), PRISTINE_MARK))
+
+    ############################################################################
+    def getTreePath(self):
+        """
+
+        Root of the tree we build in: the source tree itself, or out of
+        tree, build/NAME[-VARIANT] below the build root (or the one of
+        the object we share it with, see `tree`).
+        """
+        if self.tree:
+            return self._builder.getObject(*self.tree.split(":", 1)).getTreePath()
+        if not self.isOutOfTree():
+            return self.getSourcePath()
+        return os.path.join(self._builder.buildroot, "build", self.getPathName())
+
+    ############################################################################
+    def getSubdirectory(self):
+        """
+
+        Where we build in the tree, relative to its root.
+        """
+        return os.sep.join(self.getRepository().split(os.sep)[1:])
+
     ############################################################################
     def getBuildPath(self):
-        return os.path.join(self._builder.buildroot, self.getRepository())
+        return os.path.normpath(os.path.join(self.getTreePath(), self.getSubdirectory()))
+
+    ############################################################################
+    def getSourceBuildPath(self):
+        """
+
+        Counterpart of getBuildPath() in the source tree.
+        """
+        return os.path.normpath(os.path.join(self.getSourcePath(), self.getSubdirectory()))
+
+    ############################################################################
+    def getBuildMode(self):
+        """
+
+        How our build tree is made from the sources: "tree" (we build in
+        the sources, or in the tree of another object), "vpath" (an empty
+        build directory, see SimpleBuildObject) or "copy" (hard links to
+        the sources: they are read-only, tools replacing files don't
+        change the pristine ones; the files rewritten in place, see
+        REWRITTEN_FILES and getPatchedFiles(), are copied).
+        """
+        if self.tree or not self.isOutOfTree():
+            return "tree"
+        return "copy"
+
+    ############################################################################
+    def prepareTree(self):
+        """
+
+        Make our build tree from the extracted sources, see getBuildMode().
+        """
+        mode = self.getBuildMode()
+        if mode == "tree" or os.path.isdir(self.getBuildPath()):
+            return
+        ## A fresh tree has no stamps
+        self._builder.stamps.discard(os.path.relpath(self.getTreePath(), self._builder.buildroot))
+        self._builder.checks.forget(self)
+        logger.info("Preparing the %s build tree of %s in %s" % (mode, self, self.getTreePath()))
+        if mode == "vpath":
+            os.makedirs(self.getBuildPath())
+            return
+        source = self.getSourcePath()
+        for dirpath, dirnames, filenames in os.walk(source):
+            directory = os.path.join(self.getTreePath(), os.path.relpath(dirpath, source))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        patched = set([ os.path.normpath(os.path.join(self.getSubdirectory(), path))
+                        for path in self.getPatchedFiles() ])
+        files = listTree(source)
+        copies = set([ path for path in files
+                       if os.path.basename(path) in REWRITTEN_FILES or path in patched ])
+        mergeTree(source, self.getTreePath(), files, copies)
+
+    ############################################################################
+    def getPatchedFiles(self):
+        """
+
+        Files our patch file changes, relative to getBuildPath().
+        """
+        if not self.patchfile:
+            return []
+        self.getDistFile(self.patchfile)
+        files = []
+        f = open(os.path.join(self._builder.distfiles, self.patchfile), "r")
+        try:
+            for line in f:
+                if line.startswith("+++ "):
+                    files.append(os.path.normpath(line[4:].split("\t")[0].strip()))
+        finally:
+            f.close()
+        return files
+
+    ############################################################################
+    def getSharers(self):
+        """
+
+        Objects building in our tree (see `tree`).
+        """
+        return [ obj for obj in self._builder.builds if obj.tree == self.getQualifiedName() ]
 
     ############################################################################
     def isBuild(self):
@@ -135,14 +420,25 @@ class AbstractBuildObject(object):
         return self._isFile(".configured")
 
     ############################################################################
-    def _isFile(self, file):
-        try:
-            f = open(os.path.join(self.getBuildPath(), file), "r")
-        except IOError:
-            return False
+    def _getStampName(self, file):
+        return file
 
-        f.close()
-        return True
+    ############################################################################
+    def _getStampPath(self, file):
+        """
+
+        Stamp path, relative to the build root: its key in the builder's stamp store.
+        """
+        return os.path.relpath(os.path.join(self.getBuildPath(), self._getStampName(file)),
+                               self._builder.buildroot)
+
+    ############################################################################
+    def getStampPaths(self):
+        return [ self._getStampPath(file) for file in self.STAMPS ]
+
+    ############################################################################
+    def _isFile(self, file):
+        return self._builder.stamps.has(self._getStampPath(file))
     
     ############################################################################
     def _setInstallOk(self, ok = True):
@@ -162,111 +458,454 @@ class AbstractBuildObject(object):
     
     ############################################################################
     def _setFile(self, file, ok):
-        if ok:
+        """
+
+        The stamp store is authoritative; stamp files are still written in the
+        build tree, if any (see Builder.reconcile()).
+        """
+        filename = os.path.join(self.getBuildPath(), self._getStampName(file))
+        if not os.path.isdir(self.getBuildPath()):
+            pass
+        elif ok:
             try:
-                f = open(os.path.join(self.getBuildPath(), file), "w")
-            except:
+                f = open(filename, "w")
+            except IOError:
                 print "Unable to create the %s file for %s." % (file, self.getBuildPath())
-            f.write("%s" % (datetime.datetime.now()))
-            f.close()
+            else:
+                f.write("%s" % (datetime.datetime.now()))
+                f.close()
         else:
             try:
-                os.unlink(os.path.join(self.getBuildPath(), file))
+                os.unlink(filename)
             except OSError: pass
+        self._builder.stamps.set(self._getStampPath(file), ok)
+        self._builder.checks.forget(self)
+
+    ############################################################################
+    def getCacheInputs(self):
+        """
+
+        Everything the installed files depend on, but the dependencies.
+        Extended by the subclasses with their commands and arguments.
+        """
+        inputs = [ self.__class__.__name__, self.name, self.variant, self.version,
+                   self.filename, cache.fileDigest(os.path.join(self._builder.distfiles, self.filename)),
+                   self.getCflags(), self._builder.getCC(), self.getPrefix(),
+                   sorted(self.getEnvironmentOverrides().items()) ] + self._builder.getTargetInputs()
+        if self.patchfile:
+            inputs.append(cache.fileDigest(os.path.join(self._builder.distfiles, self.patchfile)))
+        return inputs
+
+    ############################################################################
+    def getCacheKey(self, keys = None):
+        """
+
+        Content hash of getCacheInputs() and of the keys of the dependencies,
+        computed once: distfiles must be there.
+
+        `keys` ({ dependency: key }) replaces the keys of some dependencies
+        (the ones they will have once built, see planner.Planner): the
+        result is then not kept.
+        """
+        if self._cacheKey and not keys:
+            return self._cacheKey
+
+        digest = hashlib.sha1()
+        for value in self.getCacheInputs():
+            digest.update("%r\0" % (value, ))
+        for dep in sorted(self._builder.getDependencies(self), key = lambda dep: dep.getQualifiedName()):
+            ## The key of what is actually installed, if known
+            key = keys and keys.get(dep) or dep.getRecordedKey() or dep.getCacheKey()
+            digest.update("%s=%s\0" % (dep.getQualifiedName(), key))
+        if keys:
+            return digest.hexdigest()
+        self._cacheKey = digest.hexdigest()
+        return self._cacheKey
+
+    ############################################################################
+    def resetCacheKey(self):
+        """
+
+        Forget the computed cache key: the dependencies are about to change.
+        """
+        self._cacheKey = None
+
+    ############################################################################
+    def getRecordedKey(self):
+        """
+
+        Cache key of the last completed build of this object, if any.
+        """
+        return self._builder.stamps.get(self._getStampPath(".cachekey"))
+
+    ############################################################################
+    def setRecordedKey(self, key):
+        self._builder.stamps.set(self._getStampPath(".cachekey"), True, key)
+
+    ############################################################################
+    def invalidate(self, phase = "configure"):
+        """
+
+        Forget the stamps of `phase` and of the next ones: they will run again.
+        """
+        if phase == "configure":
+            self._setConfigureOk(False)
+        if phase in ("configure", "build"):
+            self._setBuildOk(False)
+        self._setInstallOk(False)
+
+    ############################################################################
+    def _getStatePath(self, name):
+        return os.path.join(self.getBuildPath(), self._getStampName(name))
+
+    ############################################################################
+    def getPhaseInputs(self, phase):
+        """
+
+        What the result of a phase depends on, but the sources:
+        the patch, the configure command and environment, and for the
+        build, everything (the cache key).
+        """
+        if phase == "patch":
+            if not self.patchfile:
+                return ""
+            return cache.fileDigest(os.path.join(self._builder.distfiles, self.patchfile))
+        if phase == "configure":
+            digest = hashlib.sha1()
+            for value in self.getConfigureInputs():
+                digest.update("%r\0" % (value, ))
+            return digest.hexdigest()
+        return self.getCacheKey()
+
+    ############################################################################
+    def getConfigureInputs(self):
+        return [ sorted(self.getEnvironmentOverrides().items()), self._builder.getCC(),
+                 self.getPrefix() ] + self._builder.getTargetInputs()
+
+    ############################################################################
+    def _setInputs(self, phase):
+        self._builder.stamps.set(self._getStampPath(".%s.inputs" % (phase, )), True, self.getPhaseInputs(phase))
+
+    ############################################################################
+    def _getInputs(self, phase):
+        return self._builder.stamps.get(self._getStampPath(".%s.inputs" % (phase, )))
+
+    ############################################################################
+    def _readSources(self):
+        """
+
+        Current (size, mtime) of the extracted files, None if unknown.
+        """
+        ## Sources are changed in our copy of the tree, if we have one
+        if self.getBuildMode() == "copy":
+            root = self.getTreePath()
+        else:
+            root = self.getSourcePath()
+        try:
+            f = open(os.path.join(root, SOURCES_LIST), "r")
+        except IOError:
+            return None
+        try:
+            names = f.read().split("\n")
+        finally:
+            f.close()
+
+        sources = {}
+        for name in names:
+            try:
+                st = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            sources[name] = [ st.st_size, st.st_mtime ]
+        return sources
+
+    ############################################################################
+    def recordSources(self):
+        """
+
+        Remember the state of the sources a build was made from.
+        """
+        sources = self._readSources()
+        if sources is None:
+            return
+        writeJSON(self._getStatePath(".built.sources"), sources, indent = None)
+
+    ############################################################################
+    def getChangedSources(self):
+        """
+
+        Source files changed since the last build.
+        """
+        try:
+            f = open(self._getStatePath(".built.sources"), "r")
+        except IOError:
+            return []
+        try:
+            try:
+                recorded = json.load(f)
+            except ValueError:
+                return []
+        finally:
+            f.close()
+
+        current = self._readSources() or {}
+        return sorted([ name for name in set(recorded) | set(current)
+                        if recorded.get(name) != current.get(name) ])
+
+    ############################################################################
+    def isModified(self):
+        """
+
+        True if the sources were changed after extraction (until the next one).
+        """
+        return self._isFile(".modified")
+
+    ############################################################################
+    def getChanges(self, keys = None):
+        """
+
+        Compare the inputs of the done phases with the recorded ones, without
+        changing anything. Returns (phase, reason, changed sources) for the
+        first phase which must run again, or None: a changed patch must be
+        reverted, a changed configure command or configure script means
+        configuring again, anything else just building again (make is
+        incremental). `keys`: see getCacheKey().
+        """
+        if not os.path.isdir(self.getBuildPath()):
+            ## Never built, or restored from the build cache
+            return None
+
+        if self.isPatch() and self._getInputs("patch") not in (None, self.getPhaseInputs("patch")):
+            return "patch", "patch changed", []
+
+        if self.isConfigure() and self._getInputs("configure") not in (None, self.getPhaseInputs("configure")):
+            return "configure", "configure inputs changed", []
+
+        if not self.isBuild():
+            return None
+
+        changed = self.getChangedSources()
+        if [ name for name in changed if os.path.basename(name) in CONFIGURE_INPUTS ]:
+            return "configure", "configure scripts changed: %s" % (", ".join(changed[:10])), changed
+        if changed:
+            return "build", "%d source files changed: %s" % (len(changed), ", ".join(changed[:10])), changed
+
+        if self.getRecordedKey() not in (None, self.getCacheKey(keys)):
+            return "build", "build inputs changed", []
+        return None
+
+    ############################################################################
+    def checkChanges(self):
+        """
+
+        Invalidate the phases which must run again, see getChanges().
+        Returns the first invalidated phase, if any.
+        """
+        changes = self.getChanges()
+        if changes is None:
+            return None
+
+        phase, reason, changed = changes
+        print " -> %s: %s." % (self, reason)
+        if changed:
+            ## Local changes: the build cache can't be used by this tree anymore
+            self._builder.stamps.set(self._getStampPath(".modified"))
+        if phase == "patch":
+            self.unpatch()
+            self.invalidate("configure")
+        else:
+            self.invalidate(phase)
+        return phase
 
     ############################################################################
     def clean(self):
-        command = "rm -rf %s" % (self.getBuildPath())
+        ## Out of tree, the pristine sources are kept
+        if self.getBuildMode() == "tree":
+            path = self.getBuildPath()
+        else:
+            path = self.getTreePath()
+        command = "rm -rf %s" % (path)
         try:
-            self.execute(command)
+            self.execute(command, "clean")
         except:
             print "Unable to cleanup %s: %s" % (self, command)
             raise
+        self._builder.stamps.discard(os.path.relpath(path, self._builder.buildroot))
+        self._builder.checks.forget(self)
     
     ############################################################################
-    def execute(self, command):
-        myenv = os.environ
-        try:
-            myenv["CPPFLAGS"] = "%s -I%s" % (myenv["CPPFLAGS"] or "", os.path.join(os.getcwd(), "include"))
-        except KeyError:
-            myenv["CPPFLAGS"] = "-I%s" % (os.path.join(config.PREFIX, "include"))
+    def getPrefix(self):
+        """
 
-        try:
-            myenv["LDFLAGS"] = "%s -L%s" % (myenv["LDFLAGS"] or "", os.path.join(os.getcwd(), "lib"))
-        except KeyError:
-            myenv["LDFLAGS"] = "-L%s" % (os.path.join(config.PREFIX, "lib"))
+        Where this object is installed: the prefix of our builder.
+        """
+        return self._builder.prefix
 
-        try:
-            myenv["LD_LIBRARY_PATH"] = "%s:%s" % (myenv["LD_LIBRARY_PATH"] or "", os.path.join(os.getcwd(), "lib"))
-        except KeyError:
-            myenv["LD_LIBRARY_PATH"] = "%s" % (os.path.join(config.PREFIX, "lib"))
+    ############################################################################
+    def getEnvironmentOverrides(self):
+        """
+
+        Variables of this object only: its `environment`, by default.
+        """
+        return dict(self.environment)
+
+    ############################################################################
+    def getEnvironment(self):
+        """
+
+        Environment of the commands of this object, composed once: the
+        builder's one, the bin/, lib/ and include/ directories of our prefix
+        and of our dependencies' ones, the compiler cache, then
+        getEnvironmentOverrides().
+        Each command gets its own copy: os.environ is never modified.
+        """
+        if self._environment is None:
+            environment = dict(self._builder.getEnvironment())
+
+            prefixes = [ self.getPrefix() ]
+            for dep in self._builder.getClosure([ self ]):
+                if dep.getPrefix() not in prefixes:
+                    prefixes.append(dep.getPrefix())
+
+            def prepend(name, values, separator):
+                values = list(values)
+                if environment.get(name):
+                    values.append(environment[name])
+                environment[name] = separator.join(values)
+
+            prepend("PATH", [ os.path.join(prefix, "bin") for prefix in prefixes ], ":")
+            prepend("LD_LIBRARY_PATH", [ os.path.join(prefix, "lib") for prefix in prefixes ], ":")
+            prepend("CPPFLAGS", [ "-I%s" % (os.path.join(prefix, "include")) for prefix in prefixes ], " ")
+            prepend("CFLAGS", [ "-I%s" % (os.path.join(prefix, "include")) for prefix in prefixes ], " ")
+            prepend("LDFLAGS", [ "-L%s" % (os.path.join(prefix, "lib")) for prefix in prefixes ], " ")
+
+            ## The compiler cache wraps the compilers first in the PATH
+            compilerCache = self._builder.compilerCache
+            if compilerCache:
+                prepend("PATH", [ compilerCache.bindir ], ":")
+                environment.update(compilerCache.getEnvironment(self.getLogPath("ccache"), environment.get("CC")))
+
+            environment.update(self.getEnvironmentOverrides())
+            self._environment = environment
+        return dict(self._environment)
+
+    ############################################################################
+    def getLogPath(self, phase):
+        return os.path.join(self._builder.buildroot, "logs", self.getQualifiedName(), "%s.log" % (phase, ))
+
+    ############################################################################
+    def openLog(self, phase):
+        """
+
+        Log file of a phase: truncated by the first command of the phase of
+        this run, appended to by the next ones.
+        """
+        filename = self.getLogPath(phase)
+        if not os.path.isdir(os.path.dirname(filename)):
+            try:
+                os.makedirs(os.path.dirname(filename))
+            except OSError:
+                ## Created by another thread meanwhile
+                pass
+        if phase in self._logs:
+            return open(filename, "a")
+        self._logs.add(phase)
+        return open(filename, "w")
+
+    ############################################################################
+    def execute(self, command, phase = "build"):
+        """
 
+        Run `command` in the working directory set by goto(). Its output is
+        written to the log of `phase`, see openLog().
+        """
         #logger.info("Will execute %s" % (command))
         print("Will execute %s" % (command, ))
-        p = subprocess.Popen(command,
-                             bufsize = 0,
-                             stdin   = subprocess.PIPE,
-                             stdout  = subprocess.PIPE,
-                             stderr  = subprocess.PIPE,
-                             close_fds = True,
-                             shell  = True,
-                             env    = myenv)
-
-        stdin, stdout, stderr = (p.stdin, p.stdout, p.stderr)
-        stdin.close()
-        if not config.VERBOSE:
-            (rlst, wlst, xlst) = select.select([stdout, stderr], [], [], 0.1)
-            if stdout in rlst:
-                out = stdout.read()
+        log = self.openLog(phase)
+        try:
+            log.write("## %s\n" % (command, ))
+            log.flush()
+            ## Lines go to the event stream, without ever blocking the command
+            if self._builder.events.callbacks:
+                echo, prefix = OutputEcho(self._builder.events, self.getQualifiedName()), ""
+            elif config.VERBOSE:
+                echo, prefix = sys.stdout, "[%s] " % (self.getQualifiedName(), )
             else:
-                out = ""
+                echo, prefix = None, ""
+            p = runner.Command(command,
+                               cwd     = self._cwd,
+                               env     = self.getEnvironment(),
+                               logfile = log,
+                               echo    = echo,
+                               prefix  = prefix,
+                               tail    = config.LOG_TAIL)
+            exit_code = p.run()
+        finally:
+            log.close()
+        self._builder.profiler.addUsage(p.rusage)
 
-            if stderr in rlst:
-                err = stderr.read()
-            else:
-                err = ""
+        if exit_code != 0:
+            logger.error("Error executing `%s':\n%s\nExit code was: %s (pid %s)" % (command, p.getTail(), exit_code, p.pid))
+            logger.error("Complete output in %s" % (log.name))
+            raise ExecutionError(p.getTail())
 
-        else:
-            err = ""
-            while 1:
-                (rlst, wlst, xlst) = select.select([stdout, stderr], [], [], 0.1)
-                if stdout in rlst:
-                    out = stdout.readline()
-                    if not out:
-                        break
-                    else:
-                        print out,
-
-                if stderr in rlst:
-                    lerr = stderr.readline()
-                    err += lerr
-        
-        ## NOT REENTRANT !!!!
-        pid = p.pid
-        exit_code = p.wait()
+    ############################################################################
+    def getSourcePath(self):
+        """
 
-        if exit_code != 0:
-            logger.error("Error executing `%s':\n%s\nExit code was: %s (pid %s)" % (command, err, exit_code, pid))
-            logger.debug("Complete output: %s" % (out))
-            raise ExecutionError(err)
+        Root of the extracted tree (getRepository() may be a subdirectory).
+        """
+        return os.path.join(self._builder.sources, self.getRepository().split(os.sep)[0])
 
-    ############################################################################ 
-    def extract(self): 
-        logger.info("Extracting %s to %s" % (self, self._builder.buildroot)) 
-        os.chdir(self._builder.buildroot) 
-        filename = os.path.join(self._builder.distfiles, self.filename) 
-        if filename.endswith("tar.gz") or filename.endswith(".tgz"): 
-            ## GZIP Tarball 
-            command = "tar xvzf %s" % (filename) 
-        elif filename.endswith("tar.bz2") or filename.endswith("tbz2"): 
-            ## BZIP2 Tarball 
-            command = "tar xvjf %s" % (filename) 
-         
-        self.execute(command)
+    ############################################################################
+    def extract(self, destination = None):
+        """
+
+        Extract the distfile to getSourcePath(), in-process, without its
+        top-level directory. With a `destination` (eg. a scratch space),
+        the tree is extracted there, and getSourcePath() links to it.
+        """
+        logger.info("Extracting %s to %s" % (self, destination or self._builder.buildroot))
+        ## A fresh tree has no stamps
+        self._builder.stamps.discard(os.path.relpath(self.getSourcePath(), self._builder.buildroot))
+        self._builder.checks.forget(self)
+        ## Link to a lost tree (eg. a tmpfs after a reboot)
+        if os.path.islink(self.getSourcePath()) and not os.path.exists(self.getSourcePath()):
+            os.unlink(self.getSourcePath())
+        filename = os.path.join(self._builder.distfiles, self.filename)
+        try:
+            names = archive.extract(filename, destination or self.getSourcePath())
+        except archive.ArchiveError, err:
+            raise BuildError("%s" % (err, ))
+        if destination:
+            os.symlink(destination, self.getSourcePath())
+        logger.info("Extracted %d files from %s" % (len(names), self.filename))
+
+        ## The pristine files, whose changes trigger rebuilds (see checkChanges())
+        f = open(os.path.join(self.getSourcePath(), SOURCES_LIST), "w")
+        try:
+            f.write("\n".join(names))
+        finally:
+            f.close()
+
+        ## Shared by the build trees: writing to the sources must fail,
+        ## creating files in them too
+        if self.isOutOfTree():
+            open(os.path.join(self.getSourcePath(), PRISTINE_MARK), "w").close()
+            for dirpath, dirnames, filenames in os.walk(self.getSourcePath()):
+                for name in filenames + dirnames + [ "" ]:
+                    path = os.path.join(dirpath, name)
+                    if not os.path.islink(path):
+                        os.chmod(path, os.stat(path).st_mode & ~0222)
 
     ############################################################################
-    def goto(self):
-        os.chdir(self.getBuildPath())
+    def goto(self, path = None):
+        """
+
+        Set the working directory of the next executed commands.
+        The process one is left alone: objects are built concurrently.
+        """
+        self._cwd = path or self.getBuildPath()
 
     ############################################################################
     def hasDistFile(self, file = None):
@@ -275,37 +914,53 @@ class AbstractBuildObject(object):
         filename = os.path.join(self._builder.distfiles, file)
         return os.path.isfile(filename)
 
+    ############################################################################
+    def getURLs(self):
+        """
+
+        Where to get the distfiles from: our URLs, then the mirrors.
+        """
+        return self.url + [ url for url in config.MIRROR if url not in self.url ]
+
+    ############################################################################
+    def getDistFiles(self):
+        """
+
+        The distfile and the patch, if any.
+        """
+        if self.patchfile:
+            return [ self.filename, self.patchfile ]
+        return [ self.filename ]
+
     ############################################################################
     def getDistFile(self, file = None):
         if not file:
             file = self.filename
 
-        filename = os.path.join(self._builder.distfiles, file)
-        
-        def getURL(url, filename):
-            if url.endswith("/"):
-                return "%s%s" % (url, filename)
-            else:
-                return "%s/%s" % (url, filename)
-
         if self.hasDistFile(file):
             return
-       
-        for url in self.url:
-            try:
-                command = "%s %s -O%s" % (config.WGET, getURL(url, file), filename)
-                self.execute(command)
-            except ExecutionError, err:
-                os.unlink(filename)
-                logger.warning("Error message from wget: %s" % (err))
-                logger.warning("Unable to wget %s. Trying another URL if exists..." % (getURL(url, file)))
-            else:
-                break
-    
+
+        try:
+            self._builder.fetcher.fetch(file, self.getURLs())
+        except FetchError, err:
+            raise BuildError("%s" % (err, ))
+
     ############################################################################
     def getCflags(self):
         return ""
 
+    ############################################################################
+    def isAutoconf(self):
+        return False
+
+    ############################################################################
+    def getMaxJobs(self):
+        """
+
+        Maximum number of parallel jobs this object can use (None: no limit).
+        """
+        return 1
+
     
 ################################################################################
 class SimpleBuildObject(AbstractBuildObject):
@@ -316,11 +971,48 @@ class SimpleBuildObject(AbstractBuildObject):
 
     ############################################################################
     def getConfigureCommand(self):
-        return "./configure --prefix=%s" % (config.PREFIX)
+        return "./configure --prefix=%s" % (self.getPrefix())
     
+    ############################################################################
+    def getCacheInputs(self):
+        return AbstractBuildObject.getCacheInputs(self) + [
+            self.getConfigureCommand(), config.MAKE, config.GMAKE_FLAGS ]
+
+    ############################################################################
+    def getConfigureInputs(self):
+        return AbstractBuildObject.getConfigureInputs(self) + [ self.getConfigureCommand() ]
+
+    ############################################################################
+    def getMakeFlags(self):
+        """
+
+        config.GMAKE_FLAGS, with -jN replaced by the scheduler's job count,
+        or left to the job server.
+        """
+        if not self.jobs and not self.jobserver:
+            return config.GMAKE_FLAGS
+        flags = re.sub(r"(^|\s)-j\s*\d*", " ", config.GMAKE_FLAGS).strip()
+        if self.jobserver:
+            return flags
+        return ("-j%d %s" % (self.jobs, flags)).strip()
+
+    ############################################################################
+    def getMake(self):
+        """
+
+        config.MAKE, given the scheduler's job server if any.
+        """
+        if self.jobserver:
+            return self.jobserver.wrap(config.MAKE)
+        return config.MAKE
+
+    ############################################################################
+    def getMaxJobs(self):
+        return None
+
     ############################################################################
     def getMakeCommand(self):
-        return "%s %s" % (config.MAKE, config.GMAKE_FLAGS)
+        return "%s %s" % (self.getMake(), self.getMakeFlags())
 
     ############################################################################
     def configure(self):
@@ -334,12 +1026,66 @@ class SimpleBuildObject(AbstractBuildObject):
 
         self.goto()
 
+        command = self.getConfigureCommand()
+        if self.getBuildMode() == "vpath":
+            ## ./configure of the sources, run from our build directory
+            command = "%s%s" % (os.path.join(os.path.relpath(self.getSourceBuildPath(), self.getBuildPath()), "configure"),
+                                command[len("./configure"):])
+        cache = self._builder.configureCache
+        if cache and self.isAutoconf():
+            try:
+                self.execute("%s --cache-file=%s" % (command, cache.checkout(self)), "configure")
+            except ExecutionError:
+                ## A cached result may be what broke it: once more without
+                logger.warning("%s failed to configure with the shared cache, retrying without it" % (self))
+            except:
+                self._setConfigureOk(False)
+                raise
+            else:
+                cache.checkin(self)
+                command = None
+
+        if command:
+            try:
+                self.execute(command, "configure")
+            except:
+                self._setConfigureOk(False)
+                raise
+            if cache and self.isAutoconf():
+                ## It was the cache: start a new one
+                cache.discard(self)
+        self._setConfigureOk()
+        self._setInputs("configure")
+
+    ############################################################################
+    def isAutoconf(self):
+        """
+
+        Whether our configure is an autoconf one, which takes --cache-file
+        (zlib's or Qt's are not).
+        """
+        if not self.getConfigureCommand().startswith("./configure"):
+            return False
         try:
-            self.execute(self.getConfigureCommand())
-        except:
-            self._setConfigureOk(False)
-            raise
-        self._setConfigureOk()    
+            f = open(os.path.join(self.getSourceBuildPath(), "configure"), "r")
+        except IOError:
+            return False
+        try:
+            return "Generated by GNU Autoconf" in f.read(4096)
+        finally:
+            f.close()
+
+    ############################################################################
+    def getBuildMode(self):
+        """
+
+        Out of tree, autoconf packages build in an empty directory (VPATH),
+        unless patched (the sources are pristine) or built in by others.
+        """
+        mode = AbstractBuildObject.getBuildMode(self)
+        if mode == "copy" and not self.patchfile and not self.getSharers() and self.isAutoconf():
+            return "vpath"
+        return mode
 
     ############################################################################
     def build(self):
@@ -351,7 +1097,9 @@ class SimpleBuildObject(AbstractBuildObject):
             print "%s already built..." % (self)
             return True
         
-        self.check_dependencies("build")
+        if not self.check_dependencies("build"):
+            logger.error("Dependency check failed for %s. Can't continue." % (self))
+            return False
         self.goto()
         
         command = self.getMakeCommand()
@@ -366,26 +1114,15 @@ class SimpleBuildObject(AbstractBuildObject):
             self._setBuildOk(False)
             raise
         self._setBuildOk()
+        self.recordSources()
         return True
     
     ############################################################################
-    def install(self):
-        if self.isInstalled():
-            print "%s already installed..." % (self)
-            return True
-        
-        if not self.check_dependencies("install"):
-            logger.error("Dependency check failed for %s. Can't continue." % (self))
-            return False
-
-        self.goto()
-        try:
-            self.execute("%s install" % (config.MAKE))
-        except:
-            self._setInstallOk(False)
-            raise
-        
-        self._setInstallOk()
+    def getInstallCommands(self, destdir = None):
+        command = "%s install" % (config.MAKE)
+        if destdir:
+            command += " DESTDIR=%s" % (destdir, )
+        return [ command ]
 
 ################################################################################
 class PythonBuildObject(AbstractBuildObject):
@@ -395,24 +1132,30 @@ class PythonBuildObject(AbstractBuildObject):
     python setup.py install
     """
     ############################################################################
-    def __init__(self, name, version, filename, url = [], dependencies = [], builddir = None, patch = None):
-        AbstractBuildObject.__init__(self, name, version, filename, url, dependencies, patch = patch)
+    def __init__(self, name, version, filename, url = [], dependencies = [], builddir = None, patch = None, variant = None,
+                       environment = None, tree = None):
         self.builddir = builddir
+        AbstractBuildObject.__init__(self, name, version, filename, url, dependencies, patch = patch,
+                                     variant = variant or builddir, environment = environment)
+        ## eg. the setup.py of Python, run in the tree of its make
+        self.tree = tree
 
     ############################################################################
-    def getBuildPath(self):
+    def getSubdirectory(self):
         if self.builddir:
-            return os.path.join(self._builder.buildroot, self.getRepository(), self.builddir)
-        else:
-            return AbstractBuildObject.getBuildPath(self)
+            return os.path.join(AbstractBuildObject.getSubdirectory(self), self.builddir)
+        return AbstractBuildObject.getSubdirectory(self)
 
     ############################################################################
-    def _isFile(self, file):
-        return AbstractBuildObject._isFile(self, "python.%s" % (file, ))
+    def _getStampName(self, file):
+        ## Stamps of a tree of our own can't collide
+        if self.getBuildMode() == "copy":
+            return file
+        return "python.%s" % (file, )
 
     ############################################################################
-    def _setFile(self, file, ok = True):
-        return AbstractBuildObject._setFile(self, "python.%s" % (file, ), ok)
+    def getCacheInputs(self):
+        return AbstractBuildObject.getCacheInputs(self) + [ self.builddir, self._builder.getPythonBin() ]
 
     ############################################################################
     def isConfigure(self):
@@ -434,29 +1177,19 @@ class PythonBuildObject(AbstractBuildObject):
         self.goto()
 
         try:
-            self.execute("%s setup.py build" % (config.PYTHON_BIN))
+            self.execute("%s setup.py build" % (self._builder.getPythonBin()))
         except:
             self._setBuildOk(False)
             raise
         self._setBuildOk()
+        self.recordSources()
 
     ############################################################################
-    def install(self):
-        if self.isInstalled():
-            print "%s already installed..." % (self)
-            return True
-        
-        if not self.check_dependencies("install"):
-            logger.error("Dependency check failed for %s. Can't continue." % (self))
-            return False
-        self.goto()
-        try:
-            self.execute("%s setup.py install --prefix=%s" % (config.PYTHON_BIN, config.PREFIX))
-        except:
-            self._setInstallOk(False)
-            raise
-        
-        self._setInstallOk()
+    def getInstallCommands(self, destdir = None):
+        command = "%s setup.py install --prefix=%s" % (self._builder.getPythonBin(), self.getPrefix())
+        if destdir:
+            command += " --root=%s" % (destdir, )
+        return [ command ]
 
 ################################################################################
 class PostgreSQLBuildObject(SimpleBuildObject):
@@ -483,24 +1216,37 @@ class BZIP2BuildObject(SimpleBuildObject):
         return "-fPIC"
 
     ############################################################################
-    def install(self):
-        if self.isInstalled():
-            print "%s already installed..." % (self)
-            return True
-        
-        if not self.check_dependencies("install"):
-            logger.error("Dependency check failed for %s. Can't continue." % (self))
+    def getInstallCommands(self, destdir = None):
+        ## No DESTDIR support: PREFIX is the staged one
+        prefix = self.getPrefix()
+        if destdir:
+            prefix = os.path.join(destdir, prefix.lstrip(os.sep))
+        return [ "%s install PREFIX=%s" % (config.MAKE, prefix),
+                 "%s -f Makefile-libbz2_so PREFIX=%s" % (config.MAKE, prefix),
+                 "cp libbz2.so* %s" % (os.path.join(prefix, "lib")) ]
+
+    ############################################################################
+    def install(self, destdir = None):
+        """
+
+        make install links bzegrep, bzfgrep, bzless and bzcmp to
+        $(PREFIX)/bin/...: staged, they would point into `destdir`.
+        They are made relative.
+        """
+        if not SimpleBuildObject.install(self, destdir):
             return False
-        self.goto()
-        try:
-            self.execute("%s install PREFIX=%s" % (config.MAKE, config.PREFIX))
-            self.execute("%s -f Makefile-libbz2_so PREFIX=%s" % (config.MAKE, config.PREFIX))
-            self.execute("cp libbz2.so* %s" % (os.path.join(config.PREFIX, "lib")))
-        except:
-            self._setInstallOk(False)
-            raise
-        
-        self._setInstallOk()
+        bindir = destdir and os.path.join(destdir, self.getPrefix().lstrip(os.sep), "bin")
+        if not bindir or not os.path.isdir(bindir):
+            return True
+        for name in os.listdir(bindir):
+            path = os.path.join(bindir, name)
+            if not os.path.islink(path):
+                continue
+            target = os.readlink(path)
+            if os.path.isabs(target) and target.startswith(destdir.rstrip(os.sep) + os.sep):
+                os.unlink(path)
+                os.symlink(os.path.relpath(target, bindir), path)
+        return True
 
 
 ################################################################################
@@ -511,29 +1257,49 @@ class ComplexBuildObject(SimpleBuildObject):
     """
     ############################################################################
     def __init__(self, name, version, filename, url = [], dependencies = [],
-                       configureArgs = "", makeArgs = "", override_makeflags = False, patch = None):
-        SimpleBuildObject.__init__(self, name, version, filename, url, dependencies, patch = patch)
+                       configureArgs = "", makeArgs = "", override_makeflags = False, patch = None,
+                       variant = None, environment = None):
+        SimpleBuildObject.__init__(self, name, version, filename, url, dependencies, patch = patch,
+                                   variant = variant, environment = environment)
         self._makeArgs      = makeArgs
         self._configureArgs = configureArgs
         self._override_makeflags = override_makeflags
 
     ############################################################################
     def getConfigureCommand(self):
-        configureString = "./configure --prefix=%s" % (config.PREFIX)
+        configureString = "./configure --prefix=%s" % (self.getPrefix())
         if self._configureArgs:
             configureString += " %s" % (self._configureArgs)
         return configureString
 
     ############################################################################
     def getMakeCommand(self):
-        commandString = "%s" % (config.MAKE)
+        commandString = "%s" % (self.getMake())
         if not self._override_makeflags:
-            commandString += " %s" % (config.GMAKE_FLAGS)
+            commandString += " %s" % (self.getMakeFlags())
         
         if self._makeArgs:
             commandString += " %s" % (self._makeArgs)
         return commandString
 
+    ############################################################################
+    def getCacheInputs(self):
+        return SimpleBuildObject.getCacheInputs(self) + [
+            self._configureArgs, self._makeArgs, self._override_makeflags ]
+
+    ############################################################################
+    def getMaxJobs(self):
+        """
+
+        An explicit -jN in makeArgs wins over ours: don't give more slots.
+        """
+        if self._override_makeflags:
+            return 1
+        jobs = re.findall(r"(?:^|\s)-j\s*(\d+)", self._makeArgs)
+        if jobs:
+            return int(jobs[-1])
+        return None
+
 ################################################################################
 class QtBuildObject(ComplexBuildObject):
     """
@@ -541,10 +1307,17 @@ class QtBuildObject(ComplexBuildObject):
     For Qt 3.3
     """
 
+    ############################################################################
+    def getInstallCommands(self, destdir = None):
+        command = "%s install" % (config.MAKE)
+        if destdir:
+            command += " INSTALL_ROOT=%s" % (destdir, )
+        return [ command ]
+
     ############################################################################
     def getConfigureCommand(self):
-        os.path.join(config.PREFIX, "include")
-        configureString = "./configure -prefix %s -I%s -I/usr/include/freetype2 -I/usr/include/xorg -I/usr/include/X11 -L%s -L/usr/lib/i386-linux-gnu" % (config.PREFIX, os.path.join(config.PREFIX, "include"), os.path.join(config.PREFIX, "lib"))
+        prefix = self.getPrefix()
+        configureString = "./configure -prefix %s -I%s -I/usr/include/freetype2 -I/usr/include/xorg -I/usr/include/X11 -L%s -L/usr/lib/i386-linux-gnu" % (prefix, os.path.join(prefix, "include"), os.path.join(prefix, "lib"))
         if self._configureArgs:
             configureString += " %s" % (self._configureArgs)
         return configureString
@@ -557,16 +1330,11 @@ class PopplerBuildObject(ComplexBuildObject):
     """
     
     ############################################################################
-    def configure(self):
-        os.environ["QTINC"] = os.path.join(config.PREFIX, "include")
-        os.environ["QTLIB"] = os.path.join(config.PREFIX, "lib")
-        ComplexBuildObject.configure(self)
-
-    ############################################################################
-    def build(self):
-        os.environ["QTLIB"] = os.path.join(config.PREFIX, "lib")
-        os.environ["QTINC"] = os.path.join(config.PREFIX, "include")
-        ComplexBuildObject.configure(self)
+    def getEnvironmentOverrides(self):
+        environment = ComplexBuildObject.getEnvironmentOverrides(self)
+        environment.setdefault("QTINC", os.path.join(self.getPrefix(), "include"))
+        environment.setdefault("QTLIB", os.path.join(self.getPrefix(), "lib"))
+        return environment
 
 ################################################################################
 class QStyleBuildObject(ComplexBuildObject):
@@ -576,14 +1344,10 @@ class QStyleBuildObject(ComplexBuildObject):
     """
     
     ############################################################################
-    def configure(self):
-        os.environ["QTDIR"] = config.PREFIX
-        ComplexBuildObject.configure(self)
-
-    ############################################################################
-    def build(self):
-        os.environ["QTDIR"] = config.PREFIX
-        ComplexBuildObject.configure(self)
+    def getEnvironmentOverrides(self):
+        environment = ComplexBuildObject.getEnvironmentOverrides(self)
+        environment.setdefault("QTDIR", self.getPrefix())
+        return environment
 
 ################################################################################
 class PyQtBuildObject(ComplexBuildObject):
@@ -594,6 +1358,14 @@ class PyQtBuildObject(ComplexBuildObject):
     make install
     """
 
+    ############################################################################
+    def getInstallCommands(self, destdir = None):
+        ## sipconfig generated Makefiles prefix their paths with $(DESTDIR)
+        command = "%s install" % (config.MAKE)
+        if destdir:
+            command += " DESTDIR=%s" % (destdir, )
+        return [ command ]
+
     ############################################################################
     def getConfigureCommand(self):
         configureString = "python configure.py"
@@ -613,8 +1385,8 @@ class TCLBuildObject(ComplexBuildObject):
         return "%s%s" % (self.name, self.version)
 
     ############################################################################
-    def getBuildPath(self):
-        return os.path.join(self._builder.buildroot, self.getRepository(), "unix")
+    def getSubdirectory(self):
+        return "unix"
 
 class SambaBuildObject(ComplexBuildObject):
     """
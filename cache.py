@@ -0,0 +1,107 @@
+import os
+import os.path
+import hashlib
+import tarfile
+import threading
+
+import logging
+logger = logging.getLogger("builder")
+
+## (filename, size, mtime) -> digest, see fileDigest()
+_digests = {}
+_digestsLock = threading.Lock()
+
+
+################################################################################
+def fileDigest(filename):
+    """
+
+    SHA-1 of a file content, computed once per process and file version.
+    """
+    st = os.stat(filename)
+    memo = (filename, st.st_size, st.st_mtime)
+    _digestsLock.acquire()
+    try:
+        if memo in _digests:
+            return _digests[memo]
+    finally:
+        _digestsLock.release()
+
+    digest = hashlib.sha1()
+    f = open(filename, "rb")
+    try:
+        while 1:
+            data = f.read(1 << 20)
+            if not data:
+                break
+            digest.update(data)
+    finally:
+        f.close()
+
+    _digestsLock.acquire()
+    try:
+        _digests[memo] = digest.hexdigest()
+    finally:
+        _digestsLock.release()
+    return digest.hexdigest()
+
+
+################################################################################
+class ArtifactCache(object):
+    """
+
+    Directory of packed install trees, named after the cache key of the
+    build object which produced them.
+    """
+
+    ############################################################################
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    ############################################################################
+    def getPath(self, key):
+        return os.path.join(self.directory, "%s.tar.gz" % (key, ))
+
+    ############################################################################
+    def has(self, key):
+        return os.path.isfile(self.getPath(key))
+
+    ############################################################################
+    def store(self, key, root, files):
+        """
+
+        Pack `files` (relative to `root`) as the artifact of `key`.
+        """
+        filename = self.getPath(key)
+        tmpname = "%s.%d.%s.tmp" % (filename, os.getpid(), threading.current_thread().ident)
+        archive = tarfile.open(tmpname, "w:gz")
+        try:
+            for path in files:
+                archive.add(os.path.join(root, path), arcname = path, recursive = False)
+        finally:
+            archive.close()
+        os.rename(tmpname, filename)
+        logger.info("Stored %d files as artifact %s" % (len(files), key))
+
+    ############################################################################
+    def restore(self, key, root):
+        """
+
+        Unpack the artifact of `key` into `root`.
+        Returns the list of restored files.
+        """
+        archive = tarfile.open(self.getPath(key), "r:gz")
+        try:
+            members = []
+            for member in archive.getmembers():
+                path = os.path.normpath(member.name)
+                if os.path.isabs(path) or path.startswith(os.pardir):
+                    logger.warning("Skipping %s from artifact %s" % (member.name, key))
+                    continue
+                members.append(member)
+            archive.extractall(root, members)
+        finally:
+            archive.close()
+        return [ member.name for member in members ]
@@ -0,0 +1,131 @@
+import os
+import os.path
+import subprocess
+from distutils.spawn import find_executable
+
+import config
+
+import logging
+logger = logging.getLogger("builder")
+
+## Compilers wrapped by default, on top of those of the builders (config.CC,
+## or the one of their matrix.Target)
+COMPILERS = [ "cc", "gcc", "c++", "g++" ]
+
+
+################################################################################
+class CompilerCache(object):
+    """
+
+    A ccache shared by every build object: a cache directory of bounded
+    size, and a directory of compiler names linked to ccache put first
+    in the PATH of the commands (ccache "masquerade" mode), which also
+    catches builds ignoring $CC (eg. qmake ones).
+    """
+
+    ############################################################################
+    def __init__(self, ccache, directory, maxsize = None):
+        self.ccache     = ccache
+        self.directory  = directory
+        self.maxsize    = maxsize
+        self.bindir     = os.path.join(directory, "bin")
+
+    ############################################################################
+    @staticmethod
+    def create(distfiles):
+        """
+
+        The compiler cache configured in config, or None if disabled or
+        ccache can't be found.
+        """
+        if config.CCACHE is False:
+            return None
+        ccache = find_executable(config.CCACHE or "ccache")
+        if not ccache:
+            if config.CCACHE:
+                logger.warning("Compiler cache %s not found, building without it." % (config.CCACHE, ))
+            return None
+        directory = config.CCACHE_DIR or os.path.join(os.path.dirname(os.path.abspath(distfiles)), "ccache")
+        return CompilerCache(os.path.abspath(ccache), directory, config.CCACHE_MAXSIZE)
+
+    ############################################################################
+    def setup(self, compilers = ()):
+        """
+
+        Create the cache and compiler directories, wrapping `compilers`
+        (commands, like CC) too, and apply the size limit: ccache evicts
+        the oldest objects beyond it.
+        """
+        if not os.path.isdir(self.bindir):
+            os.makedirs(self.bindir)
+
+        for compiler in COMPILERS + [ os.path.basename(cc.split()[0]) for cc in compilers ]:
+            link = os.path.join(self.bindir, compiler)
+            if os.path.realpath(link) != os.path.realpath(self.ccache):
+                try:
+                    if os.path.lexists(link):
+                        os.unlink(link)
+                    os.symlink(self.ccache, link)
+                except OSError:
+                    ## Linked by another builder meanwhile (see matrix.Matrix)
+                    if os.path.realpath(link) != os.path.realpath(self.ccache):
+                        raise
+
+        if self.maxsize:
+            env = dict(os.environ)
+            env["CCACHE_DIR"] = self.directory
+            devnull = open(os.devnull, "w")
+            try:
+                if subprocess.call([ self.ccache, "-M", self.maxsize ], env = env, stdout = devnull) != 0:
+                    logger.warning("Unable to set the compiler cache size to %s" % (self.maxsize, ))
+            finally:
+                devnull.close()
+
+    ############################################################################
+    def getEnvironment(self, statslog, cc = None):
+        """
+
+        Variables for the commands of a build object; `statslog` collects
+        its cache results. A `cc` given with its path (eg. a CC of a
+        matrix target) isn't looked for in the PATH: it runs through
+        ccache explicitly.
+        """
+        environment = { "CCACHE_DIR"      : self.directory,
+                        "CCACHE_STATSLOG" : statslog }
+        if cc and os.path.isabs(cc.split()[0]):
+            environment["CC"] = "%s %s" % (self.ccache, cc)
+        return environment
+
+    ############################################################################
+    def resetStats(self, statslog):
+        try:
+            os.unlink(statslog)
+        except OSError:
+            pass
+
+    ############################################################################
+    def readStats(self, statslog):
+        """
+
+        (hits, misses) of the compilations logged in `statslog`, or None if
+        there is none (no compilation, or a ccache without CCACHE_STATSLOG
+        support).
+        """
+        try:
+            f = open(statslog, "r")
+        except IOError:
+            return None
+
+        hits = misses = 0
+        try:
+            for line in f:
+                line = line.strip()
+                if line.startswith("#"):
+                    continue
+                if line.endswith("cache_hit"):
+                    hits += 1
+                elif line.endswith("cache_miss"):
+                    misses += 1
+        finally:
+            f.close()
+        return hits, misses
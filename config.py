@@ -10,21 +10,110 @@ CC = "gcc" # -m64"
 ## gMake flags (eg. -j8)
 GMAKE_FLAGS = "-j4"
 
+## Machine-wide job budget, shared between the packages built at the same time.
+## The -jN of config.GMAKE_FLAGS is replaced by a GNU make jobserver (see
+## scheduler.JobServer), or by each package's share if it has a limit.
+## None means the number of cores.
+JOBS = None
+
+## Memory available to concurrent builds, in MB: builds which used more than
+## what is left (see the build history) wait for the others.
+## None means the physical memory, False no limit.
+MEMORY = None
+
 ## Where to install our stuff ?
 PREFIX = "/clarilab"
 
 ## Defautt is to use our python!
 PYTHON_BIN = os.path.join(PREFIX, "bin", "python")
 
+## Out-of-tree builds: every object builds in a directory of its own
+## (build/NAME below the build root), from one pristine read-only source
+## tree per distfile; autoconf packages with VPATH, the others in a hard
+## linked copy of the sources (but for the files builds rewrite). A tree
+## built in place is extracted again.
+OUT_OF_TREE = False
+
+## Matrix build (see matrix.Matrix): the same projects for several
+## configurations at once, "NAME:PREFIX[:CC[:CFLAGS[:LDFLAGS]]]" each.
+## Empty: a single build for PREFIX and CC.
+TARGETS = [ ]
+
+## Distfile store shared by all the build roots of the host (see
+## distfilestore.DistfileStore): distfiles directories become views of it.
+## None disables it.
+DISTFILE_STORE = None
+
+## Scratch space for the build trees (eg. a tmpfs such as /dev/shm/claribuild,
+## or a local disk): trees expected to fit, keeping SCRATCH_RESERVE MB free,
+## are built there and removed once installed (unless SCRATCH_KEEP).
+## A never built tree is expected to take SCRATCH_EXPANSION times its distfile.
+## None disables it.
+SCRATCH = None
+SCRATCH_RESERVE = 1024
+SCRATCH_KEEP = False
+SCRATCH_EXPANSION = 8
+
+## Build cache: install trees packed by cache key, restored instead of rebuilt.
+## None means an "artifacts" directory next to the distfiles one, False disables it.
+ARTIFACTS = None
+
+## Compiler cache: ccache binary (None looks for "ccache" in PATH, False disables it),
+## its shared directory (None means a "ccache" directory next to the distfiles one)
+## and its maximum size (ccache evicts the oldest objects beyond it).
+CCACHE = None
+CCACHE_DIR = None
+CCACHE_MAXSIZE = "5G"
+
+## Shared autoconf cache (--cache-file) of the configure results, one per
+## compiler, flags and prefix, and per contents of the prefix for the results
+## depending on it (headers, functions...): directory (None means a "configcache"
+## directory next to the distfiles one, False disables it).
+CONFIGURE_CACHE = None
+
+## Binary packages: directory (None means a "packages" directory next to the
+## distfiles one), whether to export every installed package there, and
+## whether to install matching packages (same version and cache key) instead
+## of building.
+PACKAGES = None
+EXPORT_PACKAGES = False
+IMPORT_PACKAGES = False
+
+## Installs are staged in a DESTDIR, then merged into the prefix, whose files
+## are owned by the package which installed them (<prefix>/.installed.json).
+## A package installing a file owned by another one: "warn" (it takes the
+## file over) or "error" (the install fails, the prefix is left untouched).
+INSTALL_CONFLICTS = "warn"
+
 MAKE = "/usr/bin/make"
 
 PATCH = "/usr/bin/patch"
 
+## Our own distfile mirrors, the default URLs of the manifest declarations
+CLARILAB_MIRROR = [ ]
+
 MIRROR = [ "http://path/to/mirror/", ]
 
-WGET = "/usr/bin/wget"
+## Number of distfiles downloaded at the same time
+FETCH_JOBS = 4
+
+## Keep building what doesn't depend on a failed package, instead of
+## stopping at the first failure.
+KEEP_GOING = False
+
+## Network timeout (in seconds) of a download
+FETCH_TIMEOUT = 60
 
 ## Should I show all executed stuff ?
 VERBOSE = True
 
+## Progress report: a status line at most every DASHBOARD_INTERVAL seconds
+## (see events.Dashboard), which also prints the output when VERBOSE.
+DASHBOARD = True
+DASHBOARD_INTERVAL = 5
+
+## Complete command outputs are in buildroot/logs/<package>/<phase>.log;
+## only that many last lines are kept for error reports.
+LOG_TAIL = 50
+
 ## This configuration should not been modified unless you really know what you are doing !
@@ -0,0 +1,199 @@
+import os
+import os.path
+import re
+import fcntl
+import hashlib
+
+from util import writeFile
+
+import logging
+logger = logging.getLogger("builder")
+
+## Results which only depend on the compiler, its flags and the system:
+## shared between all the packages
+SHARED_PREFIXES = ("ac_cv_c_", "ac_cv_sys_", "ac_cv_prog_cc_", "ac_cv_objext", "ac_cv_exeext",
+                   "ac_cv_build", "ac_cv_host")
+## Results which depend on the headers and libraries installed in the prefix
+## too: shared only as long as the prefix contents don't change
+INSTALLED_PREFIXES = ("ac_cv_header_", "ac_cv_func_", "ac_cv_type_", "ac_cv_sizeof_", "ac_cv_alignof_",
+                      "ac_cv_member_", "ac_cv_have_decl_")
+
+CACHE_LINE_RE = re.compile(r"^(\w+)=")
+CHECK_RE = re.compile(r"^checking ")
+CACHED_RE = re.compile(r"\(cached\)")
+
+
+################################################################################
+def readCacheFile(filename):
+    """
+
+    {variable: line} of an autoconf cache file.
+    """
+    entries = {}
+    try:
+        f = open(filename, "r")
+    except IOError:
+        return entries
+    try:
+        for line in f:
+            match = CACHE_LINE_RE.match(line)
+            if match:
+                entries[match.group(1)] = line.rstrip("\n")
+    finally:
+        f.close()
+    return entries
+
+
+################################################################################
+class ConfigureCache(object):
+    """
+
+    autoconf caches shared by the packages: one per compiler, flags and
+    prefix (see getKey()), so changing any of them starts a new one.
+    Results which depend on the contents of the prefix (INSTALLED_PREFIXES,
+    eg. a header found or not) are in another cache, one per generation
+    of the prefix (see installdb.InstallDB.getGeneration()): a header
+    missing before a dependency installs it isn't missing anymore after.
+
+    Before configuring, a package gets a copy of the shared caches
+    (checkout()); after a successful configure, its generic results are
+    merged back (checkin()), under a lock: other builders may share the
+    directory.
+    """
+
+    ## Cache file of the packages, in their build tree
+    FILENAME = "config.cache.shared"
+
+    ############################################################################
+    def __init__(self, directory):
+        self.directory = directory
+        ## object -> generation of the prefix its cache was checked out from
+        self._generations = {}
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    ############################################################################
+    def getKey(self, obj):
+        environment = obj.getEnvironment()
+        digest = hashlib.sha1()
+        for value in (obj._builder.getCC(), obj.getCflags(), obj.getPrefix(), os.uname()[0], os.uname()[4],
+                      environment.get("CFLAGS"), environment.get("CPPFLAGS"), environment.get("LDFLAGS")):
+            digest.update("%r\0" % (value, ))
+        return digest.hexdigest()
+
+    ############################################################################
+    def getPath(self, obj):
+        return os.path.join(self.directory, "%s.cache" % (self.getKey(obj), ))
+
+    ############################################################################
+    def getInstalledPath(self, obj, generation = None):
+        if generation is None:
+            generation = obj._builder.installed.getGeneration()
+        return os.path.join(self.directory, "%s-%s.cache" % (self.getKey(obj), generation))
+
+    ############################################################################
+    def _write(self, filename, entries):
+        writeFile(filename, "".join([ "%s\n" % (entries[variable], ) for variable in sorted(entries) ]))
+
+    ############################################################################
+    def _lock(self, obj):
+        f = open("%s.lock" % (self.getPath(obj), ), "a")
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return f
+
+    ############################################################################
+    def _unlock(self, f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+
+    ############################################################################
+    def checkout(self, obj):
+        """
+
+        Copy the shared cache into the build tree of `obj`.
+        Returns the name of the copy, relative to the build tree.
+        """
+        filename = os.path.join(obj.getBuildPath(), self.FILENAME)
+        generation = self._generations[obj] = obj._builder.installed.getGeneration()
+        lock = self._lock(obj)
+        try:
+            entries = readCacheFile(self.getPath(obj))
+            entries.update(readCacheFile(self.getInstalledPath(obj, generation)))
+        finally:
+            self._unlock(lock)
+        if entries:
+            self._write(filename, entries)
+        elif os.path.exists(filename):
+            os.unlink(filename)
+        return self.FILENAME
+
+    ############################################################################
+    def checkin(self, obj):
+        """
+
+        Merge the generic results of the configure of `obj` into the shared
+        cache. Those depending on the prefix contents are dropped if other
+        packages were installed meanwhile.
+        """
+        entries = readCacheFile(os.path.join(obj.getBuildPath(), self.FILENAME))
+        generation = self._generations.pop(obj, None)
+        current = obj._builder.installed.getGeneration()
+        caches = [ (self.getPath(obj), SHARED_PREFIXES) ]
+        if generation == current:
+            caches.append((self.getInstalledPath(obj, current), INSTALLED_PREFIXES))
+        lock = self._lock(obj)
+        try:
+            added = 0
+            for path, prefixes in caches:
+                shared = readCacheFile(path)
+                new = dict([ (variable, line) for variable, line in entries.items()
+                             if variable.startswith(prefixes) and variable not in shared ])
+                if new:
+                    shared.update(new)
+                    self._write(path, shared)
+                    added += len(new)
+            if added:
+                logger.info("%d configure results of %s added to the shared cache" % (added, obj))
+            ## Caches of the previous generations of the prefix are of no use anymore
+            keep = os.path.basename(self.getInstalledPath(obj, current))
+            for name in os.listdir(self.directory):
+                if name.startswith("%s-" % (self.getKey(obj), )) and name.endswith(".cache") and name != keep:
+                    os.unlink(os.path.join(self.directory, name))
+        finally:
+            self._unlock(lock)
+
+    ############################################################################
+    def discard(self, obj):
+        """
+
+        Forget the shared cache of `obj` (eg. a configure failing because of it).
+        """
+        self._generations.pop(obj, None)
+        lock = self._lock(obj)
+        try:
+            for path in (self.getPath(obj), self.getInstalledPath(obj)):
+                if os.path.exists(path):
+                    os.unlink(path)
+        finally:
+            self._unlock(lock)
+
+    ############################################################################
+    def readStats(self, logfile):
+        """
+
+        (cached checks, checks) of a configure log.
+        """
+        cached = checks = 0
+        try:
+            f = open(logfile, "r")
+        except IOError:
+            return 0, 0
+        try:
+            for line in f:
+                if CHECK_RE.match(line):
+                    checks += 1
+                    if CACHED_RE.search(line):
+                        cached += 1
+        finally:
+            f.close()
+        return cached, checks
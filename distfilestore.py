@@ -0,0 +1,239 @@
+import os
+import os.path
+import json
+import time
+import errno
+import fcntl
+import shutil
+import hashlib
+import threading
+
+from util import writeJSON
+
+import logging
+logger = logging.getLogger("builder")
+
+
+################################################################################
+def fileSHA256(filename):
+    digest = hashlib.sha256()
+    f = open(filename, "rb")
+    try:
+        while 1:
+            data = f.read(1 << 20)
+            if not data:
+                break
+            digest.update(data)
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+
+################################################################################
+class DistfileStore(object):
+    """
+
+    Distfiles shared by every build root of a host, by content:
+
+        objects/<sha256[:2]>/<sha256>   read-only distfiles
+        manifest.json                   distfile name -> sha256, size, dates
+        .lock                           taken while changing the manifest
+
+    Projects don't use the store directly: their distfiles directory is
+    a view of hard links to its objects (copies across filesystems, which
+    the manifest lists with their object to keep it alive).
+    Objects are inserted with a rename, and the manifest is only changed
+    under an exclusive lock, so several builders (processes) can share a
+    store. collect() removes the objects no view uses anymore.
+    """
+
+    ############################################################################
+    def __init__(self, directory):
+        self.directory  = directory
+        self.objects    = os.path.join(directory, "objects")
+        self.manifest   = os.path.join(directory, "manifest.json")
+        if not os.path.isdir(self.objects):
+            try:
+                os.makedirs(self.objects)
+            except OSError, err:
+                if err.errno != errno.EEXIST:
+                    raise
+
+    ############################################################################
+    def _lock(self):
+        f = open(os.path.join(self.directory, ".lock"), "a")
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return f
+
+    ############################################################################
+    def _unlock(self, f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+
+    ############################################################################
+    def _readManifest(self):
+        try:
+            f = open(self.manifest, "r")
+        except IOError:
+            return {}
+        try:
+            try:
+                return json.load(f)
+            except ValueError:
+                logger.warning("Ignoring the corrupted distfile manifest %s" % (self.manifest, ))
+                return {}
+        finally:
+            f.close()
+
+    ############################################################################
+    def _writeManifest(self, manifest):
+        writeJSON(self.manifest, manifest)
+
+    ############################################################################
+    def getPath(self, checksum):
+        return os.path.join(self.objects, checksum[:2], checksum)
+
+    ############################################################################
+    def lookup(self, file, checksum = None):
+        """
+
+        The object of distfile `file`, None if not in the store.
+        With a `checksum`, only that content will do.
+        """
+        if checksum is None:
+            entry = self._readManifest().get(file)
+            if entry is None:
+                return None
+            checksum = entry["sha256"]
+        path = self.getPath(checksum)
+        if os.path.isfile(path):
+            return path
+        return None
+
+    ############################################################################
+    def _addCopy(self, entry, destination):
+        """
+
+        Record `destination` as a copy of the object of manifest `entry`.
+        Returns True if the entry changed.
+        """
+        copies = entry.setdefault("copies", [])
+        if os.path.abspath(destination) in copies:
+            return False
+        copies.append(os.path.abspath(destination))
+        return True
+
+    ############################################################################
+    def addCopy(self, file, destination):
+        """
+
+        Record `destination`, a view file, as a copy of the object of
+        `file`: copies don't count in the link count of their object
+        (see collect()).
+        """
+        lock = self._lock()
+        try:
+            manifest = self._readManifest()
+            entry = manifest.get(file)
+            if entry is not None and self._addCopy(entry, destination):
+                self._writeManifest(manifest)
+        finally:
+            self._unlock(lock)
+
+    ############################################################################
+    def insert(self, filename, file, checksum = None, view = None):
+        """
+
+        Add `filename` to the store as distfile `file`, hard linked if
+        possible: `filename` becomes read-only. `view` is where it ends
+        up in the view of the caller, if elsewhere (a download renamed
+        once inserted). Returns the object path.
+        """
+        if checksum is None:
+            checksum = fileSHA256(filename)
+        path = self.getPath(checksum)
+        if not os.path.isfile(path):
+            if not os.path.isdir(os.path.dirname(path)):
+                try:
+                    os.makedirs(os.path.dirname(path))
+                except OSError, err:
+                    if err.errno != errno.EEXIST:
+                        raise
+            os.chmod(filename, 0444)
+            self.link(filename, path)
+
+        lock = self._lock()
+        try:
+            manifest = self._readManifest()
+            entry = manifest.get(file)
+            changed = False
+            if entry is None or entry["sha256"] != checksum:
+                entry = manifest[file] = { "sha256" : checksum,
+                                           "size"   : os.path.getsize(path),
+                                           "added"  : int(time.time()) }
+                changed = True
+            if not os.path.samefile(filename, path):
+                changed = self._addCopy(entry, view or filename) or changed
+            if changed:
+                self._writeManifest(manifest)
+        finally:
+            self._unlock(lock)
+        return path
+
+    ############################################################################
+    def link(self, path, destination):
+        """
+
+        Put `path` at `destination` (an object in a view, or a file in the
+        store), atomically: a hard link, or a copy across filesystems.
+        Returns False for a copy.
+        """
+        tmpname = "%s.%d.%s.tmp" % (destination, os.getpid(), threading.current_thread().ident)
+        try:
+            os.link(path, tmpname)
+        except OSError, err:
+            if err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            shutil.copyfile(path, tmpname)
+            os.rename(tmpname, destination)
+            return False
+        os.rename(tmpname, destination)
+        return True
+
+    ############################################################################
+    def collect(self):
+        """
+
+        Remove the objects no view uses anymore (link count of 1, and no
+        recorded copy left), and their manifest entries. Returns the
+        number of bytes freed.
+        """
+        freed = 0
+        lock = self._lock()
+        try:
+            manifest = self._readManifest()
+            copied = set()
+            for file, entry in manifest.items():
+                copies = [ copy for copy in entry.get("copies", []) if os.path.isfile(copy) ]
+                if copies:
+                    entry["copies"] = copies
+                    copied.add(entry["sha256"])
+                elif "copies" in entry:
+                    del entry["copies"]
+            for dirpath, dirnames, filenames in os.walk(self.objects):
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    if name.endswith(".tmp"):
+                        continue
+                    stat = os.stat(path)
+                    if stat.st_nlink == 1 and name not in copied:
+                        logger.info("Removing unused distfile object %s" % (name, ))
+                        os.unlink(path)
+                        freed += stat.st_size
+            for file, entry in manifest.items():
+                if not os.path.isfile(self.getPath(entry["sha256"])):
+                    del manifest[file]
+            self._writeManifest(manifest)
+        finally:
+            self._unlock(lock)
+        return freed
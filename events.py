@@ -0,0 +1,245 @@
+import sys
+import time
+import threading
+import Queue
+
+import logging
+logger = logging.getLogger("builder")
+
+
+################################################################################
+class Event(object):
+    """
+
+    Something which happened during a build:
+
+        build-start     objects, eta            the scheduler starts
+        build-end       ok, duration, dropped (output events)
+        phase-start     name, phase             see Builder._runPhase()
+        phase-end       name, phase, ok, duration
+        progress        done, total, eta        after each object
+        download        name, size, total       while fetching a distfile
+        output          name, line              a line of command output
+
+    `name` is the qualified name of the object (the file name for
+    downloads), `eta` the expected remaining seconds, None if unknown.
+    """
+
+    ############################################################################
+    def __init__(self, kind, name = None, **data):
+        self.kind   = kind
+        self.name   = name
+        self.time   = time.time()
+        self.data   = data
+
+    ############################################################################
+    def __getattr__(self, attribute):
+        try:
+            return self.__dict__["data"][attribute]
+        except KeyError:
+            raise AttributeError(attribute)
+
+    ############################################################################
+    def __repr__(self):
+        return "<Event %s %s %r>" % (self.kind, self.name, self.data)
+
+
+################################################################################
+class EventBus(object):
+    """
+
+    Delivers events to the subscribed callbacks from its own thread:
+    emitting never blocks. When the callbacks can't keep up, output events
+    are dropped (and counted) rather than slowing the build down.
+    """
+
+    ############################################################################
+    def __init__(self, size = 10000):
+        self.callbacks  = []
+        self.dropped    = 0
+        self._queue     = Queue.Queue(size)
+        self._thread    = None
+        self._lock      = threading.Lock()
+
+    ############################################################################
+    def subscribe(self, callback):
+        """
+
+        Call `callback(event)` for every event from now on.
+        """
+        self._lock.acquire()
+        try:
+            self.callbacks.append(callback)
+            if self._thread is None:
+                self._thread = threading.Thread(target = self._dispatch, name = "events")
+                self._thread.daemon = True
+                self._thread.start()
+        finally:
+            self._lock.release()
+
+    ############################################################################
+    def unsubscribe(self, callback):
+        self._lock.acquire()
+        try:
+            self.callbacks.remove(callback)
+        finally:
+            self._lock.release()
+
+    ############################################################################
+    def emit(self, kind, name = None, **data):
+        if not self.callbacks:
+            return
+        event = Event(kind, name, **data)
+        try:
+            self._queue.put_nowait(event)
+        except Queue.Full:
+            if kind == "output":
+                self.dropped += 1
+            else:
+                ## Rare, and worth waiting for
+                self._queue.put(event)
+
+    ############################################################################
+    def flush(self):
+        """
+
+        Wait until the events emitted so far are delivered.
+        """
+        if self._thread is not None:
+            self._queue.join()
+
+    ############################################################################
+    def _dispatch(self):
+        while 1:
+            event = self._queue.get()
+            try:
+                for callback in list(self.callbacks):
+                    try:
+                        callback(event)
+                    except Exception, err:
+                        logger.warning("Event callback %r failed on %r: %s" % (callback, event, err))
+            finally:
+                self._queue.task_done()
+
+
+################################################################################
+class OutputEcho(object):
+    """
+
+    Stream-like echo of a command (see runner.Command): each line
+    becomes an output event.
+    """
+
+    ############################################################################
+    def __init__(self, events, name):
+        self.events = events
+        self.name   = name
+
+    ############################################################################
+    def write(self, line):
+        self.events.emit("output", self.name, line = line)
+
+
+################################################################################
+class Dashboard(object):
+    """
+
+    Compact progress report: a status line at most every `interval`
+    seconds, with the running objects, their phase, the lines of output
+    they produced so far, and the ETA. With `verbose`, output lines are
+    printed too, prefixed by their object.
+
+    The builders of a matrix share one dashboard, each subscribing
+    forTarget(): their objects are shown as TARGET/NAME, and the progress
+    adds up.
+    """
+
+    ############################################################################
+    def __init__(self, stream = None, interval = 5, verbose = False):
+        self.stream     = stream or sys.stdout
+        self.interval   = interval
+        self.verbose    = verbose
+        self.running    = {}
+        self.lines      = {}
+        ## target -> (done, total, eta)
+        self.progress   = {}
+        self.downloads  = {}
+        self._last      = 0
+        self._lock      = threading.Lock()
+
+    ############################################################################
+    def forTarget(self, target):
+        """
+
+        Callback for the events of the builder of `target`.
+        """
+        return lambda event: self(event, target)
+
+    ############################################################################
+    def __call__(self, event, target = None):
+        self._lock.acquire()
+        try:
+            self._update(event, target)
+        finally:
+            self._lock.release()
+
+    ############################################################################
+    def _update(self, event, target):
+        name = target and "%s/%s" % (target, event.name) or event.name
+        if event.kind == "output":
+            self.lines[name] = self.lines.get(name, 0) + 1
+            if self.verbose:
+                self.stream.write("[%s] %s" % (name, event.line))
+        elif event.kind == "phase-start":
+            self.running[name] = (event.phase, event.time)
+        elif event.kind == "phase-end":
+            if self.running.get(name, (None, ))[0] == event.phase:
+                del self.running[name]
+        elif event.kind == "download":
+            if event.total and event.size >= event.total:
+                self.downloads.pop(name, None)
+            else:
+                self.downloads[name] = (event.size, event.total)
+        elif event.kind == "build-start":
+            self.progress[target] = (0, len(event.objects), event.eta)
+        elif event.kind == "progress":
+            self.progress[target] = (event.done, event.total, event.eta)
+        elif event.kind == "build-end":
+            for names in (self.running, self.downloads):
+                for other in names.keys():
+                    if not target or other.startswith("%s/" % (target, )):
+                        del names[other]
+            self.show(event.time, force = True)
+            if event.dropped:
+                self.stream.write("(%d lines of output not shown: too many)\n" % (event.dropped, ))
+            return
+        self.show(event.time)
+
+    ############################################################################
+    def formatDuration(self, seconds):
+        if seconds is None:
+            return "?"
+        if seconds >= 3600:
+            return "%dh%02dm" % (seconds // 3600, seconds % 3600 // 60)
+        if seconds >= 60:
+            return "%dm%02ds" % (seconds // 60, seconds % 60)
+        return "%ds" % (seconds, )
+
+    ############################################################################
+    def show(self, now, force = False):
+        if not force and now - self._last < self.interval:
+            return
+        self._last = now
+        parts = [ "%s (%s %s, %d lines)" % (name, phase, self.formatDuration(now - start), self.lines.get(name, 0))
+                  for name, (phase, start) in sorted(self.running.items()) ]
+        parts.extend([ "%s (%d%s KB)" % (name, size >> 10, total and "/%d" % (total >> 10) or "")
+                       for name, (size, total) in sorted(self.downloads.items()) ])
+        done = sum([ progress[0] for progress in self.progress.values() ])
+        total = sum([ progress[1] for progress in self.progress.values() ])
+        etas = [ progress[2] for progress in self.progress.values() ]
+        eta = None
+        if etas and None not in etas:
+            eta = max(etas)
+        self.stream.write("[%d/%d done, ETA %s] %s\n" % (
+            done, total, self.formatDuration(eta), ", ".join(parts) or "idle"))
+        self.stream.flush()
@@ -0,0 +1,283 @@
+import os
+import os.path
+import re
+import time
+import hashlib
+import threading
+import urllib2
+
+import config
+
+import logging
+logger = logging.getLogger("builder")
+
+class FetchError(Exception): pass
+
+DISTINFO_RE = re.compile(r"^SHA256 \((.+)\) = ([0-9a-fA-F]{64})$")
+
+## Distfile -> lock: fetchers of the same distfiles (variants sharing a file,
+## the builders of a matrix) download each file once
+_locks = {}
+_locksLock = threading.Lock()
+
+
+################################################################################
+def readDistinfo(filename):
+    """
+
+    Checksums of the distfiles, one per line, BSD style:
+        SHA256 (qt-x11-free-3.3.8d.tar.gz) = 0123...
+    """
+    checksums = {}
+    try:
+        f = open(filename, "r")
+    except IOError:
+        return checksums
+    try:
+        for line in f:
+            match = DISTINFO_RE.match(line.strip())
+            if match:
+                checksums[match.group(1)] = match.group(2).lower()
+    finally:
+        f.close()
+    return checksums
+
+################################################################################
+def getURL(url, filename):
+    if url.endswith("/"):
+        return "%s%s" % (url, filename)
+    else:
+        return "%s/%s" % (url, filename)
+
+
+################################################################################
+class HeadRequest(urllib2.Request):
+    def get_method(self):
+        return "HEAD"
+
+
+################################################################################
+class Fetcher(object):
+    """
+
+    Downloads distfiles into the distfiles directory.
+
+    Mirrors of a file are probed at the same time and tried by latency,
+    partial downloads (.part files) are resumed, from the same mirror
+    unless they have a checksum, and files listed in the distinfo file
+    of the distfiles directory are checked.
+
+    With a distfile store (see distfilestore.DistfileStore), files are
+    looked for there first, and downloaded ones are added to it.
+    """
+
+    ############################################################################
+    def __init__(self, distfiles, timeout = None, store = None):
+        self.distfiles  = distfiles
+        self.store      = store
+        self.timeout    = timeout or config.FETCH_TIMEOUT
+        self.checksums  = readDistinfo(os.path.join(distfiles, "distinfo"))
+        ## events.EventBus told about the progress of the downloads, if any
+        self.events     = None
+
+    ############################################################################
+    def _probe(self, url):
+        """
+
+        Time (in seconds) to get the headers of `url`, or None if unreachable.
+        """
+        start = time.time()
+        try:
+            urllib2.urlopen(HeadRequest(url), timeout = self.timeout).close()
+        except (urllib2.URLError, IOError, ValueError), err:
+            logger.info("Mirror probe of %s failed: %s" % (url, err))
+            return None
+        return time.time() - start
+
+    ############################################################################
+    def rankURLs(self, urls):
+        """
+
+        Probe `urls` concurrently: the reachable ones, fastest first,
+        then the others (some servers don't answer HEAD requests).
+        """
+        if len(urls) < 2:
+            return list(urls)
+
+        latencies = {}
+        def probe(url):
+            latencies[url] = self._probe(url)
+        threads = [ threading.Thread(target = probe, args = (url, )) for url in urls ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return sorted([ url for url in urls if latencies.get(url) is not None ],
+                      key = lambda url: latencies[url]) + \
+               [ url for url in urls if latencies.get(url) is None ]
+
+    ############################################################################
+    def verify(self, file, filename):
+        expected = self.checksums.get(file)
+        if not expected:
+            return True
+        digest = hashlib.sha256()
+        f = open(filename, "rb")
+        try:
+            while 1:
+                data = f.read(1 << 20)
+                if not data:
+                    break
+                digest.update(data)
+        finally:
+            f.close()
+        return digest.hexdigest() == expected
+
+    ############################################################################
+    def _getPartURL(self, partname):
+        """
+
+        URL a partial download was started from, if known.
+        """
+        try:
+            f = open("%s.url" % (partname, ), "r")
+        except IOError:
+            return None
+        try:
+            return f.read().strip()
+        finally:
+            f.close()
+
+    ############################################################################
+    def _setPartURL(self, partname, url = None):
+        if url is None:
+            if os.path.exists("%s.url" % (partname, )):
+                os.unlink("%s.url" % (partname, ))
+            return
+        f = open("%s.url" % (partname, ), "w")
+        try:
+            f.write("%s\n" % (url, ))
+        finally:
+            f.close()
+
+    ############################################################################
+    def _download(self, url, partname, file = None):
+        """
+
+        Download `url` to `partname`, resuming it if it exists: if it was
+        started from the same URL, or if `file` has a checksum to verify
+        the result (another mirror may have another version of the file).
+        Progress events are about `file`.
+        """
+        offset = 0
+        if os.path.isfile(partname) and (self.checksums.get(file) or self._getPartURL(partname) == url):
+            offset = os.path.getsize(partname)
+
+        request = urllib2.Request(url)
+        if offset:
+            request.add_header("Range", "bytes=%d-" % (offset, ))
+        try:
+            response = urllib2.urlopen(request, timeout = self.timeout)
+        except urllib2.HTTPError, err:
+            if not offset or err.code != 416:
+                raise
+            ## Nothing left to get: the partial file is complete (or
+            ## longer than the file). Kept only if its checksum says so.
+            if self.checksums.get(file) and self.verify(file, partname):
+                logger.info("%s was complete already" % (partname, ))
+                return
+            logger.info("Restarting the download of %s" % (url, ))
+            os.unlink(partname)
+            return self._download(url, partname, file)
+        try:
+            if offset and response.getcode() == 206:
+                logger.info("Resuming %s at %d bytes" % (url, offset))
+                f = open(partname, "ab")
+            else:
+                offset = 0
+                f = open(partname, "wb")
+                self._setPartURL(partname, url)
+            length = response.info().getheader("Content-Length")
+            total = length and length.isdigit() and offset + int(length) or None
+            size = offset
+            try:
+                while 1:
+                    data = response.read(1 << 16)
+                    if not data:
+                        break
+                    f.write(data)
+                    size += len(data)
+                    ## Every MB
+                    if self.events and size >> 20 != (size - len(data)) >> 20:
+                        self.events.emit("download", file, size = size, total = total)
+            finally:
+                f.close()
+            if self.events:
+                self.events.emit("download", file, size = size, total = size)
+        finally:
+            response.close()
+
+    ############################################################################
+    def fetch(self, file, urls):
+        """
+
+        Get `file` from the first working URL of `urls` (base URLs).
+        """
+        filename = os.path.join(self.distfiles, file)
+        if os.path.isfile(filename):
+            return filename
+
+        _locksLock.acquire()
+        try:
+            lock = _locks.setdefault(os.path.abspath(filename), threading.Lock())
+        finally:
+            _locksLock.release()
+        lock.acquire()
+        try:
+            return self._fetch(file, filename, urls)
+        finally:
+            lock.release()
+
+    ############################################################################
+    def _fetch(self, file, filename, urls):
+        ## Fetched by someone else while we waited
+        if os.path.isfile(filename):
+            return filename
+
+        if self.store:
+            try:
+                path = self.store.lookup(file, self.checksums.get(file))
+                if path:
+                    if not self.store.link(path, filename):
+                        self.store.addCopy(file, filename)
+                    print " -> Linked %s from the distfile store" % (file, )
+                    return filename
+            except OSError, err:
+                ## Collected by another builder meanwhile: download it
+                logger.warning("Unable to get %s from the distfile store: %s" % (file, err))
+
+        partname = "%s.part" % (filename, )
+        for url in self.rankURLs([ getURL(url, file) for url in urls ]):
+            try:
+                self._download(url, partname, file)
+            except (urllib2.URLError, IOError), err:
+                ## Keep the partial file: the next mirror resumes it
+                logger.warning("Unable to fetch %s: %s. Trying another URL if exists..." % (url, err))
+                continue
+
+            if not self.verify(file, partname):
+                logger.warning("Checksum mismatch for %s from %s" % (file, url))
+                os.unlink(partname)
+                self._setPartURL(partname)
+                continue
+
+            if self.store:
+                self.store.insert(partname, file, self.checksums.get(file), view = filename)
+            os.rename(partname, filename)
+            self._setPartURL(partname)
+            print " -> Fetched %s from %s" % (file, url)
+            return filename
+
+        raise FetchError("Unable to fetch %s from %s" % (file, ", ".join(urls) or "nowhere"))
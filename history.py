@@ -0,0 +1,170 @@
+import json
+import math
+import threading
+
+from util import writeJSON
+
+import logging
+logger = logging.getLogger("builder")
+
+## Phases which are part of the cost of a package (not the fetch)
+PHASES = [ "extract", "patch", "configure", "build", "install" ]
+
+
+################################################################################
+class History(object):
+    """
+
+    Past costs of every package, kept from one run to the next in a JSON
+    file: phase durations, CPU time, peak RSS and achieved parallelism of
+    the build phase, the number of jobs it was given, and the size of its
+    build tree. Used to schedule and place the next builds (see Scheduler
+    and ScratchSpace).
+
+    Figures are smoothed over the runs: one slow run (eg. a loaded host)
+    doesn't change them much.
+    """
+
+    ## Weight of the last run
+    SMOOTHING = 0.5
+
+    ############################################################################
+    def __init__(self, filename):
+        self.filename   = filename
+        self.packages   = {}
+        self._lock      = threading.RLock()
+        self.load()
+
+    ############################################################################
+    def load(self):
+        try:
+            f = open(self.filename, "r")
+        except IOError:
+            return
+        try:
+            try:
+                self.packages = json.load(f)
+            except ValueError:
+                logger.warning("Ignoring the corrupted build history %s" % (self.filename, ))
+                self.packages = {}
+        finally:
+            f.close()
+
+    ############################################################################
+    def save(self):
+        self._lock.acquire()
+        try:
+            writeJSON(self.filename, self.packages)
+        finally:
+            self._lock.release()
+
+    ############################################################################
+    def _smooth(self, old, new):
+        if old is None:
+            return new
+        return old + self.SMOOTHING * (new - old)
+
+    ############################################################################
+    def record(self, obj, spans):
+        """
+
+        Account the `spans` of one run of `obj` (see profiler.Profiler).
+        Only runs which built something are recorded.
+        """
+        builds = [ span for span in spans if span.phase == "build" and span.end ]
+        if not builds:
+            return
+        durations = {}
+        for span in spans:
+            if span.phase in PHASES and span.end:
+                durations[span.phase] = durations.get(span.phase, 0.0) + span.getDuration()
+        wall = sum([ span.getDuration() for span in builds ])
+        cpu = sum([ span.cpu for span in builds ])
+
+        self._lock.acquire()
+        try:
+            entry = self.packages.setdefault(obj.getQualifiedName(), {})
+            phases = entry.setdefault("phases", {})
+            for phase, duration in durations.items():
+                phases[phase] = round(self._smooth(phases.get(phase), duration), 2)
+            entry["parallelism"] = round(self._smooth(entry.get("parallelism"), wall and cpu / wall or 1.0), 2)
+            ## Peak RSS of the largest process, in KB
+            entry["maxrss"] = max([ span.maxrss for span in builds ])
+            ## With a job server, it could have had the whole budget
+            entry["jobs"] = obj.jobserver and obj.jobserver.jobs or obj.jobs
+            entry["runs"] = entry.get("runs", 0) + 1
+        finally:
+            self._lock.release()
+
+    ############################################################################
+    def setSize(self, obj, size):
+        """
+
+        Record the size of the build tree of `obj`, in bytes.
+        """
+        self._lock.acquire()
+        try:
+            self.packages.setdefault(obj.getQualifiedName(), {})["size"] = size
+        finally:
+            self._lock.release()
+
+    ############################################################################
+    def getSize(self, obj):
+        entry = self.packages.get(obj.getQualifiedName())
+        return entry and entry.get("size")
+
+    ############################################################################
+    def setUncachedConfigure(self, obj, duration):
+        """
+
+        Record the duration of a configure of `obj` which didn't use the
+        shared configure cache: what the cache saves is measured against it.
+        """
+        self._lock.acquire()
+        try:
+            entry = self.packages.setdefault(obj.getQualifiedName(), {})
+            entry["uncachedConfigure"] = round(self._smooth(entry.get("uncachedConfigure"), duration), 2)
+        finally:
+            self._lock.release()
+
+    ############################################################################
+    def getUncachedConfigure(self, obj):
+        entry = self.packages.get(obj.getQualifiedName())
+        return entry and entry.get("uncachedConfigure")
+
+    ############################################################################
+    def getDuration(self, obj):
+        """
+
+        Expected wall time of a whole build of `obj`, None if unknown.
+        """
+        entry = self.packages.get(obj.getQualifiedName())
+        if not entry or not entry.get("phases"):
+            return None
+        return sum(entry["phases"].values())
+
+    ############################################################################
+    def getMemory(self, obj):
+        """
+
+        Expected peak memory of a build of `obj` in MB, None if unknown:
+        the largest process times the parallelism achieved.
+        """
+        entry = self.packages.get(obj.getQualifiedName())
+        if not entry or not entry.get("maxrss"):
+            return None
+        return entry["maxrss"] / 1024.0 * max(1.0, entry["parallelism"])
+
+    ############################################################################
+    def getMaxJobs(self, obj):
+        """
+
+        Jobs worth giving to `obj`, None if unknown or unbounded: a package
+        which used much less than its jobs won't use more next time.
+        """
+        entry = self.packages.get(obj.getQualifiedName())
+        if not entry or not entry.get("jobs") or "parallelism" not in entry:
+            return None
+        if entry["parallelism"] >= 0.75 * entry["jobs"]:
+            return None
+        return max(1, int(math.ceil(entry["parallelism"] + 0.5)))
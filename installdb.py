@@ -0,0 +1,137 @@
+import os
+import os.path
+import json
+import hashlib
+import threading
+
+from util import writeJSON
+
+import logging
+logger = logging.getLogger("builder")
+
+
+################################################################################
+class InstallDB(object):
+    """
+
+    Owners of the files of a prefix: for every installed package, its
+    version, cache key and files (relative to the prefix), in a JSON file.
+    Kept by Builder.mergeObject(): what lets a single package be upgraded
+    (its files left over are removed) or uninstalled.
+
+    Files installed before the database existed have no owner.
+    """
+
+    ############################################################################
+    def __init__(self, filename):
+        self.filename   = filename
+        self.packages   = {}
+        ## path -> package name
+        self._owners    = {}
+        self._lock      = threading.RLock()
+        self.load()
+
+    ############################################################################
+    def load(self):
+        try:
+            f = open(self.filename, "r")
+        except IOError:
+            return
+        try:
+            try:
+                self.packages = json.load(f)
+            except ValueError:
+                logger.warning("Ignoring the corrupted install database %s" % (self.filename, ))
+                self.packages = {}
+        finally:
+            f.close()
+        self._owners = {}
+        for name, entry in self.packages.items():
+            for path in entry["files"]:
+                self._owners[path] = name
+
+    ############################################################################
+    def save(self):
+        self._lock.acquire()
+        try:
+            if not os.path.isdir(os.path.dirname(self.filename)):
+                os.makedirs(os.path.dirname(self.filename))
+            writeJSON(self.filename, self.packages)
+        finally:
+            self._lock.release()
+
+    ############################################################################
+    def getOwner(self, path):
+        return self._owners.get(path)
+
+    ############################################################################
+    def getFiles(self, name):
+        entry = self.packages.get(name)
+        return entry and list(entry["files"]) or []
+
+    ############################################################################
+    def getGeneration(self):
+        """
+
+        Digest of the installed packages and their keys: changes with
+        the contents of the prefix.
+        """
+        self._lock.acquire()
+        try:
+            digest = hashlib.sha1()
+            for name in sorted(self.packages):
+                digest.update("%s\0%s\0" % (name, self.packages[name]["key"]))
+            return digest.hexdigest()
+        finally:
+            self._lock.release()
+
+    ############################################################################
+    def getConflicts(self, name, files):
+        """
+
+        [ (path, owner) ] of `files` owned by another package than `name`.
+        """
+        return [ (path, self._owners[path]) for path in files
+                 if self._owners.get(path, name) != name ]
+
+    ############################################################################
+    def record(self, name, version, key, files):
+        """
+
+        `name` now owns `files` (taken from their previous owners, if any).
+        Returns the files it owned before and doesn't anymore: left over
+        from the previous version, to be removed.
+        """
+        self._lock.acquire()
+        try:
+            stale = sorted(set(self.getFiles(name)) - set(files))
+            for path in files:
+                owner = self._owners.get(path)
+                if owner is not None and owner != name:
+                    self.packages[owner]["files"].remove(path)
+                self._owners[path] = name
+            for path in stale:
+                del self._owners[path]
+            self.packages[name] = { "version" : version, "key" : key, "files" : sorted(files) }
+            self.save()
+            return stale
+        finally:
+            self._lock.release()
+
+    ############################################################################
+    def remove(self, name):
+        """
+
+        Forget `name`. Returns its files, to be removed.
+        """
+        self._lock.acquire()
+        try:
+            files = self.getFiles(name)
+            for path in files:
+                del self._owners[path]
+            if name in self.packages:
+                del self.packages[name]
+                self.save()
+            return files
+        finally:
+            self._lock.release()
@@ -0,0 +1,190 @@
+import ast
+import sys
+
+import config
+import buildobj
+
+import logging
+logger = logging.getLogger("builder")
+
+class ManifestError(Exception): pass
+
+
+################################################################################
+def getVariables(overrides = None):
+    """
+
+    What declarations can refer to as %(NAME)s: the settings of config,
+    and PYTHON_VERSION ("2.7"), then `overrides` (eg. the PREFIX of a
+    matrix target).
+    """
+    variables = dict([ (name, value) for name, value in vars(config).items() if name.isupper() ])
+    variables["PYTHON_VERSION"] = "%d.%d" % (sys.version_info[0], sys.version_info[1])
+    variables.update(overrides or {})
+    return variables
+
+################################################################################
+def expand(value, variables):
+    """
+
+    `value` with the %(NAME)s of its strings replaced.
+    """
+    if isinstance(value, basestring):
+        return value % variables
+    if isinstance(value, list):
+        return [ expand(item, variables) for item in value ]
+    if isinstance(value, dict):
+        return dict([ (key, expand(item, variables)) for key, item in value.items() ])
+    return value
+
+
+################################################################################
+class Manifest(object):
+    """
+
+    Build objects declared as data: a list of dicts, each one with the
+    build object class name ("class"), its name, and the arguments of
+    the class. An optional "set" (eg. "full") puts a declaration in a set
+    of objects, only part of "all" on request: they can still be named,
+    or be dependencies.
+
+        { "class"         : "ComplexBuildObject",
+          "name"          : "zlib",
+          "version"       : "1.2.7",
+          "filename"      : "zlib-1.2.7.tar.gz",
+          "configureArgs" : "--shared --prefix=%(PREFIX)s",
+        }
+
+    Nothing is evaluated until materialise(): only the requested objects
+    and their dependencies are then created (and registered), with the
+    current config. Objects without "url" use config.CLARILAB_MIRROR.
+    """
+
+    ############################################################################
+    def __init__(self, declarations, sets = ()):
+        self.sets = sets
+        self.declarations = []
+        for declaration in declarations:
+            if "class" not in declaration or "name" not in declaration:
+                raise ManifestError("Declaration without a class or a name: %r" % (declaration, ))
+            self.declarations.append(declaration)
+
+        ## (name, variant) -> declaration, name -> [ declarations ]
+        self._keys  = {}
+        self._names = {}
+        for declaration in self.declarations:
+            key = self.getKey(declaration)
+            if key in self._keys:
+                raise ManifestError("%s is declared twice." % (":".join([ part for part in key if part ]), ))
+            self._keys[key] = declaration
+            self._names.setdefault(key[0], []).append(declaration)
+        ## Declarations already materialised -> objects
+        self._objects = {}
+
+    ############################################################################
+    @staticmethod
+    def load(filename, sets = ()):
+        """
+
+        Read a manifest file: a Python literal (list of dicts), no code.
+        """
+        f = open(filename, "r")
+        try:
+            try:
+                declarations = ast.literal_eval(f.read())
+            except (SyntaxError, ValueError), err:
+                raise ManifestError("Invalid manifest %s: %s" % (filename, err))
+        finally:
+            f.close()
+        return Manifest(declarations, sets)
+
+    ############################################################################
+    def copy(self):
+        """
+
+        The same declarations, none materialised yet (eg. for another builder).
+        """
+        return Manifest(self.declarations, self.sets)
+
+    ############################################################################
+    def getKey(self, declaration):
+        ## Python build objects default their variant to their builddir
+        return (declaration["name"], declaration.get("variant", declaration.get("builddir")))
+
+    ############################################################################
+    def getSelected(self):
+        """
+
+        Declarations of "all": those without a set, or in one of our sets.
+        """
+        return [ declaration for declaration in self.declarations
+                 if not declaration.get("set") or declaration["set"] in self.sets ]
+
+    ############################################################################
+    def find(self, project):
+        """
+
+        Declarations of `project`: all the variants of a name, or a single
+        one if qualified ("Imaging:Sane").
+        """
+        if ":" in project:
+            declaration = self._keys.get(tuple(project.split(":", 1)))
+            return declaration and [ declaration ] or []
+        return list(self._names.get(project, []))
+
+    ############################################################################
+    def getClosure(self, projects):
+        """
+
+        Declarations of `projects` and of all their dependencies, in
+        declaration order. Unknown dependencies are left to the builder
+        to report.
+        """
+        closure = set()
+        stack = []
+        for project in projects:
+            found = self.find(project)
+            if not found:
+                raise ManifestError("Nothing named %s in the manifest." % (project, ))
+            stack.extend(found)
+        while stack:
+            declaration = stack.pop()
+            if id(declaration) in closure:
+                continue
+            closure.add(id(declaration))
+            for name in declaration.get("dependencies", []):
+                if ":" in name:
+                    key = tuple(name.split(":", 1))
+                else:
+                    key = (name, None)
+                if key in self._keys:
+                    stack.append(self._keys[key])
+        return [ declaration for declaration in self.declarations if id(declaration) in closure ]
+
+    ############################################################################
+    def materialise(self, projects = None, variables = None):
+        """
+
+        Create the build objects of `projects` (all by default) and of
+        their dependencies. Returns them, in declaration order.
+        `variables` override those of getVariables().
+        """
+        if projects is None:
+            declarations = self.getSelected()
+        else:
+            declarations = self.getClosure(projects)
+
+        variables = getVariables(variables)
+        objects = []
+        for declaration in declarations:
+            if id(declaration) not in self._objects:
+                arguments = dict([ (str(key), expand(value, variables)) for key, value in declaration.items()
+                                   if key not in ("class", "name", "set") ])
+                arguments.setdefault("url", config.CLARILAB_MIRROR)
+                cls = getattr(buildobj, declaration["class"], None)
+                if not isinstance(cls, type) or not issubclass(cls, buildobj.AbstractBuildObject):
+                    raise ManifestError("Unknown build object class %s for %s." % (
+                        declaration["class"], declaration["name"]))
+                self._objects[id(declaration)] = cls(declaration["name"], **arguments)
+            objects.append(self._objects[id(declaration)])
+        return objects
@@ -0,0 +1,165 @@
+import os
+import os.path
+import threading
+from multiprocessing import cpu_count
+
+import config
+import runner
+from scheduler import JobServer
+from builder import Builder, BuilderException
+from events import Dashboard
+from buildobj import AbstractBuildObject
+
+import logging
+logger = logging.getLogger("builder")
+
+
+################################################################################
+class Target(object):
+    """
+
+    One configuration of a matrix build: its prefix, and optionally its
+    compiler and flags (CC, CFLAGS, LDFLAGS of the commands), and the
+    Python used by setup.py (the one of the prefix by default).
+    """
+
+    ############################################################################
+    def __init__(self, name, prefix, cc = None, cflags = None, ldflags = None, python = None):
+        self.name       = name
+        self.prefix     = prefix
+        self.cc         = cc
+        self.cflags     = cflags
+        self.ldflags    = ldflags
+        self.python     = python or os.path.join(prefix, "bin", "python")
+
+    ############################################################################
+    def __repr__(self):
+        return "<Target %s (%s)>" % (self.name, self.prefix)
+
+    ############################################################################
+    @staticmethod
+    def parse(spec):
+        """
+
+        "NAME:PREFIX[:CC[:CFLAGS[:LDFLAGS]]]", eg. "m32:/clarilab32:gcc -m32:-O2".
+        """
+        fields = spec.split(":")
+        if len(fields) < 2 or not fields[0] or not fields[1]:
+            raise BuilderException("Invalid target %r: NAME:PREFIX[:CC[:CFLAGS[:LDFLAGS]]] expected." % (spec, ))
+        fields = [ field or None for field in fields ] + [ None ] * (5 - len(fields))
+        return Target(*fields[:5])
+
+    ############################################################################
+    def getEnvironment(self):
+        """
+
+        Variables of the commands of this target.
+        """
+        environment = {}
+        for name, value in (("CC", self.cc), ("CFLAGS", self.cflags), ("LDFLAGS", self.ldflags)):
+            if value:
+                environment[name] = value
+        return environment
+
+    ############################################################################
+    def getVariables(self):
+        """
+
+        What manifest declarations see of this target, see manifest.getVariables().
+        """
+        variables = { "PREFIX" : self.prefix, "PYTHON_BIN" : self.python }
+        if self.cc:
+            variables["CC"] = self.cc
+        return variables
+
+
+################################################################################
+class Matrix(object):
+    """
+
+    The same projects built for several targets in one run. Each target
+    is an isolated configuration, with its own Builder and build root
+    (buildroot/NAME: trees, stamps, history and logs). All of them share
+    the distfiles, the caches next to them, the job budget, and out of
+    tree (config.OUT_OF_TREE) the extracted sources: the targets build at
+    the same time, each with its own scheduler, and report to one
+    dashboard.
+    """
+
+    ############################################################################
+    def __init__(self, targets, buildroot, distfiles, jobs = None):
+        names = [ target.name for target in targets ]
+        if len(set(names)) != len(names):
+            raise BuilderException("Targets need different names: %s" % (", ".join(names), ))
+        if not os.path.isdir(buildroot):
+            os.makedirs(buildroot)
+        self.targets    = targets
+        self.jobserver  = JobServer(jobs or config.JOBS or cpu_count())
+        ## Out of tree, the targets build from the same sources
+        sources = config.OUT_OF_TREE and buildroot or None
+        self.dashboard  = None
+        if config.DASHBOARD:
+            self.dashboard = Dashboard(interval = config.DASHBOARD_INTERVAL, verbose = config.VERBOSE)
+        self.builders   = [ Builder(os.path.join(buildroot, target.name), distfiles,
+                                    target = target, jobserver = self.jobserver, sources = sources,
+                                    dashboard = self.dashboard)
+                            for target in targets ]
+
+    ############################################################################
+    def materialise(self, manifest, projects = None):
+        """
+
+        Create the build objects of `projects` (all by default) for every
+        target, from `manifest` (see manifest.Manifest).
+        Returns {target name: objects}.
+        """
+        objects = {}
+        for target, builder in zip(self.targets, self.builders):
+            AbstractBuildObject.setBuilder(builder)
+            objects[target.name] = manifest.copy().materialise(projects, target.getVariables())
+        return objects
+
+    ############################################################################
+    def build(self, project = "all", dryrun = False, keepGoing = None):
+        """
+
+        Build `project` for all the targets, concurrently. Failed targets
+        don't stop the others; they are reported at the end, as a
+        BuilderException. With `dryrun`, the plans are printed one by one.
+        """
+        if dryrun:
+            for target, builder in zip(self.targets, self.builders):
+                print "=> Target %s (%s)" % (target.name, target.prefix)
+                builder.build(project, dryrun = True)
+            return
+
+        errors = {}
+        def run(target, builder):
+            try:
+                builder.build(project, keepGoing = keepGoing)
+            except Exception, err:
+                logger.error("Target %s failed: %s" % (target.name, err))
+                errors[target.name] = err
+
+        threads = []
+        for target, builder in zip(self.targets, self.builders):
+            thread = threading.Thread(target = run, args = (target, builder), name = "target-%s" % (target.name, ))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        try:
+            for thread in threads:
+                ## With a timeout: KeyboardInterrupt gets through
+                while thread.isAlive():
+                    thread.join(1)
+        except KeyboardInterrupt:
+            print "Interrupted: killing the running commands..."
+            runner.terminateAll()
+            raise
+
+        for target in self.targets:
+            print "=> Target %s (%s): %s" % (target.name, target.prefix,
+                                             target.name in errors and "FAILED" or "built")
+        if errors:
+            raise BuilderException("%d of %d targets failed: %s" % (
+                len(errors), len(self.targets), ", ".join(sorted(errors))))
@@ -0,0 +1,300 @@
+import os
+import os.path
+import json
+import time
+import errno
+import shutil
+import tarfile
+import datetime
+import threading
+import StringIO
+
+from util import writeFile
+
+import logging
+logger = logging.getLogger("builder")
+
+class PackageError(Exception): pass
+
+## Name of the manifest, first member of every binary package
+MANIFEST = "+MANIFEST"
+
+
+################################################################################
+def listTree(root):
+    """
+
+    Files and symlinks below `root`, relative to it.
+    """
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames + [ d for d in dirnames if os.path.islink(os.path.join(dirpath, d)) ]:
+            files.append(os.path.relpath(os.path.join(dirpath, name), root))
+    return sorted(files)
+
+################################################################################
+def rebaseLinks(root, files, stage):
+    """
+
+    Make the symlinks of `files` (relative to `root`, a staged prefix)
+    to absolute paths below `stage` relative: installs writing DESTDIR
+    into their links, which would dangle once merged. Returns the
+    rebased links.
+    """
+    rebased = []
+    for path in files:
+        filename = os.path.join(root, path)
+        if not os.path.islink(filename):
+            continue
+        target = os.readlink(filename)
+        if not os.path.isabs(target) or not target.startswith(stage.rstrip(os.sep) + os.sep):
+            continue
+        if not target.startswith(root.rstrip(os.sep) + os.sep):
+            raise PackageError("%s links to %s, out of the staged prefix." % (path, target))
+        os.unlink(filename)
+        os.symlink(os.path.relpath(target, os.path.dirname(filename)), filename)
+        rebased.append(path)
+    return rebased
+
+################################################################################
+def getStagedLinks(root, files, directory):
+    """
+
+    [ (path, target) ] of the symlinks of `files` (relative to `root`)
+    to absolute paths through a `directory` directory (a staging one,
+    see rebaseLinks()).
+    """
+    staged = []
+    for path in files:
+        filename = os.path.join(root, path)
+        if os.path.islink(filename):
+            target = os.readlink(filename)
+            if os.path.isabs(target) and directory in target.split(os.sep):
+                staged.append((path, target))
+    return staged
+
+################################################################################
+def _linkOrCopy(source, destination, copy = False):
+    """
+
+    Hard link `source` (a copy across filesystems, or if `copy`) next
+    to `destination`. Returns the temporary name, to be renamed to
+    `destination`.
+    """
+    parent = os.path.dirname(destination)
+    if parent and not os.path.isdir(parent):
+        try:
+            os.makedirs(parent)
+        except OSError, err:
+            if err.errno != errno.EEXIST:
+                raise
+
+    tmpname = "%s.%d.%s.tmp" % (destination, os.getpid(), threading.current_thread().ident)
+    if os.path.lexists(tmpname):
+        os.unlink(tmpname)
+    if os.path.islink(source):
+        os.symlink(os.readlink(source), tmpname)
+    elif copy:
+        shutil.copy2(source, tmpname)
+    else:
+        try:
+            os.link(source, tmpname)
+        except OSError, err:
+            if err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            shutil.copy2(source, tmpname)
+    return tmpname
+
+################################################################################
+def mergeTree(source, destination, files = None, copies = ()):
+    """
+
+    Put the files of `source` at the same place in `destination`,
+    hard linked if possible (but `copies`). Returns the merged files.
+
+    All the files are linked (or copied) next to their destination
+    first, then renamed over it: a failure (a full disk...) leaves
+    `destination` as it was, but for new empty directories.
+    """
+    if files is None:
+        files = listTree(source)
+    staged = []
+    try:
+        for path in files:
+            destpath = os.path.join(destination, path)
+            if os.path.isdir(destpath) and not os.path.islink(destpath):
+                raise PackageError("Can't replace the directory %s by a file." % (destpath, ))
+            staged.append((_linkOrCopy(os.path.join(source, path), destpath, path in copies), destpath))
+    except:
+        for tmpname, destpath in staged:
+            try:
+                os.unlink(tmpname)
+            except OSError:
+                pass
+        raise
+    for tmpname, destpath in staged:
+        os.rename(tmpname, destpath)
+    return files
+
+################################################################################
+def removeFiles(root, files):
+    """
+
+    Remove `files` (relative to `root`), then the directories left empty
+    below `root`.
+    """
+    parents = set()
+    for path in files:
+        filename = os.path.join(root, path)
+        try:
+            os.unlink(filename)
+        except OSError, err:
+            if err.errno != errno.ENOENT:
+                raise
+        parent = os.path.dirname(path)
+        while parent:
+            parents.add(parent)
+            parent = os.path.dirname(parent)
+    ## Deepest first
+    for parent in sorted(parents, key = lambda path: -path.count(os.sep)):
+        try:
+            os.rmdir(os.path.join(root, parent))
+        except OSError:
+            pass
+
+
+################################################################################
+class PackageStore(object):
+    """
+
+    Directory of binary packages: compressed install trees, with a
+    manifest naming the package, its cache key, its prefix, its
+    dependencies and its files.
+
+        <name>[-<variant>]-<version>-<key>.tar.gz    the package
+        <name>[-<variant>]-<version>-<key>.json      a copy of its manifest
+        store/<key>/                                 unpacked packages
+
+    Installing a package unpacks it once into the store (stage()), then
+    the builder hard links its files into the prefix: the store must not
+    be modified.
+    """
+
+    ############################################################################
+    def __init__(self, directory):
+        self.directory  = directory
+        self.store      = os.path.join(directory, "store")
+        if not os.path.isdir(self.store):
+            os.makedirs(self.store)
+
+    ############################################################################
+    def getBaseName(self, manifest):
+        name = manifest["name"]
+        if manifest.get("variant"):
+            name += "-%s" % (manifest["variant"], )
+        return "%s-%s-%s" % (name, manifest["version"], manifest["key"])
+
+    ############################################################################
+    def getPath(self, manifest):
+        return os.path.join(self.directory, "%s.tar.gz" % (self.getBaseName(manifest), ))
+
+    ############################################################################
+    def export(self, obj, root, files, dependencies):
+        """
+
+        Pack `files` (relative to `root`, the staged prefix) as a package
+        of `obj`. `dependencies` are (qualified name, key) pairs.
+        """
+        manifest = { "name"         : obj.name,
+                     "variant"      : obj.variant,
+                     "version"      : obj.version,
+                     "key"          : obj.getCacheKey(),
+                     "prefix"       : obj.getPrefix(),
+                     "dependencies" : [ { "name": name, "key": key } for name, key in dependencies ],
+                     "files"        : files,
+                     "created"      : "%s" % (datetime.datetime.now()) }
+
+        data = json.dumps(manifest, indent = 1, sort_keys = True)
+        filename = self.getPath(manifest)
+        tmpname = "%s.%d.tmp" % (filename, os.getpid())
+        archive = tarfile.open(tmpname, "w:gz")
+        try:
+            info = tarfile.TarInfo(MANIFEST)
+            info.size = len(data)
+            info.mtime = time.time()
+            archive.addfile(info, StringIO.StringIO(data))
+            for path in files:
+                archive.add(os.path.join(root, path), arcname = path, recursive = False)
+        finally:
+            archive.close()
+        os.rename(tmpname, filename)
+
+        writeFile("%s.json" % (filename[:-len(".tar.gz")], ), data)
+        return filename
+
+    ############################################################################
+    def find(self, obj, key = None):
+        """
+
+        The package of `obj` built with the same cache key (or `key`), if any.
+        """
+        manifest = { "name": obj.name, "variant": obj.variant, "version": obj.version,
+                     "key": key or obj.getCacheKey() }
+        filename = self.getPath(manifest)
+        if os.path.isfile(filename):
+            return filename
+        return None
+
+    ############################################################################
+    def readManifest(self, filename):
+        archive = tarfile.open(filename, "r:gz")
+        try:
+            member = archive.next()
+            if member is None or member.name != MANIFEST:
+                raise PackageError("%s is not a binary package." % (filename, ))
+            return json.load(archive.extractfile(member))
+        finally:
+            archive.close()
+
+    ############################################################################
+    def unpack(self, filename):
+        """
+
+        Unpack a package into the store, once. Returns (manifest, directory).
+        """
+        manifest = self.readManifest(filename)
+        directory = os.path.join(self.store, manifest["key"])
+        if os.path.isdir(directory):
+            return manifest, directory
+
+        tmpdir = "%s.%d.tmp" % (directory, os.getpid())
+        shutil.rmtree(tmpdir, ignore_errors = True)
+        archive = tarfile.open(filename, "r:gz")
+        try:
+            members = []
+            for member in archive.getmembers():
+                path = os.path.normpath(member.name)
+                if member.name == MANIFEST or os.path.isabs(path) or path.startswith(os.pardir):
+                    continue
+                members.append(member)
+            archive.extractall(tmpdir, members)
+        finally:
+            archive.close()
+        try:
+            os.rename(tmpdir, directory)
+        except OSError:
+            ## Unpacked by someone else meanwhile
+            shutil.rmtree(tmpdir, ignore_errors = True)
+        return manifest, directory
+
+    ############################################################################
+    def stage(self, filename, prefix):
+        """
+
+        Unpack a package built for `prefix` into the store, to be merged
+        into it. Returns (manifest, directory).
+        """
+        manifest, directory = self.unpack(filename)
+        if manifest["prefix"] != prefix:
+            raise PackageError("%s was built for %s, not %s." % (filename, manifest["prefix"], prefix))
+        return manifest, directory
@@ -0,0 +1,205 @@
+import os.path
+
+import config
+
+import logging
+logger = logging.getLogger("builder")
+
+## Phases of a build, in order. "import" and "restore" replace all of them.
+PHASES = [ "fetch", "extract", "patch", "configure", "build", "install" ]
+
+
+################################################################################
+def sortObjects(objects, resolve):
+    """
+
+    `objects`, every object after its dependencies (`resolve(obj)`
+    returns them). Iterative: chains can be longer than the recursion
+    limit. Cycles are broken anywhere.
+    """
+    selected = set(objects)
+    ordered = []
+    done = set()
+    for root in objects:
+        if root in done:
+            continue
+        done.add(root)
+        stack = [ (root, iter(resolve(root))) ]
+        while stack:
+            obj, deps = stack[-1]
+            for dep in deps:
+                if dep in selected and dep not in done:
+                    done.add(dep)
+                    stack.append((dep, iter(resolve(dep))))
+                    break
+            else:
+                stack.pop()
+                ordered.append(obj)
+    return ordered
+
+
+################################################################################
+class Step(object):
+    """
+
+    What must happen to one object, and why.
+    """
+
+    ############################################################################
+    def __init__(self, obj, phases, reason):
+        self.obj        = obj
+        self.phases     = phases
+        self.reason     = reason
+
+    ############################################################################
+    def __repr__(self):
+        return "%-30s %-40s %s" % (self.obj.getQualifiedName(), " ".join(self.phases), self.reason)
+
+
+################################################################################
+class Plan(object):
+    """
+
+    The objects to build, dependencies first, with their phases.
+    Objects without anything to do are not part of it.
+    """
+
+    ############################################################################
+    def __init__(self, steps, skipped):
+        self.steps      = steps
+        ## Up to date objects
+        self.skipped    = skipped
+
+    ############################################################################
+    def getObjects(self):
+        return [ step.obj for step in self.steps ]
+
+    ############################################################################
+    def getStep(self, obj):
+        for step in self.steps:
+            if step.obj is obj:
+                return step
+        return None
+
+    ############################################################################
+    def format(self):
+        if not self.steps:
+            return "Nothing to do (%d objects up to date)." % (len(self.skipped))
+        lines = [ "%-30s %-40s %s" % ("Object", "Phases", "Reason") ]
+        lines.extend([ "%r" % (step, ) for step in self.steps ])
+        lines.append("%d objects to build, %d phases, %d objects up to date." % (
+            len(self.steps), sum([ len(step.phases) for step in self.steps ]), len(self.skipped)))
+        return "\n".join(lines)
+
+
+################################################################################
+class Planner(object):
+    """
+
+    Finds out what a build would do, without doing anything: the stamps,
+    recorded inputs, build cache and binary packages of every object are
+    looked at once, dependencies first, and the phases each object will
+    run are predicted from its state and from the plan of its
+    dependencies.
+    """
+
+    ############################################################################
+    def __init__(self, builder):
+        self.builder = builder
+
+    ############################################################################
+    def sort(self, objects):
+        """
+
+        `objects`, every object after its dependencies.
+        """
+        return sortObjects(objects, self.builder.getDependencies)
+
+    ############################################################################
+    def planObject(self, obj, planned, modified, keys):
+        """
+
+        The step of `obj`, or None if it is up to date. `planned` are
+        the objects already planned, `modified` the ones whose sources
+        have local changes, `keys` the cache keys the planned objects
+        will have once done (if known).
+        """
+        missing = [ file for file in obj.getDistFiles() if not obj.hasDistFile(file) ]
+        deps = [ dep for dep in self.builder.getDependencies(obj) if dep in planned ]
+        ## Without a patch file, there is nothing to patch
+        state = { "patch"     : obj.isPatch() or not obj.patchfile,
+                  "configure" : obj.isConfigure(),
+                  "build"     : obj.isBuild(),
+                  "install"   : obj.isInstalled() }
+        reasons = []
+
+        def invalidate(phase):
+            for name in PHASES[PHASES.index(phase):]:
+                state[name] = name == "patch" and not obj.patchfile
+
+        ## The key of `obj` needs its distfiles and the keys of its planned dependencies
+        known = not missing and not [ dep for dep in deps if dep not in keys ]
+        if known:
+            changes = obj.getChanges(keys)
+            if changes:
+                phase, reason, changed = changes
+                invalidate(phase)
+                reasons.append(reason)
+                if changed:
+                    modified.add(obj)
+        ## The rule of Builder.buildObject()
+        rebuilt = self.builder.getRebuiltDependencies(obj, [ dep for dep in deps if "build" in planned[dep].phases ])
+        if rebuilt and state["build"]:
+            invalidate("build")
+            reasons.append("dependencies rebuilt: %s" % (", ".join([ dep.getQualifiedName() for dep in rebuilt ])))
+        elif not known and deps and state["build"]:
+            invalidate("build")
+            reasons.append("dependencies change: %s" % (", ".join([ dep.getQualifiedName() for dep in deps ])))
+
+        if state["install"]:
+            return None
+        if not reasons:
+            reasons.append("not installed")
+        if known:
+            keys[obj] = obj.getCacheKey(keys)
+
+        cacheable = not [ dep for dep in self.builder.getClosure([ obj ])
+                          if dep in modified or dep.isModified() ]
+        if known and cacheable:
+            if config.IMPORT_PACKAGES and self.builder.packages.find(obj, keys[obj]):
+                return Step(obj, [ "import" ], "binary package available")
+            if self.builder.cache and self.builder.cache.has(keys[obj]):
+                return Step(obj, [ "restore" ], "in the build cache")
+
+        phases = []
+        if missing:
+            phases.append("fetch")
+        if not os.path.isdir(obj.getBuildPath()):
+            phases.append("extract")
+            invalidate("patch")
+        phases.extend([ phase for phase in PHASES[2:] if not state[phase] ])
+        return Step(obj, phases, "; ".join(reasons))
+
+    ############################################################################
+    def plan(self, objects):
+        steps = []
+        skipped = []
+        planned = {}
+        modified = set()
+        keys = {}
+        ## Keys computed before (by an earlier plan, a build...) may be outdated
+        for obj in self.builder.builds:
+            obj.resetCacheKey()
+        for obj in self.sort(objects):
+            step = self.planObject(obj, planned, modified, keys)
+            if step is None:
+                skipped.append(obj)
+            else:
+                steps.append(step)
+                planned[obj] = step
+
+        ## Keys computed while planning may be outdated once the
+        ## dependencies are built: let the builder compute them again.
+        for obj in self.builder.builds:
+            obj.resetCacheKey()
+        return Plan(steps, skipped)
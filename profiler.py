@@ -0,0 +1,183 @@
+import time
+import threading
+
+from planner import sortObjects
+from util import writeJSON
+
+## Phases of the whole build, not of a package (see Builder.build())
+BUILD_PHASES = ("plan", )
+
+
+################################################################################
+class Span(object):
+    """
+
+    One phase of one package: wall-clock bounds, and the CPU time and
+    peak RSS of the commands it ran.
+    """
+
+    ############################################################################
+    def __init__(self, name, phase, thread):
+        self.name       = name
+        self.phase      = phase
+        self.thread     = thread
+        self.start      = time.time()
+        self.end        = None
+        self.cpu        = 0.0
+        self.maxrss     = 0
+        self.commands   = 0
+
+    ############################################################################
+    def getDuration(self):
+        return (self.end or time.time()) - self.start
+
+
+################################################################################
+class Profiler(object):
+    """
+
+    Records the spans of a build, from every thread.
+    """
+
+    ############################################################################
+    def __init__(self):
+        self.spans      = []
+        self.start      = time.time()
+        self._lock      = threading.Lock()
+        self._current   = threading.local()
+        self._threads   = {}
+
+    ############################################################################
+    def begin(self, name, phase):
+        """
+
+        Start a span in this thread; commands run until end() are accounted to it.
+        """
+        self._lock.acquire()
+        try:
+            thread = self._threads.setdefault(threading.current_thread().name, len(self._threads) + 1)
+            span = Span(name, phase, thread)
+            self.spans.append(span)
+        finally:
+            self._lock.release()
+        self._current.span = span
+        return span
+
+    ############################################################################
+    def end(self, span):
+        span.end = time.time()
+        if getattr(self._current, "span", None) is span:
+            self._current.span = None
+
+    ############################################################################
+    def addUsage(self, rusage):
+        """
+
+        Account the rusage of a finished child to the current span of this thread.
+        """
+        span = getattr(self._current, "span", None)
+        if span is None or rusage is None:
+            return
+        span.cpu += rusage.ru_utime + rusage.ru_stime
+        span.maxrss = max(span.maxrss, rusage.ru_maxrss)
+        span.commands += 1
+
+    ############################################################################
+    def getTotals(self, exclude = ("fetch", )):
+        """
+
+        {name: (wall, cpu, maxrss)} over the spans of each package.
+        """
+        totals = {}
+        for span in self.spans:
+            if span.phase in exclude or span.phase in BUILD_PHASES:
+                continue
+            wall, cpu, maxrss = totals.get(span.name, (0.0, 0.0, 0))
+            totals[span.name] = (wall + span.getDuration(), cpu + span.cpu, max(maxrss, span.maxrss))
+        return totals
+
+    ############################################################################
+    def getCriticalPath(self, objects, resolve, exclude = ("fetch", )):
+        """
+
+        Longest chain of dependent packages among `objects`, by recorded
+        wall time (but the `exclude` phases). `resolve(obj)` returns the
+        dependencies of `obj`. Returns (duration, [ (obj, duration) ]).
+        """
+        totals = self.getTotals(exclude)
+        finish = {}
+        previous = {}
+
+        ## Dependencies first
+        for obj in sortObjects(objects, resolve):
+            best = None
+            for dep in resolve(obj):
+                if dep in finish and (best is None or finish[dep] > finish[best]):
+                    best = dep
+            duration = totals.get(obj.getQualifiedName(), (0.0, 0.0, 0))[0]
+            finish[obj] = duration + (best and finish[best] or 0.0)
+            previous[obj] = best
+
+        if not finish:
+            return 0.0, []
+        last = max(finish, key = lambda obj: finish[obj])
+        path = []
+        obj = last
+        while obj is not None:
+            path.append((obj, totals.get(obj.getQualifiedName(), (0.0, 0.0, 0))[0]))
+            obj = previous[obj]
+        path.reverse()
+        return finish[last], path
+
+    ############################################################################
+    def writeTrace(self, filename):
+        """
+
+        Chrome trace-event JSON (chrome://tracing, Perfetto...).
+        """
+        events = []
+        for thread_name, tid in self._threads.items():
+            events.append({ "name": "thread_name", "ph": "M", "pid": 1, "tid": tid,
+                            "args": { "name": thread_name } })
+        for span in self.spans:
+            events.append({ "name"  : span.phase,
+                            "cat"   : span.name,
+                            "ph"    : "X",
+                            "pid"   : 1,
+                            "tid"   : span.thread,
+                            "ts"    : int((span.start - self.start) * 1e6),
+                            "dur"   : int(span.getDuration() * 1e6),
+                            "args"  : { "package"   : span.name,
+                                        "cpu"       : round(span.cpu, 3),
+                                        "maxrss_kb" : span.maxrss,
+                                        "commands"  : span.commands } })
+
+        writeJSON(filename, { "traceEvents": events, "displayTimeUnit": "ms" }, indent = None)
+
+    ############################################################################
+    def report(self, objects, resolve):
+        """
+
+        Per-package figures and the critical path, as text.
+        """
+        wall = time.time() - self.start
+        totals = self.getTotals()
+        lines = [ "%-30s %10s %10s %6s %10s" % ("Package", "Wall (s)", "CPU (s)", "Par.", "RSS (MB)") ]
+        for name, (duration, cpu, maxrss) in sorted(totals.items(), key = lambda item: -item[1][0]):
+            lines.append("%-30s %10.1f %10.1f %6.1f %10.1f" % (
+                name, duration, cpu, duration and cpu / duration or 0.0, maxrss / 1024.0))
+
+        length, path = self.getCriticalPath(objects, resolve)
+        work = sum([ duration for duration, cpu, maxrss in totals.values() ])
+        lines.append("")
+        lines.append("Critical path (%.1fs): %s" % (length, " -> ".join(
+            [ "%s (%.1fs)" % (obj.getQualifiedName(), duration) for obj, duration in path ])))
+        lines.append("Wall time: %.1fs, package time: %.1fs, CPU time: %.1fs" % (
+            wall, work, sum([ cpu for duration, cpu, maxrss in totals.values() ])))
+        planning = sum([ span.getDuration() for span in self.spans if span.phase in BUILD_PHASES ])
+        if planning:
+            lines.append("Planning: %.1fs" % (planning, ))
+        if length:
+            lines.append("Best possible wall time with unlimited cores: %.1fs (%.0f%% of this build)" % (
+                length, 100.0 * length / max(wall, 0.001)))
+        return "\n".join(lines)
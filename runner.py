@@ -0,0 +1,172 @@
+import os
+import time
+import errno
+import signal
+import threading
+import subprocess
+import collections
+
+import logging
+logger = logging.getLogger("builder")
+
+## Commands running, to kill them on interruption
+_running = set()
+_runningLock = threading.Lock()
+
+################################################################################
+def terminateAll(grace = 5):
+    """
+
+    Kill the process groups of all the running commands: SIGTERM, then
+    SIGKILL to those still there after `grace` seconds.
+    """
+    _runningLock.acquire()
+    try:
+        commands = list(_running)
+    finally:
+        _runningLock.release()
+
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        for command in commands:
+            command.kill(sig)
+        deadline = time.time() + grace
+        while [ command for command in commands if command.exit_code is None ] and time.time() < deadline:
+            time.sleep(0.1)
+        commands = [ command for command in commands if command.exit_code is None ]
+        if not commands:
+            break
+
+
+################################################################################
+class Command(object):
+    """
+
+    A shell command whose stdout and stderr are both read while it runs,
+    each by its own thread, so that the child never blocks on a full pipe.
+
+    Every line goes to the log file (if any) and to the echo stream (if any);
+    only the last `tail` lines of each stream are kept in memory.
+    Nothing is shared between instances: commands can run from several
+    threads at the same time.
+
+    Every command runs in its own process group (session), so that it can
+    be killed with all of its children: see kill() and terminateAll().
+    """
+
+    ############################################################################
+    def __init__(self, command, cwd = None, env = None, logfile = None, echo = None,
+                       prefix = "", tail = 50):
+        self.command    = command
+        self.cwd        = cwd
+        self.env        = env
+        self.logfile    = logfile
+        self.echo       = echo
+        self.prefix     = prefix
+        self.pid        = None
+        self.exit_code  = None
+        ## resource.struct_rusage of the child and its waited-for children
+        self.rusage     = None
+        self.stdout     = collections.deque(maxlen = tail)
+        self.stderr     = collections.deque(maxlen = tail)
+        self._lock      = threading.Lock()
+
+    ############################################################################
+    def _read(self, pipe, lines, log):
+        for line in iter(pipe.readline, ""):
+            lines.append(line)
+            self._lock.acquire()
+            try:
+                if log:
+                    log.write(line)
+                if self.echo:
+                    self.echo.write("%s%s" % (self.prefix, line))
+            finally:
+                self._lock.release()
+        pipe.close()
+
+    ############################################################################
+    def run(self):
+        """
+
+        Run the command until it exits. Returns its exit code.
+        """
+        devnull = open(os.devnull, "r")
+        try:
+            ## Buffered pipes: unbuffered, readline() reads one byte at a time
+            p = subprocess.Popen(self.command,
+                                 cwd        = self.cwd,
+                                 bufsize    = -1,
+                                 stdin      = devnull,
+                                 stdout     = subprocess.PIPE,
+                                 stderr     = subprocess.PIPE,
+                                 close_fds  = True,
+                                 shell      = True,
+                                 env        = self.env,
+                                 preexec_fn = os.setsid)
+        finally:
+            devnull.close()
+        self.pid = p.pid
+        _runningLock.acquire()
+        try:
+            _running.add(self)
+        finally:
+            _runningLock.release()
+        try:
+            return self._wait(p)
+        finally:
+            _runningLock.acquire()
+            try:
+                _running.discard(self)
+            finally:
+                _runningLock.release()
+
+    ############################################################################
+    def _wait(self, p):
+        """
+
+        Read the output of `p` until it is closed, then reap it.
+        """
+        readers = [ threading.Thread(target = self._read, args = (p.stdout, self.stdout, self.logfile)),
+                    threading.Thread(target = self._read, args = (p.stderr, self.stderr, self.logfile)) ]
+        for reader in readers:
+            reader.daemon = True
+            reader.start()
+        for reader in readers:
+            reader.join()
+
+        ## wait4() rather than wait(): we want the rusage of the child
+        while 1:
+            try:
+                pid, status, self.rusage = os.wait4(p.pid, 0)
+                break
+            except OSError, err:
+                if err.errno != errno.EINTR:
+                    raise
+        if os.WIFSIGNALED(status):
+            self.exit_code = -os.WTERMSIG(status)
+        else:
+            self.exit_code = os.WEXITSTATUS(status)
+        p.returncode = self.exit_code
+        return self.exit_code
+
+    ############################################################################
+    def kill(self, sig = signal.SIGTERM):
+        """
+
+        Send `sig` to the process group of the command.
+        """
+        if self.pid is None or self.exit_code is not None:
+            return
+        try:
+            os.killpg(self.pid, sig)
+        except OSError, err:
+            if err.errno != errno.ESRCH:
+                raise
+
+    ############################################################################
+    def getTail(self):
+        """
+
+        Last lines of stderr, or of stdout if there were none: the error report.
+        """
+        return "".join(self.stderr or self.stdout)
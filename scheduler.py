@@ -0,0 +1,320 @@
+import os
+import sys
+import errno
+import shutil
+import atexit
+import tempfile
+import threading
+import Queue
+
+import runner
+from planner import sortObjects
+
+import logging
+logger = logging.getLogger("builder")
+
+class SchedulerError(Exception): pass
+
+
+################################################################################
+class JobServer(object):
+    """
+
+    Machine-wide budget of job slots, shared by all the concurrent builds.
+
+    A GNU make jobserver: the free slots are tokens in a FIFO. Every
+    running package holds at least one slot, taken by the scheduler;
+    the makes given the jobserver (see wrap()) take more tokens from the
+    FIFO for their parallel jobs, and give them back as the jobs end.
+    The sum of all the concurrent jobs never exceeds the budget, and the
+    slots freed by a package go to the builds still running. A make
+    killed on interruption (see runner.terminateAll()) loses its tokens:
+    the run is over anyway.
+    """
+
+    ############################################################################
+    def __init__(self, jobs):
+        self.jobs       = max(1, jobs)
+        self._directory = tempfile.mkdtemp(prefix = "jobserver-")
+        self.fifo       = os.path.join(self._directory, "tokens")
+        os.mkfifo(self.fifo, 0600)
+        ## Read and write: the FIFO (and its tokens) lives as long as we do
+        self._fd        = os.open(self.fifo, os.O_RDWR | os.O_NONBLOCK)
+        os.write(self._fd, "+" * self.jobs)
+        atexit.register(self.close)
+
+    ############################################################################
+    def close(self):
+        if self._fd is None:
+            return
+        os.close(self._fd)
+        self._fd = None
+        shutil.rmtree(self._directory, ignore_errors = True)
+
+    ############################################################################
+    def acquire(self, wanted):
+        """
+
+        Take up to `wanted` slots, without blocking.
+        Returns the number of slots taken (0 if none is free).
+        """
+        try:
+            return len(os.read(self._fd, max(1, wanted)))
+        except OSError, err:
+            if err.errno != errno.EAGAIN:
+                raise
+            return 0
+
+    ############################################################################
+    def release(self, count):
+        os.write(self._fd, "+" * count)
+
+    ############################################################################
+    def wrap(self, make):
+        """
+
+        The `make` command, taking its jobs beyond the first one from us.
+        """
+        return 'MAKEFLAGS=" -j --jobserver-fds=3,4" %s 3<>%s 4<>%s' % (make, self.fifo, self.fifo)
+
+
+################################################################################
+class Scheduler(object):
+    """
+
+    Runs an action on every object of a dependency graph, starting an
+    object as soon as all of its dependencies are done.
+
+    Independent objects run at the same time, each one in its own thread,
+    with job server slots: one, and the make jobs it gets from the job
+    server as it goes, or a fixed share for the objects with a limit.
+
+    With a history of past builds (see history.History), the objects
+    heading the longest chains start first, each one gets the jobs it
+    actually used, and objects which would exceed the memory limit
+    together don't run at the same time.
+    """
+
+    ############################################################################
+    def __init__(self, jobserver, resolve, history = None, memory = None):
+        """
+
+        `resolve(obj)` must return the list of objects `obj` depends on.
+        `memory` is the memory limit in MB, None for no limit.
+        """
+        self.jobserver  = jobserver
+        self.resolve    = resolve
+        self.history    = history
+        self.memory     = memory
+
+    ############################################################################
+    def _getShare(self, obj, waiting):
+        """
+
+        Number of slots to ask for `obj`, and whether it draws more from
+        the job server as it builds (see JobServer.wrap()).
+
+        Objects with a limit (some packages can't build in parallel,
+        others didn't use their jobs last time) get a fair share of the
+        whole budget between the `waiting` ones (ready or running),
+        capped by the limit. The others start with one slot.
+        """
+        limits = [ maxjobs for maxjobs in (obj.getMaxJobs(), self.history and self.history.getMaxJobs(obj))
+                   if maxjobs ]
+        if not limits:
+            return 1, True
+        return min([ -(-self.jobserver.jobs // max(1, waiting)) ] + limits), False
+
+    ############################################################################
+    def _getPriorities(self, objects, dependencies):
+        """
+
+        Expected duration of the longest chain starting at each object,
+        itself included: the long poles go first. Unknown durations count
+        as the average known one.
+        """
+        if not self.history:
+            return dict([ (obj, 0.0) for obj in objects ])
+        durations = dict([ (obj, self.history.getDuration(obj)) for obj in objects ])
+        known = [ duration for duration in durations.values() if duration is not None ]
+        default = known and sum(known) / len(known) or 0.0
+
+        dependents = dict([ (obj, []) for obj in objects ])
+        for obj in objects:
+            for dep in dependencies[obj]:
+                dependents[dep].append(obj)
+
+        ## Dependents first (cycles are reported by run())
+        priorities = {}
+        for obj in reversed(sortObjects(objects, lambda obj: dependencies[obj])):
+            duration = durations[obj]
+            if duration is None:
+                duration = default
+            priorities[obj] = duration + max([ 0.0 ] + [ priorities.get(other, 0.0) for other in dependents[obj] ])
+        return priorities
+
+    ############################################################################
+    def _prepare(self, tasks, prepare, results, stopping):
+        """
+
+        Prepare worker: call `prepare(obj)` for the objects of `tasks`
+        until there are no more, or the run stops.
+        """
+        while not stopping.is_set():
+            try:
+                obj = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                prepare(obj)
+            except:
+                results.put(("prepare", obj, sys.exc_info()))
+            else:
+                results.put(("prepare", obj, None))
+
+    ############################################################################
+    def run(self, objects, action, prepare = None, prepareJobs = 1, keepGoing = False):
+        """
+
+        Call `action(obj, jobs, jobserver)` for every object, in dependency
+        order: `obj` holds `jobs` slots, and its make takes more from
+        `jobserver` (None: it must stay within `jobs`, see _getShare()).
+        Ready objects start by priority, then in `objects` order.
+
+        `prepare(obj)`, if given, is called first for every object by
+        `prepareJobs` other threads, regardless of the dependencies and of
+        the job budget (eg. fetching and extracting the sources while
+        other objects build): an object starts once it is prepared and its
+        dependencies are done.
+
+        On error, the objects depending on the failed one are cancelled.
+        With `keepGoing`, everything else still runs, and a SchedulerError
+        listing the failed and cancelled objects is raised at the end.
+        Otherwise, no new object is started, the running ones are waited
+        for, and the first error is raised again.
+
+        On KeyboardInterrupt, the running commands are killed
+        (see runner.terminateAll()).
+        """
+        selected = set(objects)
+        dependencies = {}
+        dependents = dict([ (obj, []) for obj in objects ])
+        for obj in objects:
+            dependencies[obj] = [ dep for dep in self.resolve(obj)
+                                  if dep in selected and dep is not obj ]
+            for dep in dependencies[obj]:
+                dependents[dep].append(obj)
+
+        priorities = self._getPriorities(objects, dependencies)
+        memory = {}
+        if self.history:
+            memory = dict([ (obj, self.history.getMemory(obj) or 0.0) for obj in objects ])
+
+        pending   = sorted(objects, key = lambda obj: -priorities[obj])
+        done      = set()
+        running   = {}
+        errors    = []
+        failed    = []
+        cancelled = []
+        results   = Queue.Queue()
+        stopping  = threading.Event()
+
+        def worker(obj, jobs, jobserver):
+            try:
+                action(obj, jobs, jobserver)
+            except:
+                results.put(("action", obj, sys.exc_info()))
+            else:
+                results.put(("action", obj, None))
+
+        def cancel(obj):
+            stack = list(dependents[obj])
+            while stack:
+                other = stack.pop()
+                if other in pending:
+                    pending.remove(other)
+                    cancelled.append(other)
+                    logger.error("Cancelling %s: %s failed." % (other, obj))
+                    stack.extend(dependents[other])
+
+        preparing = set()
+        if prepare:
+            tasks = Queue.Queue()
+            for obj in pending:
+                tasks.put(obj)
+            preparing.update(pending)
+            for i in range(max(1, min(prepareJobs, len(pending)))):
+                thread = threading.Thread(target = self._prepare, args = (tasks, prepare, results, stopping),
+                                          name = "prepare-%d" % (i + 1, ))
+                thread.daemon = True
+                thread.start()
+
+        try:
+            while pending or running:
+                ## Ready objects left waiting for a slot (held by other schedulers, or by makes)
+                starved = False
+                if not errors or keepGoing:
+                    ready = [ obj for obj in pending if obj not in preparing and
+                              not [ dep for dep in dependencies[obj] if dep not in done ] ]
+                    ## Objects still waiting for their dependencies don't count
+                    waiting = len(ready) + len(running)
+                    for obj in ready:
+                        ## Memory hungry builds wait for the others, unless nothing runs
+                        used = sum([ memory.get(other, 0.0) for other in running ])
+                        if self.memory and running and used + memory.get(obj, 0.0) > self.memory:
+                            continue
+                        wanted, shared = self._getShare(obj, waiting)
+                        jobs = self.jobserver.acquire(wanted)
+                        if not jobs:
+                            starved = True
+                            break
+                        pending.remove(obj)
+                        thread = threading.Thread(target = worker, args = (obj, jobs, shared and self.jobserver or None),
+                                                  name = obj.name)
+                        thread.daemon = True
+                        running[obj] = jobs
+                        thread.start()
+
+                    if not running and not preparing and pending and not ready:
+                        raise SchedulerError("Unable to schedule %s: circular dependencies." % (
+                            ", ".join([ obj.name for obj in pending ])))
+
+                if not running and (errors and not keepGoing or not preparing and not pending):
+                    break
+
+                ## A timeout, so that KeyboardInterrupt still reaches us; a short
+                ## one when waiting for slots, which come back without a result
+                try:
+                    kind, obj, error = results.get(timeout = starved and 0.1 or 1)
+                except Queue.Empty:
+                    continue
+
+                if kind == "prepare":
+                    preparing.discard(obj)
+                else:
+                    self.jobserver.release(running.pop(obj))
+                if error:
+                    logger.error("Building %s failed: %s" % (obj, error[1]))
+                    errors.append(error)
+                    failed.append(obj)
+                    if obj in pending:
+                        pending.remove(obj)
+                    cancel(obj)
+                    if not keepGoing:
+                        stopping.set()
+                elif kind == "action":
+                    done.add(obj)
+        except KeyboardInterrupt:
+            stopping.set()
+            logger.error("Interrupted, killing the running commands...")
+            runner.terminateAll()
+            raise
+        stopping.set()
+
+        if errors and keepGoing:
+            raise SchedulerError("%d objects failed (%s), %d cancelled (%s)." % (
+                len(failed), ", ".join([ "%s" % (obj, ) for obj in failed ]),
+                len(cancelled), ", ".join([ "%s" % (obj, ) for obj in cancelled ])))
+        if errors:
+            exc_type, exc_value, exc_tb = errors[0]
+            raise exc_type, exc_value, exc_tb
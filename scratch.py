@@ -0,0 +1,205 @@
+import os
+import os.path
+import shutil
+import hashlib
+import threading
+
+import logging
+logger = logging.getLogger("builder")
+
+## File systems whose pages are memory
+MEMORY_FILESYSTEMS = ("tmpfs", "ramfs")
+
+
+################################################################################
+def getTreeSize(path):
+    """
+
+    Disk usage of the tree at `path`, in bytes.
+    """
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames + dirnames:
+            try:
+                size += os.lstat(os.path.join(dirpath, name)).st_blocks * 512
+            except OSError:
+                pass
+    return size
+
+################################################################################
+def makeWritable(path):
+    """
+
+    Give the owner write access to the tree at `path` (eg. pristine
+    sources, see AbstractBuildObject.extract()).
+    """
+    os.chmod(path, os.stat(path).st_mode | 0200)
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames + dirnames:
+            filename = os.path.join(dirpath, name)
+            if not os.path.islink(filename):
+                os.chmod(filename, os.stat(filename).st_mode | 0200)
+
+################################################################################
+def removeTree(path):
+    """
+
+    shutil.rmtree(), read-only directories included.
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        makeWritable(path)
+    shutil.rmtree(path, ignore_errors = True)
+
+################################################################################
+def getAvailableMemory():
+    """
+
+    MemAvailable of /proc/meminfo in bytes, None if unknown.
+    """
+    try:
+        f = open("/proc/meminfo", "r")
+    except IOError:
+        return None
+    try:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    finally:
+        f.close()
+    return None
+
+################################################################################
+def getFilesystemType(path):
+    """
+
+    Type of the file system `path` is on, from /proc/mounts.
+    """
+    path = os.path.realpath(path)
+    best, fstype = "", None
+    try:
+        f = open("/proc/mounts", "r")
+    except IOError:
+        return None
+    try:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 3:
+                continue
+            mountpoint = fields[1].replace("\\040", " ")
+            if (path == mountpoint or path.startswith(mountpoint.rstrip("/") + "/")) and len(mountpoint) >= len(best):
+                best, fstype = mountpoint, fields[2]
+    finally:
+        f.close()
+    return fstype
+
+
+################################################################################
+class ScratchSpace(object):
+    """
+
+    A fast directory (tmpfs, local disk...) for the build trees of the
+    packages which fit: the tree is extracted there, and linked from the
+    build root. Trees are placed by expected size, leaving `reserve`
+    bytes free; on a memory file system, the available memory counts too.
+
+    Trees go back to the build root if memory gets tight (spill()), and
+    are removed once installed (release()): only the installed files and
+    the stamps are kept.
+    """
+
+    ############################################################################
+    def __init__(self, directory, buildroot, reserve):
+        ## One directory per build root: several builders can share the space
+        self.directory  = os.path.join(directory, hashlib.sha1(os.path.abspath(buildroot)).hexdigest()[:12])
+        self.reserve    = reserve
+        self.memory     = getFilesystemType(directory) in MEMORY_FILESYSTEMS
+        ## Source path -> expected growth of the trees being built
+        self._growth    = {}
+        self._lock      = threading.Lock()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    ############################################################################
+    def getFree(self):
+        """
+
+        Bytes we can still use.
+        """
+        stat = os.statvfs(self.directory)
+        free = stat.f_bavail * stat.f_frsize
+        if self.memory:
+            available = getAvailableMemory()
+            if available is not None:
+                free = min(free, available)
+        return free - sum(self._growth.values())
+
+    ############################################################################
+    def isTight(self):
+        return self.memory and self.getFree() < self.reserve
+
+    ############################################################################
+    def getPath(self, sourcePath):
+        return os.path.join(self.directory, os.path.basename(sourcePath))
+
+    ############################################################################
+    def place(self, sourcePath, size):
+        """
+
+        Where to extract the tree of `sourcePath`, expected to grow to
+        `size` bytes: in the scratch space if it fits, None otherwise.
+        """
+        self._lock.acquire()
+        try:
+            if self.getFree() - size < self.reserve:
+                logger.info("%s (%d MB) doesn't fit in %s" % (sourcePath, size >> 20, self.directory))
+                return None
+            self._growth[sourcePath] = size
+        finally:
+            self._lock.release()
+        path = self.getPath(sourcePath)
+        removeTree(path)
+        return path
+
+    ############################################################################
+    def settle(self, sourcePath):
+        """
+
+        The tree of `sourcePath` is built: its size is known to the file system.
+        """
+        self._lock.acquire()
+        try:
+            self._growth.pop(sourcePath, None)
+        finally:
+            self._lock.release()
+
+    ############################################################################
+    def isPlaced(self, sourcePath):
+        return os.path.islink(sourcePath) and \
+               os.path.dirname(os.readlink(sourcePath)) == self.directory
+
+    ############################################################################
+    def spill(self, sourcePath):
+        """
+
+        Move the tree of `sourcePath` back to the build root.
+        """
+        path = os.readlink(sourcePath)
+        logger.warning("Memory is tight: moving %s back to %s" % (path, sourcePath))
+        tmpname = "%s.%d.tmp" % (sourcePath, os.getpid())
+        removeTree(tmpname)
+        shutil.copytree(path, tmpname, symlinks = True)
+        os.unlink(sourcePath)
+        os.rename(tmpname, sourcePath)
+        removeTree(path)
+        self.settle(sourcePath)
+
+    ############################################################################
+    def release(self, sourcePath):
+        """
+
+        Remove the tree of `sourcePath`, and its link.
+        """
+        path = os.readlink(sourcePath)
+        os.unlink(sourcePath)
+        removeTree(path)
+        self.settle(sourcePath)
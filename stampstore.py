@@ -0,0 +1,136 @@
+import os
+import os.path
+import json
+import datetime
+import threading
+
+from util import writeJSON
+
+import logging
+logger = logging.getLogger("builder")
+
+
+################################################################################
+class StampStore(object):
+    """
+
+    State of every stamp (.patched, .configured, .built, .installed...)
+    of a build root, in a single JSON manifest.
+
+    The manifest is read once; queries never touch the disk, and every
+    update rewrites it atomically (temporary file + rename).
+    Stamps are identified by their path, relative to the build root.
+    """
+
+    ############################################################################
+    def __init__(self, filename):
+        self.filename   = filename
+        self._stamps    = {}
+        self._lock      = threading.RLock()
+        ## Manifest reads and writes, and bytes written (see benchmark.py)
+        self.loads      = 0
+        self.saves      = 0
+        self.written    = 0
+        ## True if there was no usable manifest: stamps must be reconciled
+        self.isNew      = not self.load()
+
+    ############################################################################
+    def load(self):
+        try:
+            f = open(self.filename, "r")
+        except IOError:
+            return False
+
+        self.loads += 1
+        try:
+            try:
+                self._stamps = json.load(f)
+            except ValueError, err:
+                logger.warning("Ignoring corrupted stamp manifest %s: %s" % (self.filename, err))
+                self._stamps = {}
+                return False
+        finally:
+            f.close()
+        return True
+
+    ############################################################################
+    def save(self):
+        self._lock.acquire()
+        try:
+            self.written += writeJSON(self.filename, self._stamps)
+            self.saves += 1
+        finally:
+            self._lock.release()
+
+    ############################################################################
+    def has(self, path):
+        return path in self._stamps
+
+    ############################################################################
+    def get(self, path):
+        return self._stamps.get(path)
+
+    ############################################################################
+    def set(self, path, ok = True, value = None):
+        """
+
+        Set (or remove, if not `ok`) a stamp. Its value is the current
+        time, unless another one is given.
+        """
+        self._lock.acquire()
+        try:
+            if ok:
+                self._stamps[path] = value or "%s" % (datetime.datetime.now())
+            elif path in self._stamps:
+                del self._stamps[path]
+            else:
+                return
+            self.save()
+        finally:
+            self._lock.release()
+
+    ############################################################################
+    def discard(self, directory):
+        """
+
+        Forget every stamp below `directory` (relative to the build root).
+        """
+        self._lock.acquire()
+        try:
+            prefix = directory.rstrip(os.sep) + os.sep
+            paths = [ path for path in self._stamps if path.startswith(prefix) ]
+            for path in paths:
+                del self._stamps[path]
+            if paths:
+                self.save()
+        finally:
+            self._lock.release()
+
+    ############################################################################
+    def reconcile(self, buildroot, paths, save = True):
+        """
+
+        Check the stamps of `paths` against the stamp files found on disk,
+        which are authoritative. Returns the list of fixed up paths. Unless
+        `save`, the manifest is not written, and stays new.
+        """
+        self._lock.acquire()
+        try:
+            changed = []
+            for path in paths:
+                ondisk = os.path.isfile(os.path.join(buildroot, path))
+                if ondisk != self.has(path):
+                    changed.append(path)
+                    if ondisk:
+                        self._stamps[path] = "%s" % (datetime.datetime.fromtimestamp(
+                            os.path.getmtime(os.path.join(buildroot, path))))
+                    else:
+                        del self._stamps[path]
+            if not save:
+                return changed
+            if changed or self.isNew:
+                self.save()
+            self.isNew = False
+            return changed
+        finally:
+            self._lock.release()
@@ -0,0 +1,40 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from manifest import Manifest, ManifestError
+
+DECLARATIONS = [
+    { "class": "ComplexBuildObject", "name": "zlib", "set": "full", "dependencies": [] },
+    { "class": "ComplexBuildObject", "name": "Python", "set": "full", "dependencies": [ "zlib" ] },
+    { "class": "ComplexBuildObject", "name": "qt", "dependencies": [] },
+]
+
+
+################################################################################
+class ManifestTest(unittest.TestCase):
+
+    ############################################################################
+    def getNames(self, declarations):
+        return [ declaration["name"] for declaration in declarations ]
+
+    ############################################################################
+    def testSets(self):
+        self.assertEqual(self.getNames(Manifest(DECLARATIONS).getSelected()), [ "qt" ])
+        self.assertEqual(self.getNames(Manifest(DECLARATIONS, [ "full" ]).getSelected()),
+                         [ "zlib", "Python", "qt" ])
+
+    ############################################################################
+    def testNamedOutOfSet(self):
+        """
+
+        Sets only select what "all" is: a named object is found anyway.
+        """
+        manifest = Manifest(DECLARATIONS)
+        self.assertEqual(self.getNames(manifest.getClosure([ "Python" ])), [ "zlib", "Python" ])
+        self.assertRaises(ManifestError, manifest.getClosure, [ "nope" ])
+
+
+if __name__ == "__main__":
+    unittest.main()
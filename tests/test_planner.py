@@ -0,0 +1,157 @@
+import os
+import sys
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+import builder
+from buildobj import AbstractBuildObject, SimpleBuildObject
+
+## An autoconf-looking package: installs share/<name>.txt
+CONFIGURE = """#!/bin/sh
+prefix=/usr/local
+for a in "$@"; do case $a in --prefix=*) prefix=${a#--prefix=};; esac; done
+sed "s|@PREFIX@|$prefix|" Makefile.in > Makefile
+"""
+MAKEFILE = """PREFIX=@PREFIX@
+all:
+\tcat version.txt > out.txt
+install:
+\tmkdir -p $(DESTDIR)$(PREFIX)/share
+\tcp out.txt $(DESTDIR)$(PREFIX)/share/%s.txt
+"""
+PATCH = """--- version.txt
++++ version.txt
+@@ -1 +1 @@
+-1.0
++%s
+"""
+
+
+################################################################################
+class PlanTest(unittest.TestCase):
+    """
+
+    What the planner predicts is what the builder does.
+    """
+
+    ############################################################################
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix = "test_planner-")
+        self.saved = dict([ (name, getattr(config, name)) for name in
+                            ("PREFIX", "MIRROR", "CCACHE", "DASHBOARD", "VERBOSE", "CONFIGURE_CACHE") ])
+        config.PREFIX = os.path.join(self.directory, "prefix")
+        config.MIRROR = []
+        config.CCACHE = False
+        config.DASHBOARD = False
+        config.VERBOSE = False
+        config.CONFIGURE_CACHE = False
+
+        self.distfiles = os.path.join(self.directory, "distfiles")
+        os.makedirs(self.distfiles)
+        for name in ("a", "b", "c"):
+            self.makeDistFile(name)
+        self.writePatch("1.1")
+
+    ############################################################################
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(config, name, value)
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+    ############################################################################
+    def makeDistFile(self, name):
+        tree = os.path.join(self.directory, "src", "%s-1.0" % (name, ))
+        os.makedirs(tree)
+        for filename, data in (("configure", CONFIGURE), ("Makefile.in", MAKEFILE % (name, )),
+                               ("version.txt", "1.0\n")):
+            f = open(os.path.join(tree, filename), "w")
+            f.write(data)
+            f.close()
+        os.chmod(os.path.join(tree, "configure"), 0755)
+        archive = tarfile.open(os.path.join(self.distfiles, "%s-1.0.tar.gz" % (name, )), "w:gz")
+        archive.add(tree, arcname = "%s-1.0" % (name, ))
+        archive.close()
+
+    ############################################################################
+    def writePatch(self, version):
+        f = open(os.path.join(self.distfiles, "a.patch"), "w")
+        f.write(PATCH % (version, ))
+        f.close()
+
+    ############################################################################
+    def getBuilder(self):
+        """
+
+        A new builder (a new run) of c -> b -> a.
+        """
+        result = builder.Builder(buildroot = os.path.join(self.directory, "buildroot"),
+                                 distfiles = self.distfiles, jobs = 2)
+        AbstractBuildObject.setBuilder(result)
+        SimpleBuildObject("a", version = "1.0", filename = "a-1.0.tar.gz", patch = "a.patch")
+        SimpleBuildObject("b", version = "1.0", filename = "b-1.0.tar.gz", dependencies = [ "a" ])
+        SimpleBuildObject("c", version = "1.0", filename = "c-1.0.tar.gz", dependencies = [ "b" ])
+        return result
+
+    ############################################################################
+    def assertPlanRuns(self):
+        """
+
+        Plan a build, run it, and compare: the objects of the plan are the
+        ones done again, those planned with a build the ones rebuilt.
+        Returns the plan as { name: phases }.
+        """
+        plan = self.getBuilder().build(dryrun = True)
+        run = self.getBuilder()
+        run.build()
+        done = set([ span.name for span in run.profiler.spans if span.phase in ("install", "restore", "import") ])
+        planned = dict([ (step.obj.getQualifiedName(), step.phases) for step in plan.steps ])
+        self.assertEqual(set(planned), done)
+        self.assertEqual(set([ name for name, phases in planned.items() if "build" in phases ]),
+                         set([ obj.getQualifiedName() for obj in run._rebuilt ]))
+        self.assertEqual(run.plan(run.builds).steps, [])
+        return planned
+
+    ############################################################################
+    def testFirstBuild(self):
+        planned = self.assertPlanRuns()
+        self.assertEqual(sorted(planned), [ "a", "b", "c" ])
+
+    ############################################################################
+    def testDryRun(self):
+        """
+
+        A dry run writes nothing, and the plan is no package.
+        """
+        run = self.getBuilder()
+        run.build(dryrun = True)
+        self.assertFalse(os.path.exists(run.stamps.filename))
+        self.assertTrue(run.stamps.isNew)
+        self.assertEqual(run.profiler.getTotals(), {})
+
+    ############################################################################
+    def testReinstall(self):
+        """
+
+        A dependency installed again (from the build cache), not rebuilt:
+        its dependents are up to date.
+        """
+        self.assertPlanRuns()
+        run = self.getBuilder()
+        run.findObjects("a")[0]._setInstallOk(False)
+        self.assertEqual(self.assertPlanRuns(), { "a": [ "restore" ] })
+
+    ############################################################################
+    def testChangedPatch(self):
+        self.assertPlanRuns()
+        self.writePatch("1.2")
+        planned = self.assertPlanRuns()
+        self.assertEqual(sorted(planned), [ "a", "b", "c" ])
+        self.assertTrue("patch" in planned["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
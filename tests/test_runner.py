@@ -0,0 +1,38 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import runner
+
+
+################################################################################
+class CommandTest(unittest.TestCase):
+
+    ############################################################################
+    def testLargeOutput(self):
+        """
+
+        20 MB of output (verbose compiles) must not be read a byte at a time.
+        """
+        command = runner.Command("head -c 20000000 /dev/zero | tr '\\0' x | fold -w 100", tail = 3)
+        start = time.time()
+        self.assertEqual(command.run(), 0)
+        self.assertTrue(time.time() - start < 3.0, "%.1fs for 20 MB" % (time.time() - start))
+        self.assertEqual([ line.rstrip("\n") for line in command.stdout ], [ "x" * 100 ] * 3)
+
+    ############################################################################
+    def testLinesAsTheyCome(self):
+        lines = []
+        class Echo(object):
+            def write(self, line):
+                lines.append((time.time(), line))
+        start = time.time()
+        runner.Command("echo a; sleep 1; echo b", echo = Echo()).run()
+        self.assertEqual([ line for when, line in lines ], [ "a\n", "b\n" ])
+        self.assertTrue(lines[0][0] - start < 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import os
+import json
+import threading
+
+
+################################################################################
+def writeFile(filename, data):
+    """
+
+    Replace `filename` by `data` atomically: written next to it, then
+    renamed over it. Readers see the old content or the new one, never
+    a partial file. Returns the number of bytes written.
+    """
+    tmpname = "%s.%d.%s.tmp" % (filename, os.getpid(), threading.current_thread().ident)
+    f = open(tmpname, "w")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    os.rename(tmpname, filename)
+    return len(data)
+
+################################################################################
+def writeJSON(filename, value, indent = 1):
+    """
+
+    writeFile() of `value` as JSON, keys sorted (or compact, without `indent`).
+    """
+    if indent is None:
+        return writeFile(filename, json.dumps(value))
+    return writeFile(filename, json.dumps(value, indent = indent, sort_keys = True))